@@ -0,0 +1,209 @@
+# # aggregateViews
+# Article counts per publication day, per source and per query, kept up to date as the crawl writes articles instead of recomputed by scanning the store. One table holds the count for every `(databaseindex, originalquery, day, publication)` cell; the per-day, per-source and per-query views are sums over it.
+#
+# Counts are of distinct documents, so they stay correct however articles reach the store: a document found by several parts of a split query, by a repair crawl, or written again by a rerun is counted once per query. When articles carry a near-duplicate `cluster` (see `nearDuplicates.py`), each cell also counts `stories`: the clusters whose first article in the query fell in that cell.
+#
+# The views of a store are kept beside it (`articles.aggregates.pickle` for `articles.jsonl`) together with how far into the store they have counted. `JsonWriterPipeline` brings them up to date with anything the store gained since they were saved (a crashed run, a store edited by hand) before it counts new articles, and saves them when the crawl ends. Views of several stores, say shards crawled on different machines, merge into one without counting any document twice.
+#
+# Usage: `python aggregateViews.py biden/data/articles.jsonl [more stores...] [--by day source query] [--query TEXT] [--save merged.pickle]`
+
+# +
+import os
+import sys
+import json
+import pickle
+import argparse
+
+import numpy as np
+
+from extractArticles import documentId
+from articleIndex import documentKey
+from infoParser import parseInfo
+
+dimensions = ('query', 'day', 'source')
+# -
+
+# ## The Views
+# For every query the views remember which documents they have counted and the cell each was counted in, which is what lets a merge or a rerun tell a new document from one already counted, and which clusters they have counted and the document that brought each in. Documents and clusters are kept as 64-bit keys (`articleIndex.documentKey`) in sorted arrays, so the views take about 12 bytes per document rather than a dictionary entry; what was counted since they were loaded is merged into the arrays when they are saved.
+
+# +
+class CountedKeys(object):
+
+    def __init__(self, dtype=np.uint32):
+        self.keys = np.zeros(0, dtype=np.uint64) # sorted
+        self.values = np.zeros(0, dtype=dtype) # what each key was counted with
+        self.added = {} # key -> value, counted since the arrays were last merged
+
+    def __len__(self):
+        return len(self.keys) + len(self.added)
+
+    def __contains__(self, key):
+        if key in self.added:
+            return True
+        position = np.searchsorted(self.keys, np.uint64(key))
+        return position < len(self.keys) and int(self.keys[position]) == key
+
+    def add(self, key, value):
+        self.added[key] = value
+
+    def items(self):
+        yield from zip(self.keys.tolist(), self.values.tolist())
+        yield from self.added.items()
+
+    # merges what was added into the sorted arrays
+    def fold(self):
+        if not self.added:
+            return
+        keys = np.fromiter(self.added.keys(), dtype=np.uint64, count=len(self.added))
+        values = np.fromiter(self.added.values(), dtype=self.values.dtype, count=len(self.added))
+        order = np.argsort(keys)
+        positions = np.searchsorted(self.keys, keys[order])
+        self.keys, self.values = np.insert(self.keys, positions, keys[order]), np.insert(self.values, positions, values[order])
+        self.added = {}
+
+class AggregateViews(object):
+
+    def __init__(self):
+        self.counts = {} # (databaseindex, originalquery, day, publication) -> [articles, stories]
+        self.cells = [] # every cell counted, by cell id
+        self.cellids = {} # cell -> cell id
+        self.documents = {} # (databaseindex, originalquery) -> CountedKeys of document -> cell id
+        self.clusters = {} # (databaseindex, originalquery) -> CountedKeys of cluster -> document that brought it in
+        self.store = None # (path, inode) of the store counted
+        self.offset = 0 # bytes of the store counted so far
+
+    def __len__(self):
+        return sum(len(documents) for documents in self.documents.values())
+
+    def add(self, record):
+        query = (record.get('databaseindex', 0), record['originalquery'])
+        if 'published' in record and 'publication' in record:
+            day, publication = record['published'], record['publication']
+        else: # stored before info was parsed during the crawl
+            parsed = parseInfo(record.get('info') or '')
+            day, publication = parsed['published'], parsed['publication']
+        return self.count(query, documentId(record['link']), query + (day, publication), record.get('cluster'))
+
+    def cellid(self, cell):
+        if cell not in self.cellids:
+            self.cellids[cell] = len(self.cells)
+            self.cells.append(cell)
+        return self.cellids[cell]
+
+    def count(self, query, document, cell, cluster=None):
+        return self.countKeys(query, documentKey(document), cell, None if cluster is None else documentKey(cluster))
+
+    # counts a document (and the story of its cluster, if that's new) in `cell`, unless the query has it already
+    def countKeys(self, query, document, cell, cluster=None):
+        documents = self.documents.setdefault(query, CountedKeys(np.uint32))
+        if document in documents:
+            return False
+        documents.add(document, self.cellid(cell))
+        counts = self.counts.setdefault(cell, [0, 0])
+        counts[0] += 1
+        if cluster is not None:
+            clusters = self.clusters.setdefault(query, CountedKeys(np.uint64))
+            if cluster not in clusters:
+                clusters.add(cluster, document)
+                counts[1] += 1
+        return True
+
+    # counts everything in `other` that isn't counted here already; a cluster of `other` is counted with the document that brought it in
+    def merge(self, other):
+        for query, documents in other.documents.items():
+            brought = {document: cluster for cluster, document in other.clusters[query].items()} if query in other.clusters else {}
+            for document, cell in documents.items():
+                self.countKeys(query, document, other.cells[cell], brought.get(document))
+        return self
+
+    # totals grouped by any of `dimensions`, optionally for queries containing `query`
+    def view(self, by=('day',), query=None):
+        totals = {}
+        for (databaseindex, originalquery, day, publication), (articles, stories) in self.counts.items():
+            if query is not None and query not in originalquery:
+                continue
+            values = {'query': (databaseindex, originalquery), 'day': day, 'source': publication}
+            key = tuple(values[dimension] for dimension in by)
+            total = totals.setdefault(key, [0, 0])
+            total[0] += articles
+            total[1] += stories
+        return sorted(((key, articles, stories) for key, (articles, stories) in totals.items()),
+                      key=lambda row: tuple('' if value is None else str(value) for value in row[0]))
+
+    # counts whatever was added to the store since the views last saw it; a store that was replaced (say, rewritten
+    # by `infoParser.py`) or shrank is counted again from scratch
+    def sync(self, path):
+        if not os.path.exists(path):
+            return 0
+        stat = os.stat(path)
+        store = (os.path.abspath(path), stat.st_ino)
+        if self.store != store or stat.st_size < self.offset:
+            self.__init__()
+        self.store = store
+        added = 0
+        with open(path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break # a record still being written
+                self.offset += len(line)
+                if line.strip():
+                    added += self.add(json.loads(line))
+        return added
+
+    # records that everything in the store at `path` has been counted, by `add` as it was written
+    def caughtUp(self, path):
+        self.store = (os.path.abspath(path), os.stat(path).st_ino)
+        self.offset = os.path.getsize(path)
+
+    def save(self, path):
+        for table in (self.documents, self.clusters):
+            for counted in table.values():
+                counted.fold()
+        with open(path + '.saving', 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.saving', path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+def viewsPath(store):
+    return os.path.splitext(store)[0] + '.aggregates.pickle'
+
+# the views of a store, loaded from beside it if they were saved before, and brought up to date with it
+def openViews(store):
+    path = viewsPath(store)
+    views = AggregateViews.load(path) if os.path.exists(path) else AggregateViews()
+    views.sync(store)
+    return views
+
+
+# -
+
+# ## Command Line
+# Brings the views of each store up to date, merges them, and prints the totals. The views saved beside a store are read but not rewritten: the crawl keeps them current.
+
+# +
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Count articles per day, source and query.')
+    args.add_argument('stores', nargs='+', help='articles.jsonl stores (shards of one dataset are merged)')
+    args.add_argument('--by', nargs='+', choices=dimensions, default=['day'], help='what to total by')
+    args.add_argument('--query', help='only count queries containing this text')
+    args.add_argument('--save', help='also save the merged views here')
+    args = args.parse_args(argv)
+
+    merged = AggregateViews()
+    for store in args.stores:
+        merged.merge(openViews(store))
+    if args.save:
+        merged.save(args.save)
+
+    print('\t'.join(args.by + ['articles', 'stories']))
+    for key, articles, stories in merged.view(args.by, args.query):
+        print('\t'.join([str(value) for value in key] + [str(articles), str(stories)]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+# # articleIndex
+# Looks records up in an `articles.jsonl` store without reading it all in. The store is memory-mapped, and a sorted index kept beside it (`articles.index/` for `articles.jsonl`) gives the byte range of every record by two keys:
+# - its ProQuest document id (`documentId(link)`), under which a document found by several queries has several records
+# - its search, `(databaseindex, originalquery, querypart)`, and `searchindex`, under which a search's records are in order, so any run of search indices is one contiguous slice of the index
+#
+# A lookup is a binary search of the index followed by a read of one record's bytes, and a range scan walks a slice of the index, handing back each record's bytes as a view of the mapped file. The index files are `numpy` arrays that are themselves memory-mapped, so opening a large index costs next to nothing.
+#
+# The index remembers how much of the store it covers. `update` indexes only what was appended since (`JsonWriterPipeline` calls it when the crawl ends); records appended after the last update are still found, from a small in-memory index of the tail built when the store is opened.
+#
+# Usage: `python articleIndex.py biden/data/articles.jsonl [--document 2397065549] [--search QUERY FIRST [LAST]] [--part N] [--databaseindex N]`
+
+# +
+import os
+import sys
+import json
+import mmap
+import hashlib
+import argparse
+
+import numpy as np
+
+from extractArticles import documentId
+
+documentdtype = np.dtype([('key', '<u8'), ('offset', '<u8'), ('length', '<u4')])
+searchdtype = np.dtype([('search', '<u8'), ('searchindex', '<u8'), ('offset', '<u8'), ('length', '<u4')])
+# -
+
+# ## Keys
+# Both indices sort on 64-bit integers. Numeric document ids are their own key; anything else (a link without a document id) and every search is hashed, with the top bit set so hashes and ids can't meet. Hashes can collide, so a document lookup checks the records it finds before returning them. The index also keeps the searches filed under each search key (`searches.json`), so a scan checks its search once rather than reading every record it finds, and only reads records when two searches share a key.
+
+# +
+def hashKey(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little') | (1 << 63)
+
+def documentKey(document):
+    document = str(document)
+    return int(document) if document.isdigit() and int(document) < (1 << 63) else hashKey(document)
+
+def searchKey(databaseindex, originalquery, querypart=0):
+    return hashKey(json.dumps([int(databaseindex), originalquery, int(querypart)]))
+
+def recordSearch(record):
+    return (record.get('databaseindex', 0), record['originalquery'], record.get('querypart', 0))
+
+# index entries for the records in store[start:end], sorted, and the searches under each search key
+def indexRange(path, start, end):
+    documents, searches, names = [], [], {}
+    with open(path, 'rb') as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if offset + len(line) > end or not line.endswith(b'\n'):
+                break # past what was asked for, or a record still being written
+            if line.strip():
+                record = json.loads(line)
+                documents.append((documentKey(documentId(record['link'])), offset, len(line)))
+                search = recordSearch(record)
+                searches.append((searchKey(*search), int(record['searchindex']), offset, len(line)))
+                names.setdefault(searches[-1][0], set()).add(search)
+            offset += len(line)
+    return sortDocuments(columns(np.array(documents, dtype=documentdtype))), sortSearches(columns(np.array(searches, dtype=searchdtype))), names, offset
+
+# an index is kept as one contiguous array per field, which is what binary search needs to run without copying
+def columns(array):
+    return {field: np.ascontiguousarray(array[field]) for field in array.dtype.names}
+
+def sortDocuments(index):
+    order = np.argsort(index['key'], kind='stable')
+    return {field: column[order] for field, column in index.items()}
+
+def sortSearches(index):
+    order = np.lexsort((index['searchindex'], index['search']))
+    return {field: column[order] for field, column in index.items()}
+
+# a sorted index with a sorted tail merged in at `positions`, the tail's entries after saved ones with the same key
+def insert(index, tail, positions):
+    return {field: np.insert(index[field], positions, tail[field]) for field in index}
+
+def documentPositions(index, tail):
+    return np.searchsorted(index['key'], tail['key'], side='right')
+
+# where each tail entry goes among the saved entries of its search, one search at a time (the tail is sorted by search)
+def searchPositions(index, tail):
+    positions = np.searchsorted(index['search'], tail['search'], side='right')
+    searches, starts = np.unique(tail['search'], return_index=True)
+    ends = np.append(starts[1:], len(tail['search']))
+    for search, start, end in zip(searches, starts, ends):
+        low, high = np.searchsorted(index['search'], search, side='left'), np.searchsorted(index['search'], search, side='right')
+        if low < high:
+            positions[start:end] = low + np.searchsorted(index['searchindex'][low:high], tail['searchindex'][start:end], side='right')
+    return positions
+
+
+# -
+
+# ## The Index
+
+# +
+class ArticleIndex(object):
+
+    def __init__(self, store):
+        self.store = os.path.abspath(store)
+        self.path = os.path.splitext(self.store)[0] + '.index'
+        self.map = None
+        self.open()
+
+    def metapath(self):
+        return os.path.join(self.path, 'meta.json')
+
+    def columnpath(self, name, field):
+        return os.path.join(self.path, '{}.{}.npy'.format(name, field))
+
+    def namespath(self):
+        return os.path.join(self.path, 'searches.json')
+
+    # maps the store and the saved index, and indexes whatever the saved index doesn't cover in memory
+    def open(self):
+        self.close()
+        meta = None
+        if os.path.exists(self.metapath()):
+            with open(self.metapath(), encoding='utf-8') as f:
+                meta = json.load(f)
+        stat = os.stat(self.store)
+        if meta is not None and meta['inode'] == stat.st_ino and meta['covered'] <= stat.st_size:
+            self.covered = meta['covered']
+            self.documents = {field: np.load(self.columnpath('documents', field), mmap_mode='r') for field in documentdtype.names}
+            self.searches = {field: np.load(self.columnpath('searches', field), mmap_mode='r') for field in searchdtype.names}
+            with open(self.namespath(), encoding='utf-8') as f:
+                self.names = {int(key): {tuple(search) for search in searches} for key, searches in json.load(f).items()}
+        else: # never indexed, or the store was replaced since
+            self.covered = 0
+            self.documents = columns(np.zeros(0, dtype=documentdtype))
+            self.searches = columns(np.zeros(0, dtype=searchdtype))
+            self.names = {}
+        self.size = stat.st_size
+        self.taildocuments, self.tailsearches, self.tailnames, self.tailend = indexRange(self.store, self.covered, self.size)
+        if self.size:
+            with open(self.store, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def __len__(self):
+        return len(self.documents['key']) + len(self.taildocuments['key'])
+
+    # whether records were appended since the store was opened
+    def stale(self):
+        return os.path.getsize(self.store) != self.size
+
+    # folds everything appended to the store into the saved index, merging the sorted tail in rather than sorting it all again
+    def update(self):
+        if self.stale():
+            self.open()
+        added = len(self.taildocuments['key'])
+        if not added:
+            return 0
+        documents = insert(self.documents, self.taildocuments, documentPositions(self.documents, self.taildocuments))
+        searches = insert(self.searches, self.tailsearches, searchPositions(self.searches, self.tailsearches))
+        names = {key: sorted(self.names.get(key, set()) | self.tailnames.get(key, set())) for key in set(self.names) | set(self.tailnames)}
+
+        self.close()
+        self.documents = self.searches = None # let go of the mapped index files before replacing them
+        os.makedirs(self.path, exist_ok=True)
+        for name, index in (('documents', documents), ('searches', searches)):
+            for field, column in index.items():
+                np.save(self.columnpath(name, field + '.saving'), column)
+                os.replace(self.columnpath(name, field + '.saving'), self.columnpath(name, field))
+        with open(self.namespath() + '.saving', 'w', encoding='utf-8') as f:
+            json.dump({str(key): searches for key, searches in names.items()}, f)
+        os.replace(self.namespath() + '.saving', self.namespath())
+        with open(self.metapath() + '.saving', 'w', encoding='utf-8') as f:
+            json.dump({'inode': os.stat(self.store).st_ino, 'covered': self.tailend}, f)
+        os.replace(self.metapath() + '.saving', self.metapath())
+        self.open()
+        return added
+
+    # the bytes of one record, as a view of the mapped store (release it before the index is closed or updated)
+    def raw(self, offset, length):
+        return memoryview(self.map)[int(offset):int(offset) + int(length)]
+
+    def record(self, offset, length):
+        return json.loads(self.raw(offset, length).tobytes())
+
+    # every record of a document, in the order they were stored
+    def document(self, document):
+        key = np.uint64(documentKey(document))
+        entries = []
+        for index in (self.documents, self.taildocuments):
+            first, last = np.searchsorted(index['key'], key, side='left'), np.searchsorted(index['key'], key, side='right')
+            entries.extend(zip(index['offset'][first:last].tolist(), index['length'][first:last].tolist()))
+        records = [self.record(offset, length) for offset, length in sorted(entries)]
+        return [record for record in records if documentId(record['link']) == str(document)]
+
+    # (searchindex, offset, length) of a search's records with first <= searchindex <= last, from one index
+    def searchSlice(self, index, search, first, last):
+        low, high = np.searchsorted(index['search'], search, side='left'), np.searchsorted(index['search'], search, side='right')
+        block = index['searchindex'][low:high]
+        first, last = low + np.searchsorted(block, np.uint64(first), side='left'), low + np.searchsorted(block, np.uint64(last), side='right')
+        return zip(index['searchindex'][first:last].tolist(), index['offset'][first:last].tolist(), index['length'][first:last].tolist())
+
+    # a search's records with first <= searchindex <= last, in searchindex order; raw=True gives views of their bytes.
+    # Records are only read to tell searches apart when another search shares the key.
+    def scan(self, originalquery, first=0, last=(1 << 63), databaseindex=0, querypart=0, raw=False):
+        key = searchKey(databaseindex, originalquery, querypart)
+        names = self.names.get(key, set()) | self.tailnames.get(key, set())
+        if (databaseindex, originalquery, querypart) not in names:
+            return
+        search = np.uint64(key)
+        entries = list(self.searchSlice(self.searches, search, first, last))
+        tail = list(self.searchSlice(self.tailsearches, search, first, last))
+        if tail:
+            entries = sorted(entries + tail, key=lambda entry: entry[0]) # stable, so stored order breaks ties
+        for searchindex, offset, length in entries:
+            if len(names) == 1:
+                yield self.raw(offset, length) if raw else self.record(offset, length)
+                continue
+            record = self.record(offset, length)
+            if recordSearch(record) == (databaseindex, originalquery, querypart):
+                yield self.raw(offset, length) if raw else record
+
+    def search(self, originalquery, searchindex, databaseindex=0, querypart=0):
+        for record in self.scan(originalquery, searchindex, searchindex, databaseindex, querypart):
+            return record
+        return None
+
+
+# -
+
+# ## Command Line
+# Brings the index of a store up to date and, optionally, prints the records asked for as JSON lines.
+
+# +
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Index an articles.jsonl store for random access, and look records up.')
+    args.add_argument('store', help='path to articles.jsonl')
+    args.add_argument('--document', action='append', default=[], help='print the records of this document id')
+    args.add_argument('--search', nargs='+', metavar=('QUERY', 'FIRST'), help='print records of QUERY with searchindex FIRST (to LAST)')
+    args.add_argument('--part', type=int, default=0, help='querypart of the search')
+    args.add_argument('--databaseindex', type=int, default=0, help='databaseindex of the search')
+    args = args.parse_args(argv)
+
+    index = ArticleIndex(args.store)
+    added = index.update()
+    print('{} records indexed ({} new)'.format(len(index), added), file=sys.stderr)
+    for document in args.document:
+        for record in index.document(document):
+            print(json.dumps(record))
+    if args.search:
+        first = int(args.search[1]) if len(args.search) > 1 else 0
+        last = int(args.search[2]) if len(args.search) > 2 else (first if len(args.search) > 1 else (1 << 63))
+        for record in index.scan(args.search[0], first, last, args.databaseindex, args.part):
+            print(json.dumps(record))
+    index.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
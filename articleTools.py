@@ -0,0 +1,102 @@
+# # articleTools
+# One command line for working with scraped data offline. `scrapeArticles.py` is a notebook: run as a script it imports Scrapy and Selenium, loads the whole store and starts a crawl. None of that is needed to count, check, export or index what has already been scraped, so each command here imports only the module that does its work, when it is run, and none of them goes near the network.
+#
+# Usage: `python articleTools.py COMMAND [arguments]`, e.g.
+# - `python articleTools.py stats biden/data/articles.jsonl --by source`
+# - `python articleTools.py verify biden/data/articles.jsonl`
+# - `python articleTools.py export biden/data/articles.jsonl --fields title published publication --unique > biden.csv`
+# - `python articleTools.py dedup biden/data/articles.jsonl`
+# - `python articleTools.py index biden/data/articles.jsonl --document 2397065549`
+# - `python articleTools.py compact biden/data/articles.jsonl host2/articles.jsonl`
+#
+# `python articleTools.py COMMAND --help` lists a command's own arguments.
+
+# +
+import sys
+import json
+import argparse
+import importlib
+
+# command -> (module whose main() runs it, or None for one defined here, and what it does)
+commands = {'stats': ('aggregateViews', 'article counts per day, source and query'),
+            'verify': ('verifyArticles', 'check a store for gaps and write repair jobs'),
+            'export': (None, 'write a store out as CSV or JSON lines'),
+            'dedup': ('nearDuplicates', 'cluster near-duplicate articles'),
+            'index': ('articleIndex', 'index a store for lookups, and look records up'),
+            'parse': ('infoParser', 'add the fields parsed from info to a store'),
+            'reextract': ('reextractArticles', 'rebuild a store from saved result pages'),
+            'plan': ('eventTable', 'plan the searches for an event dataset'),
+            'corpus': ('checkCorpus', 'check page extraction against the saved corpus'),
+            'estimate': ('resultSampling', 'estimate counts from a sampled crawl'),
+            'compact': ('compactArticles', 'merge stores into one sorted store without duplicates')}
+# -
+
+# ## Exporting
+# Streams the store and writes the chosen fields of every record (optionally only the first record of each document per query, as `queryCompiler.mergeParts` does) as CSV or JSON lines. Lists such as `authors` are joined with `'; '` in CSV.
+
+# +
+exportfields = ('databaseindex', 'originalquery', 'querypart', 'searchindex', 'title', 'authors', 'publication', 'published', 'link')
+
+def exportStore(path, out, fields=exportfields, format='csv', unique=False, query=None):
+    import csv
+    from queryCompiler import mergeParts
+
+    def records():
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if query is None or query in record['originalquery']:
+                        yield record
+
+    writer = None
+    if format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(fields)
+    count = 0
+    for record in (mergeParts(records()) if unique else records()):
+        if writer is None:
+            out.write(json.dumps({field: record.get(field) for field in fields}) + '\n')
+        else:
+            writer.writerow(['; '.join(value) if isinstance(value, list) else ('' if value is None else value)
+                             for value in (record.get(field) for field in fields)])
+        count += 1
+    return count
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Write an articles.jsonl store out as CSV or JSON lines.')
+    args.add_argument('store', help='path to articles.jsonl')
+    args.add_argument('--fields', nargs='+', default=list(exportfields), help='fields to write, in order')
+    args.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    args.add_argument('--unique', action='store_true', help='write each document once per query')
+    args.add_argument('--query', help='only queries containing this text')
+    args.add_argument('--output', help='write here instead of to standard output')
+    args = args.parse_args(argv)
+
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    count = exportStore(args.store, out, args.fields, args.format, args.unique, args.query)
+    if args.output:
+        out.close()
+    print('{} records exported'.format(count), file=sys.stderr)
+    return 0
+
+
+# -
+
+# ## Dispatching
+
+# +
+def run(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in commands:
+        print('usage: python articleTools.py COMMAND [arguments]\n\ncommands:', file=sys.stderr)
+        for command, (module, description) in commands.items():
+            print('  {:<10} {}'.format(command, description), file=sys.stderr)
+        return 0 if argv and argv[0] in ('-h', '--help') else 2
+
+    module, description = commands[argv[0]]
+    sys.argv[0] = 'articleTools.py ' + argv[0] # so the command's --help names it the way it was run
+    return (importlib.import_module(module).main if module else main)(argv[1:])
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -0,0 +1,274 @@
+# # asyncCrawler
+# The crawl of `scrapeArticles.py` without Scrapy, Twisted or Selenium, for running the scraper from asyncio code or as a library:
+#
+#     async for article in scrape('PD(20200501-20200502) AND ("biden")', d0, d1, cookies=cookies):
+#         ...
+#
+# It makes the same requests the spider does (the result page options, the search form, the search, then the result pages), reads pages with the same `extractPage`, `searchRecords`, `wantedPages` and `continuationDate`, and yields the same records the crawler stores, with the `infoParser.py` fields added. Requests share one pool of keep-alive connections, at most `concurrency` in flight, and server errors are retried twice as Scrapy retries them. Given the store it writes to, a crawl resumes the way the spider's does: only the results the store is missing are fetched, or, for the searches a `repairs.jsonl` from `verifyArticles.py` lists, the results it lists.
+#
+# Logging in is left to the caller: pass the session cookies of a logged-in browser (or none at all, for `mockProquest.py`). HTTP goes through `aiohttp`, which only has to be installed to use this module.
+#
+# Usage: `python asyncCrawler.py QUERY D0 D1 [--baseurl URL] [--topic biden] [--concurrency 16] [--cookies cookies.json]`, which appends to `topic/data/articles.jsonl` and keeps its counts, near-duplicate clusters and index up to date as the crawler does.
+
+# +
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import datetime
+from urllib.parse import urljoin
+
+from dateutil import parser
+
+from extractArticles import extractPage, searchRecords, wantedPages, continuationDate
+from queryCompiler import compileSearch, redate, querylimit
+from verifyArticles import loadRepairs, verifyStore
+from infoParser import enrich
+
+baseurl = 'https://search.proquest.com'
+# -
+
+# ## Resuming
+# `storedMissing` gives, for each search (`queryKey`) a store holds, the search indices it still lacks (as `verifyArticles.py` finds them), and what to fetch for searches it doesn't list: everything. A repair file from `verifyArticles.py` overrides the store for the searches it lists.
+
+# +
+def storedMissing(store=None, repairs=None):
+    missing = {}
+    if store is not None and os.path.exists(store):
+        coverage, malformed = verifyStore(store)
+        missing = {key: query.missing() for key, query in coverage.items()}
+    if repairs is not None and os.path.exists(repairs):
+        missing.update(loadRepairs(repairs))
+    return missing, 'All'
+
+
+# -
+
+# ## Reading the Search Form
+# What `FormRequest.from_response` would submit for the search form: its fields with their default values (checked boxes only, the selected or first option of a select) and the search button.
+
+# +
+def searchForm(text, url, formid='searchForm', button='searchToResultPage'):
+    from parsel import Selector
+
+    form = Selector(text=text).xpath("//form[@id='{}']".format(formid))
+    if not form:
+        return None, None
+    fields = {}
+    for field in form.xpath('.//input[@name]'):
+        kind = (field.attrib.get('type') or 'text').lower()
+        if kind in ('submit', 'image', 'button', 'reset') or (kind in ('checkbox', 'radio') and 'checked' not in field.attrib):
+            continue
+        fields[field.attrib['name']] = field.attrib.get('value', 'on' if kind in ('checkbox', 'radio') else '')
+    for field in form.xpath('.//select[@name]'):
+        options = field.xpath('.//option[@selected]/@value').extract() or field.xpath('.//option/@value').extract()
+        fields[field.attrib['name']] = options[0] if options else ''
+    for field in form.xpath('.//textarea[@name]'):
+        fields[field.attrib['name']] = ''.join(field.xpath('text()').extract())
+    for field in form.xpath(".//*[@id='{}'][@name]".format(button)):
+        fields[field.attrib['name']] = field.attrib.get('value', '')
+    return urljoin(url, form.attrib.get('action') or url), fields
+
+
+# -
+
+# ## The Crawler
+# Every search part runs as its own task, and so does every result page it needs; articles are handed to the caller through a bounded queue, so a caller that stops reading soon stops the crawl too. With an `executor`, pages are read in it rather than in the event loop.
+
+# +
+class AsyncCrawler(object):
+
+    def __init__(self, baseurl=baseurl, cookies=None, concurrency=16, retries=2, executor=None, timeout=180):
+        self.baseurl = baseurl
+        self.cookies = cookies or {}
+        self.concurrency = concurrency
+        self.retries = retries
+        self.executor = executor
+        self.timeout = timeout
+        self.session = None
+        self.stats = {}
+
+    async def __aenter__(self):
+        import aiohttp # imported late so the module can be read without it
+        self.aiohttp = aiohttp
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(cookies=self.cookies, cookie_jar=aiohttp.CookieJar(unsafe=True),
+                                             connector=aiohttp.TCPConnector(limit=self.concurrency),
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                             headers={'User-Agent': 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)'})
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.session.close()
+
+    def count(self, name, value=1):
+        self.stats[name] = self.stats.get(name, 0) + value
+
+    # (final url, text) of a request, following redirects; failures are retried and the last answer returned anyway
+    async def fetch(self, method, url, data=None):
+        for attempt in range(self.retries + 1):
+            async with self.semaphore:
+                self.count('requests')
+                try:
+                    async with self.session.request(method, url, data=data) as response:
+                        final, status, text = str(response.url), response.status, await response.text()
+                except (self.aiohttp.ClientError, asyncio.TimeoutError):
+                    final, status, text = url, None, ''
+            if status is not None and status < 500:
+                return final, text
+            self.count('retries')
+        logging.warning('Gave Up On {} After {} Attempts'.format(url, self.retries + 1))
+        return final, text
+
+    async def extract(self, text, url):
+        if self.executor is None:
+            return extractPage(text, url)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, extractPage, text, url)
+
+    # the same three steps as startform, query and the form submission in the spider
+    async def search(self, meta):
+        await self.fetch('GET', self.baseurl + '/advanced.showresultpageoptions?site=news')
+        url, text = await self.fetch('GET', self.baseurl + '/news/advanced')
+        action, fields = searchForm(text, url)
+        if action is None:
+            return url, text
+        fields.update({'queryTermField': meta['query'], 'fullTextLimit': 'on', 'sortType': 'DateAsc', 'includeDuplicate': 'on'})
+        self.count('searches')
+        return await self.fetch('POST', action, fields)
+
+    def outcome(self, extracted, meta):
+        if extracted['status'] == 'expired':
+            logging.warning('Session Expiration Outcome Tied To {}'.format(meta['databaseindex']))
+            self.count('session_expiries')
+        elif extracted['status'] == 'absent':
+            logging.warning('Result Absence Outcome Tied To {}'.format(meta['databaseindex']))
+            self.count('result_absences')
+        return extracted['status'] == 'ok'
+
+    async def crawlSearch(self, meta, queue):
+        url, text = await self.search(meta)
+        extracted = await self.extract(text, url)
+        if not self.outcome(extracted, meta):
+            return
+        urlparts = [url[:url.find('/1')+1], url[url.find('1?')+1:]]
+        # the search answers with the first page, so it isn't fetched again
+        await asyncio.gather(*[self.crawlPage(meta, str(page_index+1).join(urlparts), extracted if page_index == 0 else None, queue)
+                               for page_index in wantedPages(extracted['resultscount'], meta)])
+
+    async def crawlPage(self, meta, url, extracted, queue):
+        if extracted is None:
+            url, text = await self.fetch('GET', url)
+            extracted = await self.extract(text, url)
+            if not self.outcome(extracted, meta):
+                return
+        self.count('pages')
+        for record in searchRecords(extracted, meta):
+            await queue.put(enrich(record))
+
+        # more results than proquest shows: search again from the date of the last one shown
+        if extracted['limit']:
+            outcome, date = continuationDate(extracted, meta)
+            if outcome != 'ok':
+                logging.warning('Continuation {} Tied To {}'.format('Without Dates' if outcome == 'undated' else 'Stuck On ' + date, meta['databaseindex']))
+                self.count('continuation_failures')
+                return
+            start = datetime.datetime.fromisoformat(date)
+            await self.crawlSearch(dict(meta, parents=meta['parents'] + 1, querystart=start, query=redate(meta['query'], start, meta['queryend'])), queue)
+
+    # yields the articles of one query, leaving out what `missing` (from `storedMissing`) says is stored already
+    async def scrape(self, query, d0, d1, databaseindex=0, missing=({}, 'All'), limit=querylimit):
+        stored, default = missing
+        searches = []
+        for part, search in enumerate(compileSearch(query, limit)):
+            wanted = stored.get((databaseindex, query, part), default)
+            if wanted:
+                searches.append({'originalquery': query, 'query': search, 'querypart': part, 'databaseindex': databaseindex,
+                                 'originalstart': d0, 'originalend': d1, 'line': '', 'querystart': d0, 'queryend': d1,
+                                 'parents': 0, 'missing': wanted})
+
+        queue = asyncio.Queue(maxsize=self.concurrency * 100)
+        done = object()
+
+        async def run():
+            try:
+                await asyncio.gather(*[self.crawlSearch(meta, queue) for meta in searches])
+            finally:
+                await queue.put(done)
+
+        runner = asyncio.ensure_future(run())
+        try:
+            while True:
+                article = await queue.get()
+                if article is done:
+                    break
+                self.count('articles')
+                yield article
+            await runner # raises whatever went wrong in the crawl
+        finally:
+            runner.cancel()
+
+async def scrape(query, d0, d1, baseurl=baseurl, cookies=None, store=None, repairs=None, databaseindex=0, concurrency=16, executor=None):
+    async with AsyncCrawler(baseurl, cookies, concurrency, executor=executor) as crawler:
+        async for article in crawler.scrape(query, d0, d1, databaseindex, storedMissing(store, repairs)):
+            yield article
+
+
+# -
+
+# ## Command Line
+# Stores what it scrapes as `JsonWriterPipeline` does, after clustering near-duplicates as `NearDuplicatePipeline` does, and deletes the repair file it used as the spider does. `engine` makes the crawler (`exportIngest.py` passes its own).
+
+# +
+async def crawl(args, engine=AsyncCrawler):
+    from nearDuplicates import NearDuplicateIndex, articleKey, articleText
+    from aggregateViews import openViews, viewsPath
+    from articleIndex import ArticleIndex
+
+    data = os.path.join(args.topic, 'data')
+    store, repairs, clusters = (os.path.join(data, name) for name in ('articles.jsonl', 'repairs.jsonl', 'nearduplicates.pickle'))
+    cookies = None
+    if args.cookies:
+        with open(args.cookies) as f:
+            cookies = json.load(f)
+
+    index = NearDuplicateIndex.load(clusters) if os.path.exists(clusters) else NearDuplicateIndex()
+    views = openViews(store)
+    missing = storedMissing(store, repairs)
+    async with engine(args.baseurl, cookies, args.concurrency) as crawler:
+        with open(store, 'a') as f:
+            async for article in crawler.scrape(args.query, parser.parse(args.d0), parser.parse(args.d1), args.databaseindex, missing):
+                article['cluster'] = index.add(articleKey(article), articleText(article), article.get('published'))
+                f.write(json.dumps(article) + '\n')
+                views.add(article)
+    index.save(clusters)
+    if os.path.exists(repairs):
+        os.remove(repairs) # its gaps have been requested, as the spider does
+    views.caughtUp(store)
+    views.save(viewsPath(store))
+    articles = ArticleIndex(store)
+    articles.update()
+    articles.close()
+    return crawler.stats
+
+def crawlArguments(description):
+    args = argparse.ArgumentParser(description=description)
+    args.add_argument('query', help='the search, e.g. \'PD(20200501-20200502) AND ("biden")\'')
+    args.add_argument('d0', help='first publication date searched')
+    args.add_argument('d1', help='last publication date searched')
+    args.add_argument('--baseurl', default=baseurl)
+    args.add_argument('--topic', default='biden', help='directory whose data/articles.jsonl is appended to')
+    args.add_argument('--databaseindex', type=int, default=0)
+    args.add_argument('--concurrency', type=int, default=16, help='requests in flight at once')
+    args.add_argument('--cookies', help='JSON file of session cookies from a logged-in browser')
+    return args
+
+def main(argv=None):
+    args = crawlArguments('Scrape ProQuest search results with asyncio.').parse_args(argv)
+    stats = asyncio.run(crawl(args))
+    print(', '.join('{} {}'.format(value, name) for name, value in sorted(stats.items())), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
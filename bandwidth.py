@@ -0,0 +1,205 @@
+# # bandwidth
+# Accounts for what every request of the crawl costs, per query and per callback: requests sent and their header bytes, response header bytes, body bytes as transferred (compressed, if the server compressed them) and once decompressed, the time spent parsing them, and the articles they yielded. The per-query totals end up as the number that matters when pages are paid for in time and rate limits: bytes transferred per stored article.
+#
+# Enable it with `'EXTENSIONS': {'bandwidth.BandwidthExtension': 510}` and `'SPIDER_MIDDLEWARES': {'bandwidth.ParseTimeMiddleware': 1000}` (the middleware times callbacks for the extension). Settings:
+# - `BANDWIDTH_REPORT`: where the per-query and per-callback totals are written as JSON when the crawl ends (default `None`, not written)
+#
+# Transferred bytes are counted from Scrapy's `headers_received` and `bytes_received` signals, so they are the bytes the downloader read off the connection, before `HttpCompressionMiddleware` decompresses them; redirects and error pages count too.
+#
+# `leansettings` are the Scrapy settings of the crawler's lean-fetch mode (`--lean`), which trims each request down to what ProQuest needs. The same mode also reads the first result page of each search from the search response itself instead of fetching it a second time (see `parsePages` in `scrapeArticles.py`).
+#
+# Usage (reading reports): `python bandwidth.py biden/data/bandwidth.json [--by query|stage] [--compare biden/data/bandwidth-lean.json]`
+
+# +
+import sys
+import json
+import time
+import logging
+import argparse
+
+from scrapy import signals
+
+from crawlMetrics import metrics
+
+# no Referer or Accept-Language, and a short Accept; compression is already asked for by HttpCompressionMiddleware
+leansettings = {'REFERER_ENABLED': False,
+                'DEFAULT_REQUEST_HEADERS': {'Accept': 'text/html'}}
+
+fields = ('requests', 'responses', 'sentbytes', 'headerbytes', 'wirebytes', 'bodybytes', 'parseseconds', 'items')
+# -
+
+# ## The Ledger
+# Totals are kept per query (`(databaseindex, originalquery)` from the request's meta) and per stage (the callback the request was for). A single module-level `ledger` is shared by the extension and the middleware, as `crawlMetrics.metrics` is.
+
+# +
+def requestQuery(meta):
+    return (meta.get('databaseindex'), meta.get('originalquery'))
+
+def requestStage(request):
+    return getattr(request.callback, '__name__', None) or 'parse' # scrapy calls the spider's parse when there's no callback
+
+# the size of a block of headers as sent: "Name: value\r\n" for every value
+def headerSize(headers):
+    return sum(len(name) + len(value) + 4 for name, values in headers.items() for value in values)
+
+def requestSize(request):
+    return len(request.method) + len(request.url) + 11 + headerSize(request.headers) + len(request.body or b'')
+
+class BandwidthLedger(object):
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = {}
+        self.stages = {}
+
+    def add(self, query, stage, **values):
+        for totals in (self.queries.setdefault(query, dict.fromkeys(fields, 0)), self.stages.setdefault(stage, dict.fromkeys(fields, 0))):
+            for field, value in values.items():
+                totals[field] += value
+
+    def total(self):
+        total = dict.fromkeys(fields, 0)
+        for totals in self.queries.values():
+            for field in fields:
+                total[field] += totals[field]
+        return total
+
+    def report(self):
+        return {'total': summarise(self.total()),
+                'queries': [dict(summarise(totals), databaseindex=query[0], originalquery=query[1]) for query, totals in self.queries.items()],
+                'stages': {stage: summarise(totals) for stage, totals in self.stages.items()}}
+
+# adds what the totals come to per stored article
+def summarise(totals):
+    transferred = totals['sentbytes'] + totals['headerbytes'] + totals['wirebytes']
+    return dict(totals, transferred=transferred,
+                bytesperitem=transferred / totals['items'] if totals['items'] else None,
+                requestsperitem=totals['requests'] / totals['items'] if totals['items'] else None,
+                compression=totals['bodybytes'] / totals['wirebytes'] if totals['wirebytes'] else None)
+
+ledger = BandwidthLedger()
+
+
+# -
+
+# ## Counting
+# The extension counts bytes from the downloader's signals; the middleware times the spider's callbacks, from their first step to their last. Callbacks that are asynchronous generators (the post-processing pool's `parseOffloaded`) do their parsing in the pool, not in the reactor, so their time isn't counted.
+
+# +
+class BandwidthExtension(object):
+
+    def __init__(self, reportpath=None, registry=ledger):
+        self.reportpath = reportpath
+        self.registry = registry
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler.settings.get('BANDWIDTH_REPORT'))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(extension.bytes_received, signal=signals.bytes_received)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        return extension
+
+    def spider_opened(self, spider):
+        self.registry.reset()
+
+    def headers_received(self, headers, body_length, request, spider):
+        sent, received = requestSize(request), headerSize(headers)
+        self.registry.add(requestQuery(request.meta), requestStage(request), requests=1, sentbytes=sent, headerbytes=received)
+        metrics.count('sent_bytes', sent)
+        metrics.count('header_bytes', received)
+
+    def bytes_received(self, data, request, spider):
+        self.registry.add(requestQuery(request.meta), requestStage(request), wirebytes=len(data))
+        metrics.count('wire_bytes', len(data))
+
+    def response_received(self, response, request, spider):
+        self.registry.add(requestQuery(request.meta), requestStage(request), responses=1, bodybytes=len(response.body))
+
+    def item_scraped(self, item, response, spider):
+        self.registry.add(requestQuery(response.meta), requestStage(response.request), items=1)
+
+    def spider_closed(self, spider):
+        report = self.registry.report()
+        total = report['total']
+        logging.warning('Bandwidth: {:,} Bytes Transferred ({:,} Decompressed) For {:,} Articles, {} Bytes Per Article'.format(
+            total['transferred'], total['bodybytes'], total['items'],
+            '-' if total['bytesperitem'] is None else '{:,.0f}'.format(total['bytesperitem'])))
+        if self.reportpath:
+            with open(self.reportpath, 'w') as f:
+                json.dump(report, f, indent=1)
+
+
+class ParseTimeMiddleware(object):
+
+    def __init__(self, registry=ledger):
+        self.registry = registry
+
+    def process_spider_output(self, response, result, spider):
+        query, stage = requestQuery(response.meta), requestStage(response.request)
+        iterator = iter(result)
+        while True:
+            start = time.perf_counter()
+            try:
+                output = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.registry.add(query, stage, parseseconds=time.perf_counter() - start)
+            yield output
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for output in result:
+            yield output
+
+
+# -
+
+# ## Command Line
+# Prints the totals of a report per query or per callback. With `--compare`, also prints how the second report's crawl (say, with `--lean`) did against the first's.
+
+# +
+def printTotals(rows):
+    print('{:<40} {:>8} {:>12} {:>12} {:>9} {:>8} {:>10}'.format('', 'requests', 'transferred', 'decompressed', 'parse s', 'items', 'bytes/item'))
+    for name, totals in rows:
+        print('{:<40} {requests:>8} {transferred:>12,} {bodybytes:>12,} {parseseconds:>9.2f} {items:>8} {peritem:>10}'.format(
+            str(name)[:40], peritem='-' if totals['bytesperitem'] is None else '{:,.0f}'.format(totals['bytesperitem']), **totals))
+
+def saving(before, after, field):
+    if not before[field] or after[field] is None:
+        return '-'
+    return '{:+.1%}'.format(after[field] / before[field] - 1)
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Print the bandwidth report of a crawl.')
+    args.add_argument('report', help='a BANDWIDTH_REPORT written by a crawl')
+    args.add_argument('--by', choices=['query', 'stage'], default='query')
+    args.add_argument('--compare', help='a report of another crawl of the same searches')
+    args = args.parse_args(argv)
+
+    with open(args.report) as f:
+        report = json.load(f)
+    if args.by == 'stage':
+        rows = sorted(report['stages'].items())
+    else:
+        rows = [('[{}] {}'.format(query['databaseindex'], query['originalquery']), query) for query in report['queries']]
+    printTotals(rows + [('total', report['total'])])
+
+    if args.compare:
+        with open(args.compare) as f:
+            other = json.load(f)
+        before, after = report['total'], other['total']
+        print()
+        printTotals([(args.report, before), (args.compare, after)])
+        print('change: {} requests, {} bytes transferred, {} bytes per article, {} parse time'.format(
+            saving(before, after, 'requests'), saving(before, after, 'transferred'), saving(before, after, 'bytesperitem'),
+            saving(before, after, 'parseseconds')))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# # benchmarkCrawl
+# End-to-end benchmark of the crawler against `mockProquest.py`. Each scenario runs `scrapeArticles.py` in its own process with its own empty topic directory, pointed at a local mock server, and is scored on:
+# - **items/sec**: articles stored per second of wall time (including process start-up)
+# - **requests/item**: requests the mock server answered per stored article
+# - **bytes/item**: response bytes the mock server sent (gzipped, as the crawler asks for) per stored article
+# - **CPU ms/item**: CPU time (user and system) the crawling process used per stored article
+# - **completeness**: unique search indices stored over results the searches reported, as measured by `verifyArticles.py`
+# - **differing**: records that differ from what the baseline stored for the same result, field by field. Every scenario, whatever its engine, has to store the same records, so the benchmark fails when any differ.
+#
+# Usage: `python benchmarkCrawl.py [--results 2500] [--latency 0.02] [--expiry 0.01] [--errors 0.01] [--scenarios baseline,threadpool] [--json report.json]`
+
+# +
+import os
+import sys
+import json
+import time
+import resource
+import shutil
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+from mockProquest import MockProquest, serve, resultsArgument
+from verifyArticles import verifyStore
+
+here = os.path.dirname(os.path.abspath(__file__))
+# -
+
+# ## Scenarios
+# Each scenario is a set of Scrapy settings (`--set`) and extra `scrapeArticles.py` arguments. The baseline is the notebook's own configuration. A scenario with an `engine` runs that script instead, with the notebook's search given as arguments; `asyncio` runs the same crawl through `asyncCrawler.py`, and `export` through `exportIngest.py`, which reads citation exports instead of result pages.
+
+scenarios = {
+    'baseline': {},
+    'concurrency32': {'settings': {'CONCURRENT_REQUESTS': 32, 'CONCURRENT_REQUESTS_PER_DOMAIN': 32}},
+    'fifo': {'settings': {'SCHEDULER_PRIORITY_QUEUE': 'scrapy.pqueues.ScrapyPriorityQueue'}},
+    'threadpool': {'args': ['--postprocessing', 'thread']},
+    'processpool': {'args': ['--postprocessing', 'process']},
+    'lean': {'args': ['--lean']},
+    'asyncio': {'engine': 'asyncCrawler.py', 'args': ['PD(20200501-20200502) AND ("biden")', '2020-05-01', '2020-05-02']},
+    'export': {'engine': 'exportIngest.py', 'args': ['PD(20200501-20200502) AND ("biden")', '2020-05-01', '2020-05-02']},
+}
+
+
+# ## Running a Scenario
+
+# +
+# fields left out of the comparison: exports have no info line, and links and cluster ids differ from one crawl to the next
+uncompared = ('info', 'link', 'cluster')
+
+# a store's records by search and search index
+def storedRecords(store):
+    records = {}
+    if os.path.exists(store):
+        with open(store, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records[(record.get('databaseindex', 0), record['originalquery'], record.get('querypart', 0), record['searchindex'])] = record
+    return records
+
+# {field: records that differ in it} over the results both stores hold
+def compareRecords(records, reference):
+    differing = {}
+    for key in records.keys() & reference.keys():
+        for field in (records[key].keys() | reference[key].keys()) - set(uncompared):
+            if records[key].get(field) != reference[key].get(field):
+                differing[field] = differing.get(field, 0) + 1
+    return differing
+
+def mockStats(base):
+    with urllib.request.urlopen(base + '/__stats') as response:
+        return json.loads(response.read().decode('utf-8'))
+
+def runScenario(name, scenario, base, workdir):
+    topic = os.path.join(workdir, name)
+    os.makedirs(os.path.join(topic, 'data'))
+
+    if 'engine' in scenario:
+        command = [sys.executable, os.path.join(here, scenario['engine']), '--baseurl', base, '--topic', topic] + scenario['args']
+    else:
+        command = [sys.executable, os.path.join(here, 'scrapeArticles.py'), '--baseurl', base, '--noauth', '--topic', topic,
+                   '--set', 'METRICS_PORT=0', '--set', 'LOG_LEVEL=ERROR']
+        for setting, value in scenario.get('settings', {}).items():
+            command += ['--set', '{}={}'.format(setting, value)]
+        command += scenario.get('args', [])
+
+    before = mockStats(base)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    finished = subprocess.run(command, cwd=here, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    elapsed = time.perf_counter() - start
+    cpu = sum(getattr(resource.getrusage(resource.RUSAGE_CHILDREN), field) - getattr(usage, field) for field in ('ru_utime', 'ru_stime'))
+    after = mockStats(base)
+
+    store = os.path.join(topic, 'data', 'articles.jsonl')
+    items = expected = unique = 0
+    if os.path.exists(store):
+        coverage, malformed = verifyStore(store)
+        for query in coverage.values():
+            report = query.report()
+            items += report['records']
+            unique += report['unique']
+            expected += report['expected'] or 0
+    requests = after.get('requests', 0) - before.get('requests', 0)
+    transferred = after.get('bytes', 0) - before.get('bytes', 0)
+
+    return {'scenario': name, 'returncode': finished.returncode, 'seconds': elapsed, 'items': items,
+            'itemspersecond': items / elapsed if elapsed else 0.0,
+            'requests': requests, 'requestsperitem': requests / items if items else None,
+            'bytes': transferred, 'bytesperitem': transferred / items if items else None,
+            'cpuseconds': cpu, 'cpumsperitem': 1000 * cpu / items if items else None,
+            'completeness': unique / expected if expected else 0.0,
+            'store': store, 'output': finished.stdout[-2000:] if finished.returncode else ''}
+
+
+# -
+
+# ## Command Line
+
+# +
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Benchmark scrapeArticles.py against a local ProQuest stand-in.')
+    args.add_argument('--results', type=resultsArgument, default=2500, help='results per query, or a LOW-HIGH range')
+    args.add_argument('--latency', type=float, default=0.02)
+    args.add_argument('--expiry', type=float, default=0.0)
+    args.add_argument('--errors', type=float, default=0.0)
+    args.add_argument('--scenarios', default=','.join(scenarios), help='comma-separated subset of: ' + ', '.join(scenarios))
+    args.add_argument('--keep', action='store_true', help='keep the scraped data directories')
+    args.add_argument('--json', help='also write the results to this file')
+    args = args.parse_args(argv)
+
+    server = serve(MockProquest(args.results, args.latency, args.expiry, args.errors))
+    base = 'http://localhost:{}'.format(server.server_address[1])
+    workdir = tempfile.mkdtemp(prefix='proquest-bench-')
+
+    results, reference = [], None
+    print('{:<14} {:>9} {:>7} {:>10} {:>13} {:>10} {:>13} {:>13} {:>10}'.format('scenario', 'seconds', 'items', 'items/sec', 'requests/item', 'bytes/item', 'CPU ms/item', 'completeness', 'differing'))
+    try:
+        for name in args.scenarios.split(','):
+            result = runScenario(name, scenarios[name], base, workdir)
+            records = storedRecords(result.pop('store'))
+            if reference is None:
+                reference = records # the first scenario run, the baseline unless --scenarios says otherwise
+            result['differing'] = compareRecords(records, reference)
+            results.append(result)
+            print('{scenario:<14} {seconds:>9.2f} {items:>7} {itemspersecond:>10.1f} {rpi:>13} {bpi:>10} {cpi:>13} {completeness:>13.1%} {dif:>10}'.format(
+                dif=sum(result['differing'].values()),
+                rpi='-' if result['requestsperitem'] is None else '{:.3f}'.format(result['requestsperitem']),
+                bpi='-' if result['bytesperitem'] is None else '{:.0f}'.format(result['bytesperitem']),
+                cpi='-' if result['cpumsperitem'] is None else '{:.2f}'.format(result['cpumsperitem']), **result))
+            if result['returncode']:
+                print(result['output'], file=sys.stderr)
+            if result['differing']:
+                print('{} differs from {} in {}'.format(name, results[0]['scenario'], result['differing']), file=sys.stderr)
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print('scraped data kept in ' + workdir, file=sys.stderr)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'mock': {'results': args.results, 'latency': args.latency, 'expiry': args.expiry, 'errors': args.errors},
+                       'scenarios': results}, f, indent=2)
+    return 0 if all(result['returncode'] == 0 and not result['differing'] for result in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# # checkCorpus
+# Regression check and micro-benchmark for result-page extraction. `corpus/pages` holds saved ProQuest result pages chosen to cover the cases that have broken selectors before (multilingual titles and HTML entities, syndicated duplicates, an item without `titleAuthorETC`, the maximum-results message, pages without results, session expiry). `corpus/index.jsonl` lists each page with the URL it was fetched from, and `corpus/golden/<page>.json` holds what `extractPage` must return for it.
+#
+# For every page the harness compares `extractPage`'s output with the golden file and reports the median extraction time and the peak memory allocated while extracting.
+#
+# Usage: `python checkCorpus.py [--repeat 50] [--update]`. `--update` rewrites the golden files from the current extraction code, so only use it after checking the differences it reports are intended.
+
+# +
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import tracemalloc
+
+from extractArticles import extractPage
+
+corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+# -
+
+# ## Checking a Page
+
+# +
+def loadCorpus(path=corpus):
+    with open(os.path.join(path, 'index.jsonl'), encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                with open(os.path.join(path, 'pages', entry['name'] + '.html'), encoding='utf-8') as page:
+                    entry['text'] = page.read()
+                yield entry
+
+# human-readable differences between what was extracted and what was expected
+def differences(extracted, golden):
+    problems = []
+    for field in sorted(set(extracted) | set(golden)):
+        if field == 'records':
+            continue
+        if extracted.get(field) != golden.get(field):
+            problems.append('{}: got {!r}, expected {!r}'.format(field, extracted.get(field), golden.get(field)))
+    got, expected = extracted.get('records', []), golden.get('records', [])
+    if len(got) != len(expected):
+        problems.append('records: got {}, expected {}'.format(len(got), len(expected)))
+    for i, (a, b) in enumerate(zip(got, expected)):
+        for field in sorted(set(a) | set(b)):
+            if a.get(field) != b.get(field):
+                problems.append('records[{}].{}: got {!r}, expected {!r}'.format(i, field, a.get(field), b.get(field)))
+    return problems
+
+def measure(entry, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        extractPage(entry['text'], entry['url'])
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    extracted = extractPage(entry['text'], entry['url'])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return extracted, statistics.median(times), peak
+
+
+# -
+
+# ## Command Line
+
+# +
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Check result-page extraction against the saved corpus.')
+    args.add_argument('--repeat', type=int, default=50, help='extractions per page for timing')
+    args.add_argument('--update', action='store_true', help='rewrite golden outputs from the current code')
+    args = args.parse_args(argv)
+
+    failures = 0
+    print('{:<22} {:>6} {:>8} {:>12} {:>10}'.format('page', 'result', 'records', 'median ms', 'peak KiB'))
+    for entry in loadCorpus():
+        extracted, seconds, peak = measure(entry, args.repeat)
+        goldenpath = os.path.join(corpus, 'golden', entry['name'] + '.json')
+        try:
+            with open(goldenpath, encoding='utf-8') as f:
+                problems = differences(extracted, json.load(f))
+        except FileNotFoundError:
+            problems = ['no golden output']
+
+        print('{:<22} {:>6} {:>8} {:>12.3f} {:>10.1f}'.format(entry['name'], 'FAIL' if problems else 'ok',
+                                                            len(extracted.get('records', [])), seconds * 1000, peak / 1024))
+        for problem in problems:
+            print('    ' + problem)
+        if problems and args.update:
+            with open(goldenpath, 'w', encoding='utf-8') as f:
+                json.dump(extracted, f, indent=2, ensure_ascii=False)
+                f.write('\n')
+            print('    golden output updated')
+        elif problems:
+            failures += 1
+
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
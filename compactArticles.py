@@ -0,0 +1,176 @@
+# # compactArticles
+# Merges article stores into one sorted store without duplicates, in bounded memory. Resumed crawls, continuation searches, repair runs and crawls split across machines all append to `articles.jsonl` in whatever order results arrive, and some results get stored more than once. Compaction reads any number of stores (or segments of one), sorts their records by search and search index and keeps one record of each result, then writes one store and its `articleIndex.py` index.
+#
+# Records are ordered by `(databaseindex, originalquery, querypart, searchindex)`, which is the order of the index's search key, of `verifyArticles.py` and of the results in ProQuest. A record is a duplicate when another record has the same search, search index and document id (`documentId(link)`). The copy stored last wins: stores listed later win over stores listed earlier, and later lines over earlier ones, so a rerun's records replace a first run's. Two different documents under one search index (a search whose results changed between runs) are both kept, and counted as `conflicts`.
+#
+# The sort is an external merge sort. Records are read in runs of `runsize`, and each run is sorted, cleared of duplicates and written to a temporary file. The runs are then merged `fanin` at a time, in as many passes as it takes, so memory holds at most one run and the open files never exceed `fanin`. Lines that aren't JSON, or are cut off at the end of a store still being written, are skipped and counted as `malformed`.
+#
+# The compacted store replaces its target in one `os.replace`. Its aggregate views and index are rebuilt from it the next time they are opened, because it is a new file; the index is rebuilt straight away. Near-duplicate clusters and repair lists stay valid, since they refer to documents and search indices.
+#
+# Usage: `python compactArticles.py biden/data/articles.jsonl [host2/articles.jsonl ...] [--output biden/data/compacted.jsonl] [--runsize 200000] [--fanin 64] [--tempdir /scratch]`
+
+# +
+import os
+import sys
+import json
+import heapq
+import shutil
+import argparse
+import tempfile
+import itertools
+
+from extractArticles import documentId
+
+runsize = 200000 # records sorted in memory at once
+fanin = 64 # runs merged at once
+# -
+
+# ## Sort Keys
+# A run line is the record's key as JSON, a tab, then the record exactly as it was stored, so merging only decodes keys and records are written out byte for byte. The key ends with where the record was stored, `[store, line]`, which orders copies of one result from first stored to last.
+
+# +
+def sortKey(record, store, line):
+    return [int(record.get('databaseindex', 0)), record['originalquery'], int(record.get('querypart', 0)),
+            int(record['searchindex']), documentId(record['link']), store, line]
+
+def resultKey(key):
+    return key[:5]
+
+def runLine(key, line):
+    return json.dumps(key) + '\t' + line
+
+def splitRunLine(line):
+    key, record = line.split('\t', 1)
+    return json.loads(key), record
+
+# the last copy of every result in (key, record) pairs sorted by key
+def lastCopies(entries, stats):
+    for result, copies in itertools.groupby(entries, key=lambda entry: resultKey(entry[0])):
+        copies = list(copies)
+        stats['duplicates'] += len(copies) - 1
+        yield copies[-1]
+
+
+# -
+
+# ## Sorted Runs
+
+# +
+# (key, record line) for every record in the stores, in the order they were stored
+def storeRecords(stores, stats):
+    for number, store in enumerate(stores):
+        with open(store, encoding='utf-8') as f:
+            for position, line in enumerate(f):
+                if not line.strip():
+                    continue
+                stats['read'] += 1
+                try:
+                    if not line.endswith('\n'):
+                        raise ValueError('record still being written')
+                    key = sortKey(json.loads(line), number, position)
+                except (ValueError, KeyError, TypeError):
+                    stats['malformed'] += 1
+                    continue
+                yield key, line
+
+def writeRun(entries, directory, stats):
+    fd, path = tempfile.mkstemp(prefix='run-', suffix='.txt', dir=directory)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for key, line in entries:
+            f.write(runLine(key, line))
+    stats['runs'] += 1
+    return path
+
+def sortedRuns(stores, directory, stats, size=runsize):
+    runs = []
+    records = storeRecords(stores, stats)
+    while True:
+        chunk = list(itertools.islice(records, size))
+        if not chunk:
+            return runs
+        chunk.sort(key=lambda entry: entry[0])
+        runs.append(writeRun(lastCopies(chunk, stats), directory, stats))
+        del chunk
+
+
+# -
+
+# ## Merging
+# `mergeRuns` merges sorted run files into one sorted stream of `(key, record line)`, dropping the earlier copies of each result as it goes. Runs beyond `fanin` are first merged into longer runs.
+
+# +
+def readRun(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield splitRunLine(line)
+
+def mergeRuns(runs, directory, stats, width=fanin):
+    width = max(2, width)
+    while len(runs) > width:
+        merged = []
+        for first in range(0, len(runs), width):
+            group = runs[first:first + width]
+            merged.append(writeRun(lastCopies(heapq.merge(*map(readRun, group), key=lambda entry: entry[0]), stats), directory, stats))
+            for path in group:
+                os.remove(path)
+        runs = merged
+        stats['passes'] += 1
+    stats['passes'] += 1
+    return lastCopies(heapq.merge(*map(readRun, runs), key=lambda entry: entry[0]), stats)
+
+
+# -
+
+# ## Compacting
+# Writes the merged records to `output` (by default the first store, which is then replaced) through a temporary file beside it, so the target is never half written. Returns the counts of what was read, written and dropped.
+
+# +
+def compact(stores, output=None, size=runsize, width=fanin, tempdir=None):
+    from articleIndex import ArticleIndex
+
+    output = output or stores[0]
+    stats = dict.fromkeys(('read', 'written', 'duplicates', 'conflicts', 'malformed', 'runs', 'passes'), 0)
+    directory = tempfile.mkdtemp(prefix='compact-', dir=tempdir or os.path.dirname(os.path.abspath(output)))
+    target = output + '.compacting'
+    try:
+        previous = None
+        with open(target, 'w', encoding='utf-8') as out:
+            for key, line in mergeRuns(sortedRuns(stores, directory, stats, size), directory, stats, width):
+                if previous is not None and key[:4] == previous[:4]:
+                    stats['conflicts'] += 1 # another document under the same search index
+                previous = key
+                out.write(line)
+                stats['written'] += 1
+        os.replace(target, output)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        if os.path.exists(target):
+            os.remove(target)
+
+    index = ArticleIndex(output)
+    index.update()
+    index.close()
+    return stats
+
+
+# -
+
+# ## Command Line
+
+# +
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Merge article stores into one sorted store without duplicates.')
+    args.add_argument('stores', nargs='+', help='articles.jsonl stores or segments; on duplicates, later ones win')
+    args.add_argument('--output', help='write the compacted store here instead of replacing the first store')
+    args.add_argument('--runsize', type=int, default=runsize, help='records sorted in memory at once')
+    args.add_argument('--fanin', type=int, default=fanin, help='runs merged at once')
+    args.add_argument('--tempdir', help='where sorted runs are kept (default: beside the output)')
+    args = args.parse_args(argv)
+
+    stats = compact(args.stores, args.output, args.runsize, args.fanin, args.tempdir)
+    print('{read} records read, {written} written, {duplicates} duplicates dropped, {conflicts} conflicts kept, '
+          '{malformed} malformed skipped ({runs} runs, {passes} merge passes)'.format(**stats), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
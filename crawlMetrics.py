@@ -0,0 +1,216 @@
+# # crawlMetrics
+# Counters and latency histograms for each stage of the crawl (startform, query, parsePages, parse and each item pipeline), plus session expiries, result absences, bytes downloaded, and item/page rates. A single module-level `metrics` registry is shared by the spider callbacks and `MetricsExtension`, which serves it in Prometheus text format on a local port and writes a JSON snapshot every few seconds.
+#
+# Enable it with `'EXTENSIONS': {'crawlMetrics.MetricsExtension': 500}`. Settings:
+# - `METRICS_PORT`: local port for the Prometheus endpoint (default 9410, `None` to disable)
+# - `METRICS_SNAPSHOT`: path of the periodic JSON snapshot (default `None`, disabled)
+# - `METRICS_INTERVAL`: seconds between snapshots (default 10)
+
+# +
+import time
+import json
+import inspect
+import logging
+import functools
+
+from scrapy import signals
+from twisted.internet import defer, task
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+# -
+
+# ## The Registry
+
+# +
+# upper bounds (seconds) of the latency histogram buckets
+latencybuckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram(object):
+
+    def __init__(self, buckets=latencybuckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    # cumulative (le, count) pairs as prometheus expects them
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+
+class CrawlMetrics(object):
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.counters = {}
+        self.stages = {}
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        if stage not in self.stages:
+            self.stages[stage] = Histogram()
+        self.stages[stage].observe(seconds)
+
+    # wraps a callback or pipeline method so the time spent inside it is recorded under `stage`
+    # generator callbacks are timed across all of their steps, not just until they return the generator, and a method that
+    # returns a Deferred is timed until the Deferred fires
+    def timed(self, stage):
+        def decorator(fn):
+            if inspect.isasyncgenfunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        async for result in fn(*args, **kwargs):
+                            yield result
+                    finally:
+                        self.observe(stage, time.perf_counter() - start)
+                return wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                result = fn(*args, **kwargs)
+                if inspect.isgenerator(result):
+                    return self._timedGenerator(stage, result, time.perf_counter() - start)
+                if isinstance(result, defer.Deferred):
+                    return result.addBoth(self._timedResult, stage, start)
+                self.observe(stage, time.perf_counter() - start)
+                return result
+            return wrapper
+        return decorator
+
+    def _timedResult(self, result, stage, start):
+        self.observe(stage, time.perf_counter() - start)
+        return result
+
+    def _timedGenerator(self, stage, generator, elapsed):
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    result = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield result
+        finally:
+            self.observe(stage, elapsed)
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.started
+        pages = self.stages['parse'].count if 'parse' in self.stages else 0
+        return {'elapsed': elapsed, 'counters': dict(self.counters),
+                'itemspersecond': self.counters.get('items', 0) / elapsed if elapsed else 0.0,
+                'pagespersecond': pages / elapsed if elapsed else 0.0,
+                'stages': {stage: {'count': h.count, 'sum': h.sum, 'mean': h.sum / h.count if h.count else 0.0,
+                                   'buckets': {str(bound): count for bound, count in h.cumulative()}}
+                           for stage, h in self.stages.items()}}
+
+    def prometheus(self):
+        snapshot = self.snapshot()
+        lines = ['# TYPE proquest_stage_seconds histogram']
+        for stage, h in sorted(self.stages.items()):
+            for bound, count in h.cumulative():
+                lines.append('proquest_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(stage, bound, count))
+            lines.append('proquest_stage_seconds_sum{{stage="{}"}} {}'.format(stage, h.sum))
+            lines.append('proquest_stage_seconds_count{{stage="{}"}} {}'.format(stage, h.count))
+        for name, value in sorted(self.counters.items()):
+            lines.append('# TYPE proquest_{}_total counter'.format(name))
+            lines.append('proquest_{}_total {}'.format(name, value))
+        for name in ('itemspersecond', 'pagespersecond'):
+            lines.append('# TYPE proquest_{} gauge'.format(name))
+            lines.append('proquest_{} {}'.format(name, snapshot[name]))
+        return '\n'.join(lines) + '\n'
+
+metrics = CrawlMetrics()
+
+
+# -
+
+# ## Exposing the Registry
+# The endpoint is served by Twisted from the crawler's own reactor, so scraping it never competes with the crawl for a thread.
+
+# +
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, registry):
+        Resource.__init__(self)
+        self.registry = registry
+
+    def render_GET(self, request):
+        if request.path == b'/metrics.json':
+            request.setHeader(b'content-type', b'application/json')
+            return json.dumps(self.registry.snapshot()).encode('utf-8')
+        request.setHeader(b'content-type', b'text/plain; version=0.0.4')
+        return self.registry.prometheus().encode('utf-8')
+
+
+class MetricsExtension(object):
+
+    def __init__(self, port=9410, snapshotpath=None, interval=10, registry=metrics):
+        self.port = int(port) if port else None # settings given on the command line arrive as strings
+        self.snapshotpath = snapshotpath
+        self.interval = interval
+        self.registry = registry
+        self.listener = None
+        self.loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler.settings.get('METRICS_PORT', 9410), crawler.settings.get('METRICS_SNAPSHOT'),
+                        crawler.settings.getfloat('METRICS_INTERVAL', 10))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        return extension
+
+    def spider_opened(self, spider):
+        from twisted.internet import reactor # imported late so scrapy gets to choose which reactor is installed
+        self.registry.reset()
+        if self.port:
+            self.listener = reactor.listenTCP(self.port, Site(MetricsResource(self.registry)), interface='127.0.0.1')
+            logging.warning('Metrics Served On http://127.0.0.1:{}/metrics'.format(self.port))
+        if self.snapshotpath:
+            self.loop = task.LoopingCall(self.writeSnapshot)
+            self.loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        if self.snapshotpath:
+            self.writeSnapshot()
+        if self.listener is not None:
+            self.listener.stopListening()
+
+    def response_received(self, response, request, spider):
+        self.registry.count('responses')
+        self.registry.count('response_bytes', len(response.body))
+
+    def item_scraped(self, item, response, spider):
+        self.registry.count('items')
+
+    def writeSnapshot(self):
+        with open(self.snapshotpath, 'w') as f:
+            json.dump(self.registry.snapshot(), f)
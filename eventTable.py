@@ -0,0 +1,141 @@
+# # eventTable
+# Loads an event dataset (one event per row, like the Global Terrorism Database's CSV) once, and plans the ProQuest searches for all of its events in one batch. Planning used to happen row by row inside `start_requests`, looking every field up with `header.index` on every row; for a database of a few hundred thousand events that alone took minutes, before a single request was sent.
+#
+# - `FieldIndex` is the table's header with every column's position worked out up front, so the generators in `searchGenerators.py` keep calling `header.index('city')` but each call is a dictionary lookup.
+# - `EventTable` reads the CSV once and hands out its rows.
+# - `planSearches` runs a search parameter generator and `compileSearch` over every row, split into chunks across a process pool, and caches the result next to the CSV so the next run over the same table doesn't repeat the work.
+#
+# Usage: `python eventTable.py terroristattack/data/terroristattacks.csv terroristattack [--workers 8]`
+
+# +
+import os
+import csv
+import sys
+import pickle
+import hashlib
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import searchGenerators
+from queryCompiler import compileSearch, querylimit
+# -
+
+# ## Loading the Table
+
+# +
+class FieldIndex(list):
+
+    def __init__(self, names):
+        list.__init__(self, names)
+        self.positions = {}
+        for position, name in enumerate(names):
+            self.positions.setdefault(name, position) # like list.index, the first column of a name wins
+
+    def index(self, name):
+        try:
+            return self.positions[name]
+        except KeyError:
+            raise ValueError('{!r} is not a column of the event table'.format(name))
+
+
+class EventTable(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            self.header = FieldIndex(next(reader))
+            self.rows = list(reader)
+
+    def __len__(self):
+        return len(self.rows)
+
+    # events keep the databaseindex the row-by-row reader gave them: their line number, counting the header as line 1
+    def databaseindex(self, row):
+        return row + 2
+
+    # identifies the table's contents, for telling whether a cached plan is still valid
+    def fingerprint(self):
+        digest = hashlib.sha1()
+        with open(self.path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+# -
+
+# ## Planning Searches
+# A plan has one entry per event: `(databaseindex, query, d0, d1, searches)`, where `query` is what the generator produced and `searches` is what `compileSearch` made of it. Events whose generator fails, or produces no query, are left out; failures are logged with their `databaseindex` rather than stopping the whole batch.
+#
+# Chunks are handed to worker processes together with the header, and each worker looks the generator up by event type itself, so nothing but plain lists and strings is pickled. The worker's `compileSearch` cache is shared by all the rows in its chunk.
+
+# +
+def planChunk(eventtype, header, rows, first, limit):
+    generator = searchGenerators.searchParamGenerators[eventtype]
+    plans, failures = [], []
+    for offset, line in enumerate(rows):
+        databaseindex = first + offset
+        try:
+            query, d0, d1 = generator(line, header)
+            if query:
+                plans.append((databaseindex, str(query), d0, d1, compileSearch(query, limit))) # str() drops the query's tree
+        except Exception as e:
+            failures.append((databaseindex, '{}: {}'.format(type(e).__name__, e)))
+    return plans, failures
+
+def planSearches(table, eventtype, limit=querylimit, workers=None, chunksize=2000, cache=True):
+    cachepath = os.path.splitext(table.path)[0] + '.searches.pickle'
+    key = (table.fingerprint(), eventtype, limit, searchGenerators.scrape_window)
+    if cache and os.path.exists(cachepath):
+        with open(cachepath, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['key'] == key:
+            return cached['plan']
+
+    chunks = [(eventtype, table.header, table.rows[start:start + chunksize], table.databaseindex(start), limit)
+              for start in range(0, len(table), chunksize)]
+    plan = []
+    if workers == 1 or len(chunks) == 1:
+        results = (planChunk(*chunk) for chunk in chunks)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(planChunk, *zip(*chunks))
+    for plans, failures in results:
+        plan.extend(plans)
+        for databaseindex, failure in failures:
+            logging.warning('Search Generation Failed For {}: {}'.format(databaseindex, failure))
+    if workers != 1 and len(chunks) > 1:
+        executor.shutdown()
+
+    if cache:
+        with open(cachepath, 'wb') as f:
+            pickle.dump({'key': key, 'plan': plan}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return plan
+
+
+# -
+
+# ## Command Line
+# Plans (and caches) the searches for a table ahead of a crawl and prints how they came out.
+
+# +
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Plan the ProQuest searches for every event in an event table.')
+    args.add_argument('table', help='path to the event CSV')
+    args.add_argument('eventtype', choices=sorted(searchGenerators.searchParamGenerators))
+    args.add_argument('--limit', type=int, default=querylimit, help='maximum characters per search')
+    args.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    args.add_argument('--nocache', action='store_true', help='plan from scratch and leave any cached plan alone')
+    args = args.parse_args(argv)
+
+    table = EventTable(args.table)
+    plan = planSearches(table, args.eventtype, args.limit, args.workers, cache=not args.nocache)
+    searches = sum(len(entry[4]) for entry in plan)
+    print('{} events, {} planned, {} searches ({} events split)'.format(
+        len(table), len(plan), searches, sum(1 for entry in plan if len(entry[4]) > 1)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# # exportIngest
+# Gets a search's results from ProQuest's citation export instead of its result pages. An export hands over up to `maxexport` results in one response, as RIS or CSV, with the source already split into publication, place, publisher, page and date, so a search needs a tenth of the requests, and no XPath or `info` parsing is done at all.
+#
+# The crawl is `asyncCrawler.py`'s: the same search, the same resume rules, the same continuation past ProQuest's 10,000-result limit and the same records, with the same provenance fields (`searchindex`, `query`, `parents`, ...). Only the results are exported, in ranges of `searchindex`, rather than read from pages. Exported records have no `info` line (`info` is `None`); the `infoParser.py` fields come from the export. Exports are read as they stream in.
+#
+# Exports are requested from `<search results>/export?format=ris&from=N&to=M`, which is where `mockProquest.py` serves them; an institution whose ProQuest exports from elsewhere only needs `exportUrl` changed.
+#
+# Usage: `python exportIngest.py QUERY D0 D1 [--format ris|csv] [--size 1000]` plus the arguments of `asyncCrawler.py`
+
+# +
+import re
+import io
+import csv
+import sys
+import asyncio
+import logging
+import datetime
+import functools
+
+from extractArticles import searchRecords, continuationDate, maxpossiblepages
+from infoParser import infofields, parseDate, normaliseSource
+from asyncCrawler import AsyncCrawler, crawl, crawlArguments
+from queryCompiler import redate
+
+maxexport = 1000 # results per export
+# -
+
+# ## Export Ranges
+# The `searchindex` ranges a search exports: the same results `wantedPages` would fetch, in blocks of `size`.
+
+# +
+def exportRanges(resultscount, meta, size=maxexport):
+    offset = int(meta['parents'])*maxpossiblepages*100
+    shown = min(resultscount, maxpossiblepages*100)
+    for first in range(1, shown + 1, size):
+        last = min(first + size - 1, shown)
+        if meta['missing'] == 'All':
+            yield first, last
+        elif any(index in meta['missing'] for index in range(first + offset, last + offset + 1)):
+            yield first, last
+        elif last == maxpossiblepages*100 and any(index > maxpossiblepages*100 for index in meta['missing']):
+            yield first, last
+
+# the search's results page 1 url, with the page swapped for the export
+def exportUrl(url, format, first, last):
+    urlparts = [url[:url.find('/1')+1], url[url.find('1?')+1:]]
+    return '{}export{}{}format={}&from={}&to={}'.format(urlparts[0], urlparts[1], '&' if '?' in urlparts[1] else '?', format, first, last)
+
+
+# -
+
+# ## Reading Exports
+# Each reader takes lines as they arrive and returns the records they complete, each as the fields `searchRecords` reads (`title`, `info`, `link`) plus the `infoParser.py` fields, and the `searchindex` of the result when its link gives one (`/docview/<id>/<search>/<index>`), or `None`.
+
+# +
+def exportDate(text):
+    text = (text or '').strip()
+    for pattern in ('%Y/%m/%d', '%Y-%m-%d', '%Y/%m/', '%Y/%m', '%Y'):
+        try:
+            return datetime.datetime.strptime(text, pattern).date().isoformat()
+        except ValueError:
+            pass
+    return parseDate(text) if text else None
+
+exportindexpattern = re.compile(r'/docview/\d+/[^/?]+/(\d+)')
+
+def exportIndex(link):
+    match = exportindexpattern.search(link or '')
+    return int(match.group(1)) if match else None
+
+def exportRecord(title, authors, publication, place, publisher, page, published, duplicate, link, edition=None, issue=None):
+    record = {'title': title or '', 'info': None, 'link': link or ''}
+    record.update({'authors': authors, 'publication': publication or None, 'edition': edition or None, 'place': place or None,
+                   'publisher': publisher or None, 'issue': issue or None, 'page': page or None, 'published': exportDate(published),
+                   'duplicate': duplicate, 'searchindex': exportIndex(link)})
+    return normaliseSource(record) # as infoParser.py reads the same fields from an info line
+
+# RIS: "TAG  - value" lines, a record ending at "ER  -"
+ristag = re.compile(r'^([A-Z][A-Z0-9])  -(?: (.*))?$')
+
+class RisReader(object):
+
+    def __init__(self):
+        self.tags = {}
+
+    def feed(self, line):
+        match = ristag.match(line.rstrip('\r\n'))
+        if not match:
+            return []
+        tag, value = match.group(1), (match.group(2) or '').strip()
+        if tag != 'ER':
+            self.tags.setdefault(tag, []).append(value)
+            return []
+        tags, self.tags = self.tags, {}
+        first = lambda *names: next((tags[name][0] for name in names if name in tags), None)
+        issue = ', '.join(part for part in ('Vol. ' + first('VL') if 'VL' in tags else None, 'Iss. ' + first('IS') if 'IS' in tags else None) if part)
+        return [exportRecord(first('TI', 'T1'), tags.get('AU', []) + tags.get('A1', []), first('JF', 'T2', 'JO'), first('CY'), first('PB'),
+                             first('SP'), first('DA', 'Y1', 'PY'), 'Duplicate' in tags.get('N1', []), first('UR', 'L2'),
+                             first('ET'), issue)]
+
+# CSV: a header row naming the columns; a record is complete once its quotes are
+class CsvReader(object):
+
+    def __init__(self):
+        self.header = None
+        self.pending = ''
+
+    def feed(self, line):
+        self.pending += line
+        if self.pending.count('"') % 2:
+            return [] # a quoted value runs on to the next line
+        row, self.pending = next(csv.reader(io.StringIO(self.pending)), None), ''
+        if not row:
+            return []
+        if self.header is None:
+            self.header = row
+            return []
+        fields = dict(zip(self.header, row))
+        return [exportRecord(fields.get('Title'), [name.strip() for name in fields.get('Authors', '').split(';') if name.strip()],
+                             fields.get('pubtitle'), fields.get('placeOfPublication'), fields.get('publisher'), fields.get('pages'),
+                             fields.get('pubdate'), fields.get('duplicate') == 'Y', fields.get('DocumentURL'))]
+
+readers = {'ris': RisReader, 'csv': CsvReader}
+
+
+# -
+
+# ## The Crawler
+# A search's first response still has to be read for its result count; everything after it is exported. A range whose export fails, or is cut short, is logged and counted (`export_failures`, `export_shortfalls`). Records are stored under the search index their link gives, or else their position in the range, but a range cut short whose records give no index isn't stored at all: there is no telling which of its results are missing, so it is left as a gap for `verifyArticles.py` to report and a repair crawl to fetch.
+
+# +
+class ExportCrawler(AsyncCrawler):
+
+    def __init__(self, *args, format='ris', size=maxexport, **kwargs):
+        AsyncCrawler.__init__(self, *args, **kwargs)
+        self.format = format
+        self.size = size
+
+    # the records of one export, read as it streams in; a failure is retried from the start
+    async def export(self, url):
+        for attempt in range(self.retries + 1):
+            reader, records = readers[self.format](), []
+            async with self.semaphore:
+                self.count('requests')
+                try:
+                    async with self.session.get(url) as response:
+                        if response.status < 500 and 'sessionexpired' not in str(response.url):
+                            async for line in response.content:
+                                records.extend(reader.feed(line.decode('utf-8')))
+                            return records
+                        status = response.status
+                except (self.aiohttp.ClientError, asyncio.TimeoutError):
+                    status = None
+            if status == 200:
+                logging.warning('Session Expiration Outcome On Export {}'.format(url))
+                self.count('session_expiries')
+                return None
+            self.count('retries')
+        logging.warning('Gave Up On {} After {} Attempts'.format(url, self.retries + 1))
+        self.count('export_failures')
+        return None
+
+    async def crawlSearch(self, meta, queue):
+        url, text = await self.search(meta)
+        extracted = await self.extract(text, url)
+        if not self.outcome(extracted, meta):
+            return
+        await asyncio.gather(*[self.crawlExport(meta, url, first, last, extracted['resultscount'], queue)
+                               for first, last in exportRanges(extracted['resultscount'], meta, self.size)])
+
+    async def crawlExport(self, meta, url, first, last, resultscount, queue):
+        received = await self.export(exportUrl(url, self.format, first, last))
+        if received is None:
+            return
+        records, numbered = received, all(record['searchindex'] is not None for record in received)
+        if len(received) != last - first + 1:
+            logging.warning('Export Of Results {}-{} Returned {} Tied To {}'.format(first, last, len(received), meta['databaseindex']))
+            self.count('export_shortfalls')
+            if not numbered:
+                records = []
+        if not numbered:
+            for searchindex, record in enumerate(records, first):
+                record['searchindex'] = searchindex
+        self.count('exports')
+
+        # the same records parse would store, with the fields the export gave in place of parsed ones
+        exported = {'resultscount': resultscount, 'records': [record for record in records if first <= record['searchindex'] <= last],
+                    'limit': resultscount > maxpossiblepages*100 and last == maxpossiblepages*100}
+        byindex = {record['searchindex']: record for record in records}
+        offset = int(meta['parents'])*maxpossiblepages*100
+        for record in searchRecords(exported, meta):
+            source = byindex[record['searchindex'] - offset]
+            record.update((field, source[field]) for field in infofields)
+            await queue.put(record)
+
+        if exported['limit']:
+            outcome, date = continuationDate({'records': received}, meta) # the dates are good however the records were numbered
+            if outcome != 'ok':
+                logging.warning('Continuation {} Tied To {}'.format('Without Dates' if outcome == 'undated' else 'Stuck On ' + date, meta['databaseindex']))
+                self.count('continuation_failures')
+                return
+            start = datetime.datetime.fromisoformat(date)
+            await self.crawlSearch(dict(meta, parents=meta['parents'] + 1, querystart=start, query=redate(meta['query'], start, meta['queryend'])), queue)
+
+
+# -
+
+# ## Command Line
+# As `asyncCrawler.py`'s, storing into the topic's `articles.jsonl`.
+
+# +
+def main(argv=None):
+    args = crawlArguments('Ingest ProQuest search results from citation exports.')
+    args.add_argument('--format', choices=sorted(readers), default='ris')
+    args.add_argument('--size', type=int, default=maxexport, help='results per export')
+    args = args.parse_args(argv)
+
+    stats = asyncio.run(crawl(args, functools.partial(ExportCrawler, format=args.format, size=args.size)))
+    print(', '.join('{} {}'.format(value, name) for name, value in sorted(stats.items())), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
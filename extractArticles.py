@@ -0,0 +1,137 @@
+# # extractArticles
+# The part of `parse` that turns a ProQuest result page into plain article records. It lives in its own module, free of side effects, so the same code can run inside the crawler, in a worker process, or over saved pages offline.
+
+# +
+import re
+
+limitstring = 'You have reached the maximum number of search results that are displayed.'
+maxpossiblepages = 100 # no more than 100 pages are ever returned
+# -
+
+# ## Reading a Result Page
+# `extractPage` only depends on the page's text and URL and returns plain Python types, so its result can be pickled back from a worker process. The `status` tells the caller which of the outcomes `parse` has to handle occurred:
+# - `'expired'`: proquest expired the session and redirected us
+# - `'absent'`: the page has no result count, so proquest refused the query for some other reason
+# - `'ok'`: the page was read and `records` holds one entry per result
+
+# +
+def extractPage(text, url):
+    from parsel import Selector # imported on first use, so modules that only need documentId start quickly
+
+    # sometimes proquest will expire the current session or refuse to fulfill a query
+    if 'sessionexpired' in url:
+        return {'status': 'expired'}
+
+    sel = Selector(text=text)
+
+    # we check if there are no results provided for some other reason
+    try:
+        resultscount = sel.xpath("//h1[@id='pqResultsCount']/text()").extract()[0]
+    except IndexError:
+        return {'status': 'absent'}
+    resultscount = int(resultscount[:resultscount.find(' ')].replace(',', ''))
+
+    # we pull the data from the results page for parsing
+    indices = sel.xpath("//li[@class='resultItem ltr']/div//span[@class='indexing']/text()").extract()
+    titles = sel.xpath("//h3/a/@title").extract()
+    links = sel.xpath("//h3/a/@href").extract()
+    info = [(' '.join(path.xpath(".//span[@class='titleAuthorETC']//text()").extract())).replace('\n', '') for path in sel.xpath("//li[@class='resultItem ltr']")]
+
+    # correct me if im wrong but i assume all of these lists are of the same length
+    assert (len(indices) + len(titles) + len(links) + len(info)) == (len(indices) + len(indices) + len(indices) + len(indices))
+
+    records = [{'searchindex': int(indices[i]), 'title': titles[i], 'info': info[i], 'link': links[i]}
+               for i in range(len(indices))]
+
+    # note whether proquest told us we hit the maximum number of displayable results
+    limit = sel.xpath("//p[@class='errorMessageHeaderText']/text()")
+    limited = bool(limit) and limitstring in limit.extract()[0]
+
+    return {'status': 'ok', 'resultscount': resultscount, 'records': records, 'limit': limited}
+
+# extractPage with every record's `info` line parsed as well (see `infoParser.py`), for extracting pages in a worker pool
+def extractEnrichedPage(text, url):
+    from infoParser import enrich # imported on first use, like parsel above
+
+    extracted = extractPage(text, url)
+    for record in extracted.get('records', ()):
+        enrich(record)
+    return extracted
+
+
+# ## Tying Results to Their Search
+# `searchRecords` turns an extracted page into the article records `parse` stores, given the `meta` of the request the page answered. A continuation search (`parents` > 0) numbers its results from 1 again, so its search indices and results count are shifted past the pages of the searches before it. When `meta['missing']` is a set of search indices rather than `'All'`, only those results are kept. Records already parsed (`extractEnrichedPage`) keep their parsed fields, and a page from a sampled crawl adds its `meta['sample']` fields to each record.
+
+# +
+def searchRecords(extracted, meta):
+    from infoParser import infofields
+
+    offset = int(meta['parents'])*maxpossiblepages*100
+    for record in extracted['records']:
+        if meta['missing'] != 'All' and record['searchindex'] + offset not in meta['missing']:
+            continue
+        result = {'databaseindex': meta['databaseindex'],
+                  'resultscount': extracted['resultscount'] + offset,
+                  'originalquery': meta['originalquery'],
+                  'originalstart': str(meta['originalstart']),
+                  'originalend': str(meta['originalend']),
+                  'query': meta['query'],
+                  'querystart': str(meta['querystart']),
+                  'queryend': str(meta['queryend']),
+                  'parents': int(meta['parents']),
+                  'querypart': int(meta.get('querypart', 0)),
+                  'searchindex': record['searchindex'] + offset,
+                  'title': record['title'],
+                  'info': record['info'],
+                  'link': record['link']}
+        result.update((field, record[field]) for field in infofields if field in record) # parsed in a worker pool
+        result.update(meta.get('sample') or {}) # how the page was picked, in a sampled crawl
+        yield result
+
+
+# -
+
+# ## Choosing Result Pages
+# `wantedPages` lists the result pages (counting from 0) a search has to fetch, given its `pqResultsCount` and `meta`: every page when `meta['missing']` is `'All'`, otherwise the pages holding a missing result, plus the last page ProQuest shows when results beyond it are missing, so the search gets continued.
+
+# +
+def wantedPages(resultscount, meta):
+    offset = int(meta['parents'])*maxpossiblepages*100
+    for page_index in range(min(resultscount // 100 + 1, maxpossiblepages)):
+        if meta['missing'] == 'All':
+            yield page_index
+        elif any(index in meta['missing'] for index in range(page_index*100 + 1 + offset, min((page_index+1)*100, resultscount) + offset + 1)):
+            yield page_index
+        elif page_index+1 == maxpossiblepages and any(index > maxpossiblepages*100 for index in meta['missing']):
+            yield page_index
+
+
+# -
+
+# ## Continuing a Search
+# A page that says the maximum number of results was reached is the last one ProQuest will show for the search. Results are sorted oldest first, so the search continues from the date of the last result shown (its `published` field when it has one, as exported records do). `continuationDate` returns `('ok', date)`, or why the search can't continue: `'undated'` when no result on the page has a date, or `'stuck'` when that date is the day the search already starts on (more results than ProQuest shows for a single day can't be narrowed down by date any further).
+
+# +
+def continuationDate(extracted, meta):
+    from infoParser import parseInfo # imported on first use, like parsel above
+
+    dates = [record['published'] if 'published' in record else parseInfo(record['info'])['published'] for record in extracted['records']]
+    dates = [d for d in dates if d is not None]
+    if not dates:
+        return 'undated', None
+    if dates[-1] <= str(meta['querystart'])[:10]:
+        return 'stuck', dates[-1]
+    return 'ok', dates[-1]
+
+
+# -
+
+# ## Identifying Documents
+# A result's link carries ProQuest's document id (`/docview/<id>/...`), which stays the same whichever search, page or position the document turns up in. Links without one fall back to the whole link.
+
+# +
+docidpattern = re.compile(r'/docview/(\d+)')
+
+def documentId(link):
+    match = docidpattern.search(link)
+    return match.group(1) if match else link
@@ -0,0 +1,69 @@
+# # fairScheduler
+# A drop-in replacement for Scrapy's scheduler priority queue. Requests still come out highest `priority` first, but within a priority they are taken round-robin from each query instead of in the order the spider yielded them, so one 10,000-result search can't starve every other query queued behind it.
+#
+# Enable it with `'SCHEDULER_PRIORITY_QUEUE': 'fairScheduler.FairPriorityQueue'`.
+
+# +
+from collections import OrderedDict, deque
+
+from scrapy.pqueues import ScrapyPriorityQueue
+# -
+
+# ## Grouping Requests
+# Requests are shared out fairly between groups. A group is one search: the event it came from, the query that started it and, for queries split into several searches, the part (`verifyArticles.queryKey`). Continuation searches stay in the group of the search they continue.
+
+def requestGroup(request):
+    meta = request.meta
+    return (meta.get('databaseindex'), meta.get('originalquery'), meta.get('querypart', 0))
+
+
+# ## The Queue
+# Scrapy's scheduler expects `push`, `pop`, `peek`, `close` and `__len__`. Each priority holds an ordered mapping of group -> requests; popping takes the first request of the first group and then moves that group to the back.
+#
+# Everything is kept in memory. When a `JOBDIR` is configured Scrapy also builds a disk-backed queue with this class; that one falls back to the stock `ScrapyPriorityQueue` so paused crawls can still be resumed.
+
+class FairPriorityQueue(object):
+
+    @classmethod
+    def from_crawler(cls, crawler, downstream_queue_cls=None, key='', startprios=(), **kwargs):
+        if key:
+            return ScrapyPriorityQueue.from_crawler(crawler, downstream_queue_cls, key, startprios, **kwargs)
+        return cls()
+
+    def __init__(self):
+        self.queues = {} # priority -> OrderedDict(group -> deque of requests)
+        self.size = 0
+
+    def push(self, request):
+        groups = self.queues.setdefault(request.priority, OrderedDict())
+        groups.setdefault(requestGroup(request), deque()).append(request)
+        self.size += 1
+
+    def pop(self):
+        if not self.queues:
+            return None
+        priority = max(self.queues)
+        groups = self.queues[priority]
+        group, requests = next(iter(groups.items()))
+        request = requests.popleft()
+        if requests:
+            groups.move_to_end(group)
+        else:
+            del groups[group]
+            if not groups:
+                del self.queues[priority]
+        self.size -= 1
+        return request
+
+    def peek(self):
+        if not self.queues:
+            return None
+        groups = self.queues[max(self.queues)]
+        return next(iter(groups.values()))[0]
+
+    # nothing to persist for an in-memory queue
+    def close(self):
+        return []
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,192 @@
+# # infoParser
+# Splits an article's `info` (the `titleAuthorETC` line of a search result) into its parts. ProQuest writes it in a few fixed shapes:
+# - print and wire sources: `Holland, Steve. North Bay Nugget ; North Bay, Ont.  [North Bay, Ont]01 May 2020: B.4.`
+# - online sources: `Hook, Janet. Los Angeles Times (Online) , Los Angeles: Los Angeles Times Communications LLC. May 1, 2020. `
+# - magazines, with an issue instead of a day: `Levy, Pema. Mother Jones ; San Francisco  Vol. 45, Iss. 3,  (May/Jun 2020): 34.`
+# - broadcast transcripts, which only list who spoke: `Brown, Jeffrey; Desjardins, Lisa; et al.`
+#
+# each optionally followed by ` [Duplicate]`. `parseInfo` returns the `authors` (a list), `publication`, `edition` (as in `New York Times , Late Edition (East Coast); ...`), `place`, `publisher`, `issue`, `page`, `published` (an ISO date; the first of the month for magazines), `duplicate` flag, and which `format` was recognised (`'print'`, `'online'`, `'periodical'`, `'byline'`, or `'unparsed'` when none was; unparsed info keeps everything in `publication`).
+#
+# The same source turns up on every result page of a search, so the part of `info` after the byline is parsed once per distinct source line and cached, as are date strings. That keeps the parser fast enough to run inline in the crawl (`InfoParserPipeline`) and to backfill existing stores:
+#
+# Usage: `python infoParser.py biden/data/articles.jsonl [--output parsed.jsonl]` (without `--output` the store is rewritten in place)
+
+# +
+import os
+import re
+import sys
+import json
+import datetime
+import argparse
+import functools
+
+from dateutil import parser
+
+infofields = ('authors', 'publication', 'edition', 'place', 'publisher', 'issue', 'page', 'published', 'duplicate')
+# -
+
+# ## Patterns
+
+# +
+publicationpattern = r'(?P<publication>.+?)(?: , (?P<edition>[^;]+?))?\s?; (?P<place>.+?)\s+'
+printpattern = re.compile(r'^' + publicationpattern + r'\[[^\]]*\]\s*(?P<date>\d{1,2} \w+\.? \d{4})(?::\s*(?P<page>.+?))?\.?\s*$')
+periodicalpattern = re.compile(r'^' + publicationpattern + r'(?P<issue>(?:Vol|Iss|No)\..*?),?\s*\((?P<date>[^)]*)\)(?::\s*(?P<page>.+?))?\.?\s*$')
+onlinepattern = re.compile(r'^(?P<publication>.+?) , (?P<place>[^:]+?): (?P<publisher>.+?)\.? (?P<date>\w+\.? \d{1,2}, \d{4})\.?\s*$')
+
+# ahead of the source, one name is either 'Last, First' or two to five capitalised words ('Chidanand Rajghatta'),
+# so a lone 'St.' or a label like 'Weblog post.' doesn't pass for an author
+namepattern = r"(?:[^,;.]+, [^,;]+|[A-ZÀ-ÖØ-Þ][\w'’-]*(?: [A-ZÀ-ÖØ-Þ][\w'’.-]*){1,4})"
+bylinepattern = re.compile(r'^{0}(?:; {0})*(?:; et al)?\.?\s*$'.format(namepattern))
+# a transcript's whole info is its speakers, so any list of several names will do
+speakerspattern = re.compile(r'^[^;]+(?:;[^;]+)+$')
+duplicatelabel = '[Duplicate]'
+sourcelabels = ('Weblog post. ',)
+# -
+
+# ## Parsing One Line
+
+# +
+@functools.lru_cache(maxsize=4096)
+def parseDate(text):
+    text = re.sub(r'/\w+', '', text.replace('.', '').replace('\xa0', ' ')).strip() # a bimonthly 'May/Jun 2020' counts from May
+    for pattern in ('%d %b %Y', '%b %d, %Y', '%B %d, %Y', '%d %B %Y', '%b %Y', '%B %Y'):
+        try:
+            return datetime.datetime.strptime(text, pattern).date().isoformat()
+        except ValueError:
+            pass
+    try:
+        return parser.parse(text, fuzzy=True).date().isoformat()
+    except (ValueError, OverflowError):
+        return None
+
+# everything after the byline, which is the same for every article from a source on a day
+@functools.lru_cache(maxsize=65536)
+def parseSource(text):
+    for format, pattern in (('print', printpattern), ('periodical', periodicalpattern), ('online', onlinepattern)):
+        match = pattern.match(text)
+        if match:
+            parts = match.groupdict()
+            return {'format': format, 'publication': parts['publication'].strip(), 'edition': parts.get('edition'),
+                    'place': parts['place'].strip(), 'publisher': parts.get('publisher'),
+                    'issue': parts['issue'].replace('\xa0', ' ').strip() if parts.get('issue') else None,
+                    'page': parts.get('page'), 'published': parseDate(parts['date'])}
+    return None
+
+# source fields given one by one (say, by a citation export) as they would have been read from an info line, where a
+# trailing '.' can't be told apart from the one that ends the line
+def normaliseSource(fields):
+    for field in ('publisher', 'page'):
+        if fields.get(field):
+            fields[field] = re.sub(r'\.?\s*$', '', fields[field].strip()) or None
+    if fields.get('issue'):
+        fields['issue'] = fields['issue'].replace('\xa0', ' ').strip().rstrip(',')
+    if fields.get('authors'):
+        fields['authors'] = splitAuthors('; '.join(fields['authors']))
+    return fields
+
+def splitAuthors(byline):
+    names = [name.strip() for name in byline.rstrip('. ').split(';')]
+    return [name for name in names if name and name != 'et al']
+
+def parseInfo(info):
+    parsed = dict(parseLine(info.strip()))
+    parsed['authors'] = list(parsed['authors']) # callers are free to change what they're given; the cache keeps its own copy
+    return parsed
+
+@functools.lru_cache(maxsize=65536)
+def parseLine(info):
+    duplicate = info.endswith(duplicatelabel)
+    if duplicate:
+        info = info[:-len(duplicatelabel)].rstrip()
+    for label in sourcelabels:
+        if info.startswith(label):
+            info = info[len(label):]
+
+    # the byline ends at the first '. ' that leaves a recognisable source behind it
+    start = 0
+    while True:
+        split = info.find('. ', start)
+        if split == -1:
+            break
+        source = parseSource(info[split + 2:])
+        if source and bylinepattern.match(info[:split]):
+            return dict(source, authors=tuple(splitAuthors(info[:split])), duplicate=duplicate)
+        start = split + 1
+
+    source = parseSource(info)
+    if source:
+        return dict(source, authors=(), duplicate=duplicate)
+    empty = dict.fromkeys(infofields)
+    if info and (bylinepattern.match(info) or speakerspattern.match(info)):
+        return dict(empty, format='byline', authors=tuple(splitAuthors(info)), duplicate=duplicate)
+    return dict(empty, format='unparsed', authors=(), publication=info or None, duplicate=duplicate)
+
+
+# -
+
+# ## Parsing Many
+# `parseInfos` takes any iterable of `info` strings and returns the parsed fields as columns, one list per field, ready for `numpy` or `pandas`.
+
+# +
+def parseInfos(infos):
+    columns = {field: [] for field in infofields + ('format',)}
+    for info in infos:
+        parsed = parseLine(info.strip())
+        for field in columns:
+            columns[field].append(list(parsed[field]) if field == 'authors' else parsed[field])
+    return columns
+
+# adds the parsed fields to a stored article (or an ArticleItem)
+def enrich(record):
+    if record.get('info') is None and 'published' in record:
+        return record # from a citation export (see exportIngest.py), which gives the fields rather than an info line
+    parsed = parseInfo(record.get('info') or '')
+    for field in infofields:
+        record[field] = parsed[field]
+    return record
+
+
+# -
+
+# ## Parsing During the Crawl
+# Add `'infoParser.InfoParserPipeline': 0` to `ITEM_PIPELINES` to store the parsed fields with every article. The item class needs a field for each name in `infofields`. Items whose pages were extracted in a worker pool (`extractEnrichedPage`) arrive parsed already, so the pipeline only parses the rest, and the reactor thread parses nothing when post-processing is on.
+
+class InfoParserPipeline(object):
+
+    def process_item(self, item, spider):
+        if 'published' in item:
+            return item # parsed in the worker pool
+        return enrich(item)
+
+
+# ## Backfilling a Store
+# Streams the store, adds the parsed fields to every record and writes them out in the same order. Rewriting in place goes through a temporary file that replaces the store only once every record has been written.
+
+# +
+def backfill(path, output=None):
+    target = output or path + '.parsing'
+    counts = {}
+    with open(path, encoding='utf-8') as f, open(target, 'w', encoding='utf-8') as out:
+        for line in f:
+            if not line.strip():
+                continue
+            record = enrich(json.loads(line))
+            format = parseLine((record.get('info') or '').strip())['format']
+            counts[format] = counts.get(format, 0) + 1
+            out.write(json.dumps(record) + '\n')
+    if output is None:
+        os.replace(target, path)
+    return counts
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description="Parse the info field of every article in an articles.jsonl store.")
+    args.add_argument('store', help='path to articles.jsonl')
+    args.add_argument('--output', help='write the parsed store here instead of rewriting it in place')
+    args = args.parse_args(argv)
+
+    counts = backfill(args.store, args.output)
+    print(', '.join('{} {}'.format(count, format) for format, count in sorted(counts.items())))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# # itemStream
+# Publishes every article the crawler stores, as it is stored, to consumers connected to a local socket, so enrichment jobs, dashboards and full-text fetchers can work on results within a second of them arriving instead of polling `articles.jsonl`. Each item is sent to every connected consumer as one JSON line, exactly as `JsonWriterPipeline` writes it to the file; a consumer sees the items stored after it connects (the file has the rest).
+#
+# Consumers that read slower than the crawl scrapes hold the crawl back rather than letting items pile up in memory: each connection is a Twisted push producer, which the transport pauses when its send buffer fills, and while any consumer is paused no further item is written and `process_item` doesn't return. Scrapy stops pulling in more responses when too many items are waiting on the pipeline, so the crawl slows to the pace of its slowest consumer. A consumer that stays paused for longer than `STREAM_TIMEOUT` seconds is disconnected so a stuck reader can't stall the crawl for good.
+#
+# Enable it with `'ITEM_PIPELINES': {..., 'itemStream.ItemStreamPipeline': 3}` (after the file writer). Settings:
+# - `STREAM_ADDRESS`: a Unix socket path (`/tmp/proquest.sock`) or a local TCP port (`9411`); without it the pipeline is turned off
+# - `STREAM_TIMEOUT`: seconds a consumer may hold up the crawl before it is dropped (default 30)
+#
+# Usage (reading): `python itemStream.py /tmp/proquest.sock [--raw] [--wait 60]`
+
+# +
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer, protocol
+
+from crawlMetrics import metrics
+# -
+
+# ## Connections
+# A connection registers itself with its transport as a streaming producer; `ready` gives a Deferred that fires once the transport wants data again. A connection that stays paused for `timeout` seconds is aborted, which also releases everything waiting on it.
+
+# +
+class StreamProtocol(protocol.Protocol):
+
+    def connectionMade(self):
+        self.paused = False
+        self.waiters = []
+        self.deadline = None
+        self.transport.registerProducer(self, True)
+        self.factory.consumers.add(self)
+        metrics.count('stream_connections')
+
+    def connectionLost(self, reason):
+        self.factory.consumers.discard(self)
+        self.resumeProducing()
+
+    # consumers have nothing to say, so anything they send is ignored
+    def dataReceived(self, data):
+        pass
+
+    def pauseProducing(self):
+        from twisted.internet import reactor # imported late so scrapy gets to choose which reactor is installed
+        self.paused = True
+        if self.deadline is None:
+            self.deadline = reactor.callLater(self.factory.timeout, self.drop)
+
+    def resumeProducing(self):
+        self.paused = False
+        if self.deadline is not None and self.deadline.active():
+            self.deadline.cancel()
+        self.deadline = None
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            waiter.callback(None)
+
+    def stopProducing(self):
+        self.resumeProducing()
+
+    def drop(self):
+        self.deadline = None
+        logging.warning('Stream Consumer Dropped After {}s Without Reading'.format(self.factory.timeout))
+        metrics.count('stream_drops')
+        self.factory.consumers.discard(self)
+        self.transport.abortConnection()
+
+    def ready(self):
+        if not self.paused:
+            return defer.succeed(None)
+        waiter = defer.Deferred()
+        self.waiters.append(waiter)
+        return waiter
+
+
+class StreamFactory(protocol.Factory):
+    protocol = StreamProtocol
+
+    def __init__(self, timeout=30):
+        self.consumers = set()
+        self.timeout = timeout
+
+
+# a path (anything with a slash in it) is a Unix socket, a number a TCP port on 127.0.0.1
+def listen(address, factory):
+    from twisted.internet import reactor # imported late so scrapy gets to choose which reactor is installed
+    address = str(address)
+    if os.sep in address or '/' in address:
+        if os.path.exists(address):
+            os.remove(address) # left behind by an earlier crawl
+        return reactor.listenUNIX(address, factory)
+    return reactor.listenTCP(int(address), factory, interface='127.0.0.1')
+
+
+# -
+
+# ## The Pipeline
+
+class ItemStreamPipeline(object):
+
+    def __init__(self, address, timeout=30):
+        self.address = address
+        self.factory = StreamFactory(timeout)
+        self.lock = defer.DeferredLock()
+        self.listener = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        address = crawler.settings.get('STREAM_ADDRESS')
+        if not address:
+            raise NotConfigured('STREAM_ADDRESS is not set')
+        return cls(address, crawler.settings.getfloat('STREAM_TIMEOUT', 30))
+
+    def open_spider(self, spider):
+        self.listener = listen(self.address, self.factory)
+        logging.warning('Streaming Articles On {}'.format(self.address))
+
+    def close_spider(self, spider):
+        for consumer in list(self.factory.consumers):
+            consumer.transport.loseConnection() # sends whatever is still buffered first
+        if self.listener is not None:
+            self.listener.stopListening() # removes a Unix socket's file too
+
+    # Scrapy hands the pipeline many items at once, so they take turns: each waits until no consumer is paused before it is written.
+    # The `stream` stage is timed until the item is written, so it includes that wait.
+    @metrics.timed('stream')
+    def process_item(self, item, spider):
+        if not self.factory.consumers:
+            return item
+        return self.lock.run(self.publish, item)
+
+    @defer.inlineCallbacks
+    def publish(self, item):
+        paused = [consumer.ready() for consumer in self.factory.consumers if consumer.paused]
+        if paused:
+            metrics.count('stream_waits')
+            yield defer.DeferredList(paused)
+        line = (json.dumps(dict(item)) + '\n').encode('utf-8')
+        for consumer in self.factory.consumers:
+            consumer.transport.write(line)
+        metrics.count('stream_items')
+        return item
+
+
+# ## Reading the Stream
+# `readStream` yields the articles a crawl streams, as dictionaries, until the crawl ends. It only needs the standard library, so consumers don't have to run Twisted or Scrapy. With `wait`, it keeps trying to connect for that many seconds, so a consumer can be started before the crawl.
+
+# +
+def connect(address, wait=0):
+    address = str(address)
+    deadline = time.time() + wait
+    while True:
+        try:
+            if os.sep in address or '/' in address:
+                connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                connection.connect(address)
+            else:
+                connection = socket.create_connection(('127.0.0.1', int(address)))
+            return connection
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.25)
+
+def readStream(address, wait=0):
+    with connect(address, wait) as connection, connection.makefile('r', encoding='utf-8') as lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Print the articles a running crawl streams.')
+    args.add_argument('address', help='the crawl\'s STREAM_ADDRESS: a Unix socket path or a local port')
+    args.add_argument('--raw', action='store_true', help='print each article as the JSON line it was sent as')
+    args.add_argument('--wait', type=float, default=0, help='seconds to keep trying to connect')
+    args = args.parse_args(argv)
+
+    count = 0
+    for article in readStream(args.address, args.wait):
+        count += 1
+        if args.raw:
+            print(json.dumps(article), flush=True)
+        else:
+            print('[{}] {} {}'.format(article.get('databaseindex', 0), article['searchindex'], article['title']), flush=True)
+    print('{} articles streamed'.format(count), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,346 @@
+# # mockProquest
+# A local stand-in for the parts of ProQuest the crawler talks to, so the scraper can be tested and benchmarked without a university login. It serves:
+# - `/auth`: a login page with the username/password fields and `postOk()` submit script `scrapeArticles.py` expects, linking to a `title='ProQuest'` home page
+# - `/advanced.showresultpageoptions`: the page that has to be visited before the search form
+# - `/news/advanced`: the advanced search form (`searchForm`, `queryTermField`, `searchToResultPage`)
+# - `/news/results/<search>/<page>`: paginated results with `pqResultsCount` and `resultItem` markup, 100 per page, capped at 100 pages with ProQuest's maximum-results message
+# - `/news/results/<search>/export?format=ris|csv&from=N&to=M`: the same results as a citation export, at most `maxexport` per request and only as far as the result pages go
+#
+# Result counts, latency, session expiry and server-error rates are configurable. Results are deterministic: the same query always returns the same documents in the same order. Responses are gzipped for clients that accept it, as ProQuest's are, unless `--nogzip` is given.
+#
+# Usage: `python mockProquest.py [--port 8765] [--results 838] [--latency 0.05] [--expiry 0.01] [--errors 0.01] [--nogzip]`
+
+# +
+import re
+import io
+import csv
+import sys
+import gzip
+import html
+import json
+import time
+import random
+import string
+import hashlib
+import argparse
+import datetime
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+resultsperpage = 100
+maxpossiblepages = 100
+maxexport = 1000
+limitstring = 'You have reached the maximum number of search results that are displayed.'
+# -
+
+# ## Fake Results
+# Titles and `titleAuthorETC` strings are built from a small pool shaped like real ProQuest output (wire services, newspapers with page numbers, online outlets, several languages, and `[Duplicate]` entries) so downstream parsing sees realistic variety.
+
+# +
+titles = ['Biden will sich Freitag erstmals zu Vorwurf sexuellen Übergriffs äußern',
+          'Trump says China wants him to lose re-election',
+          'News from around the world',
+          'Le candidat démocrate répond aux accusations',
+          'El exvicepresidente niega las acusaciones',
+          '3.8M more workers file for unemployment',
+          'How to Run for President in the Middle of a Pandemic',
+          '‘What is this clown hiding?’: senators spar over sealed records',
+          'Os democratas e a pandemia']
+sources = ['{author}AAP General News Wire ; Sydney  [Sydney]{day:%d %b %Y}.',
+           '{author}AFP International Text Wire in German ; Washington  [Washington]{day:%d %b %Y}.',
+           '{author}Portland Press Herald ; Portland, Me.  [Portland, Me]{day:%d %b %Y}: A.1.',
+           '{author}The Huffington Post , New York: AOL Inc. {day:%b} {day.day}, {day:%Y}. ',
+           '{author}El Pais ; Madrid  [Madrid]{day:%d %b %Y}: 3.',
+           '{author}CNN Wire Service ; Atlanta  [Atlanta]{day:%d %b %Y}.']
+authors = ['', '', 'Mathes, Michael. ', 'ROJAS, Daxia. ', 'Galloway, Jim; Bluestein, Greg. ']
+# what a citation export says about each of the sources above
+sourcefields = [{'publication': 'AAP General News Wire', 'place': 'Sydney'},
+                {'publication': 'AFP International Text Wire in German', 'place': 'Washington'},
+                {'publication': 'Portland Press Herald', 'place': 'Portland, Me.', 'page': 'A.1'},
+                {'publication': 'The Huffington Post', 'place': 'New York', 'publisher': 'AOL Inc.'},
+                {'publication': 'El Pais', 'place': 'Madrid', 'page': '3'},
+                {'publication': 'CNN Wire Service', 'place': 'Atlanta'}]
+
+# a stable pseudo-random stream for one query, so every visit to a page shows the same results
+def queryRandom(query, salt=''):
+    return random.Random(hashlib.sha1((salt + query).encode('utf-8')).hexdigest())
+
+# ProQuest's PD(yyyymmdd-yyyymmdd) clause, or a single day if the query has none
+def queryDates(query):
+    match = re.search(r'PD\((\d{8})-(\d{8})\)', query)
+    if not match:
+        return datetime.date(2020, 5, 1), datetime.date(2020, 5, 1)
+    return (datetime.datetime.strptime(match.group(1), '%Y%m%d').date(),
+            datetime.datetime.strptime(match.group(2), '%Y%m%d').date())
+
+# everything about one result, for its result page markup and its export
+def resultFields(query, index, total):
+    rng = queryRandom(query, str(index))
+    start, end = queryDates(query)
+    day = start + datetime.timedelta(days=(end - start).days * (index - 1) // max(total, 1)) # sorted DateAsc
+    source, author = rng.choice(range(len(sources))), rng.choice(authors)
+    duplicate = rng.random() < 0.1
+    info = sources[source].format(author=author, day=day) + (' [Duplicate]' if duplicate else '')
+    docid = 2390000000 + int(hashlib.sha1('{}\n{}'.format(query, index).encode('utf-8')).hexdigest()[:7], 16)
+    return dict(sourcefields[source], title=rng.choice(titles), info=info, docid=docid, day=day, duplicate=duplicate,
+                authors=[name.strip() for name in author.rstrip('. ').split(';') if name.strip()])
+
+def resultItem(base, search, query, index, total):
+    fields = resultFields(query, index, total)
+    return ('<li class="resultItem ltr"><div class="resultHeader"><span class="indexing">{index}</span></div>'
+            '<div class="resultContent"><h3><a title="{title}" href="{base}/news/docview/{docid}/{search}/{index}?accountid=14816">{title}</a></h3>'
+            '<span class="titleAuthorETC">{info}</span></div></li>').format(
+                base=base, index=index, title=html.escape(fields['title'], quote=True), docid=fields['docid'], search=search, info=html.escape(fields['info']))
+
+
+# -
+
+# ## Pages
+
+# +
+authpage = '''<html><body><form onsubmit="return false">
+<input id="username" name="username"><input id="password" name="password" type="password">
+<script>function postOk() { window.location = '/home'; }</script></form></body></html>'''
+homepage = '<html><body><a title="ProQuest" href="/advanced.showresultpageoptions?site=news">ProQuest</a></body></html>'
+optionspage = '<html><body><p>Result page options saved.</p></body></html>'
+searchform = '''<html><body><form id="searchForm" action="/news/results" method="post">
+<input type="text" name="queryTermField" value="">
+<input type="checkbox" name="fullTextLimit">
+<select name="sortType"><option value="relevance">Relevance</option><option value="DateAsc">Oldest first</option></select>
+<input type="checkbox" name="includeDuplicate">
+<input type="submit" id="searchToResultPage" name="searchToResultPage" value="Search">
+</form></body></html>'''
+expiredpage = '<html><body><p>Your session has expired.</p></body></html>'
+
+def resultsPage(base, search, query, page, total):
+    first = (page - 1) * resultsperpage + 1
+    last = min(page * resultsperpage, total)
+    items = ''.join(resultItem(base, search, query, index, total) for index in range(first, last + 1))
+    limit = ''
+    if page == maxpossiblepages and total > maxpossiblepages * resultsperpage:
+        limit = '<p class="errorMessageHeaderText">{} Please refine your search.</p>'.format(limitstring)
+    return ('<html><body><h1 id="pqResultsCount">{:,} results</h1>{}<ul class="resultItems">{}</ul></body></html>'
+            .format(total, limit, items))
+
+
+# -
+
+# ## Exports
+# ProQuest's RIS and CSV citation exports: one record per result, in result order, with the source's parts as separate fields rather than one `titleAuthorETC` line.
+
+# +
+def exportRis(base, search, query, first, last, total):
+    lines = []
+    for index in range(first, last + 1):
+        fields = resultFields(query, index, total)
+        lines += ['TY  - NEWS', 'TI  - ' + fields['title']]
+        lines += ['AU  - ' + name for name in fields['authors']]
+        lines += ['JF  - ' + fields['publication'], 'CY  - ' + fields['place']]
+        lines += ['PB  - ' + fields['publisher']] if 'publisher' in fields else []
+        lines += ['SP  - ' + fields['page']] if 'page' in fields else []
+        lines += ['PY  - {:%Y}'.format(fields['day']), 'DA  - {:%Y/%m/%d}'.format(fields['day'])]
+        lines += ['N1  - Duplicate'] if fields['duplicate'] else []
+        lines += ['AN  - {}'.format(fields['docid']), 'UR  - {}/news/docview/{}/{}/{}?accountid=14816'.format(base, fields['docid'], search, index), 'ER  - ', '']
+    return '\n'.join(lines) + '\n'
+
+exportcolumns = ['Title', 'Authors', 'pubtitle', 'placeOfPublication', 'publisher', 'pubdate', 'pages', 'duplicate', 'StoreId', 'DocumentURL']
+
+def exportCsv(base, search, query, first, last, total):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(exportcolumns)
+    for index in range(first, last + 1):
+        fields = resultFields(query, index, total)
+        writer.writerow([fields['title'], '; '.join(fields['authors']), fields['publication'], fields['place'], fields.get('publisher', ''),
+                         '{:%Y-%m-%d}'.format(fields['day']), fields.get('page', ''), 'Y' if fields['duplicate'] else '',
+                         fields['docid'], '{}/news/docview/{}/{}/{}?accountid=14816'.format(base, fields['docid'], search, index)])
+    return out.getvalue()
+
+exporters = {'ris': exportRis, 'csv': exportCsv}
+
+
+# -
+
+# ## The Server
+# `MockProquest` holds the configuration, the searches submitted so far and request counters; the handler only reads and updates it under a lock. `/__stats` returns the counters as JSON so a benchmark can count the requests a crawl made.
+
+# +
+class MockProquest(object):
+
+    def __init__(self, results=838, latency=0.0, expiry=0.0, errors=0.0, seed=0, compress=True):
+        self.results = results # an int, or a (low, high) range drawn from per query
+        self.compress = compress
+        self.latency = latency
+        self.expiry = expiry
+        self.errors = errors
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.searches = {}
+        self.stats = {}
+
+    # `bytes` counts body bytes as sent, `rawbytes` before compression
+    def count(self, kind, size=0, raw=None):
+        with self.lock:
+            self.stats[kind] = self.stats.get(kind, 0) + 1
+            self.stats['bytes'] = self.stats.get('bytes', 0) + size
+            self.stats['rawbytes'] = self.stats.get('rawbytes', 0) + (size if raw is None else raw)
+
+    def totalFor(self, query):
+        if isinstance(self.results, int):
+            return self.results
+        return queryRandom(query, 'count').randint(*self.results)
+
+    # search ids are letters only so the crawler's '/1' and '1?' URL splitting stays unambiguous
+    def newSearch(self, query):
+        with self.lock:
+            search = ''.join(self.random.choice(string.ascii_uppercase) for i in range(12))
+            self.searches[search] = query
+        return search
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = 'MockProquest/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def respond(self, status, body='', headers=()):
+        raw = data = body.encode('utf-8')
+        compressed = self.mock.compress and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if compressed:
+            data = gzip.compress(raw, compresslevel=6, mtime=0)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.mock.count('responses', len(data), len(raw))
+
+    def redirect(self, location):
+        self.respond(302, '', [('Location', location)])
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/__stats':
+            with self.mock.lock:
+                stats = json.dumps(self.mock.stats)
+            return self.respond(200, stats)
+
+        time.sleep(self.mock.latency)
+        self.mock.count('requests')
+        if self.mock.roll(self.mock.errors):
+            self.mock.count('errors')
+            return self.respond(500, '<html><body>Internal Server Error</body></html>')
+
+        if url.path == '/auth':
+            return self.respond(200, authpage)
+        if url.path == '/home':
+            return self.respond(200, homepage, [('Set-Cookie', 'pqsession=mock; Path=/')])
+        if url.path == '/advanced.showresultpageoptions':
+            return self.respond(200, optionspage)
+        if url.path == '/news/advanced':
+            return self.respond(200, searchform)
+        if url.path == '/sessionexpired':
+            return self.respond(200, expiredpage)
+
+        match = re.match(r'^/news/results/([A-Z]+)/export$', url.path)
+        if match:
+            search, options = match.group(1), parse_qs(url.query)
+            if search not in self.mock.searches or self.mock.roll(self.mock.expiry):
+                self.mock.count('expiries')
+                return self.redirect('/sessionexpired?site=news')
+            query = self.mock.searches[search]
+            total = self.mock.totalFor(query)
+            exporter = exporters.get(options.get('format', ['ris'])[0].lower())
+            first = int(options.get('from', ['1'])[0])
+            last = min(int(options.get('to', [str(first)])[0]), first + maxexport - 1, total, maxpossiblepages * resultsperpage)
+            if exporter is None or first < 1:
+                return self.respond(400, '<html><body>Bad Request</body></html>')
+            self.mock.count('exports')
+            return self.respond(200, exporter('http://' + self.headers.get('Host', 'localhost'), search, query, first, last, total))
+
+        match = re.match(r'^/news/results/([A-Z]+)/(\d+)$', url.path)
+        if match:
+            search, page = match.group(1), int(match.group(2))
+            if search not in self.mock.searches or self.mock.roll(self.mock.expiry):
+                self.mock.count('expiries')
+                return self.redirect('/sessionexpired?site=news')
+            query = self.mock.searches[search]
+            total = self.mock.totalFor(query)
+            if page < 1 or page > min(maxpossiblepages, (total - 1) // resultsperpage + 1):
+                return self.respond(200, '<html><body><p>No results.</p></body></html>')
+            self.mock.count('resultpages')
+            return self.respond(200, resultsPage('http://' + self.headers.get('Host', 'localhost'), search, query, page, total))
+
+        self.respond(404, '<html><body>Not Found</body></html>')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        time.sleep(self.mock.latency)
+        self.mock.count('requests')
+        if url.path != '/news/results' or not form.get('queryTermField'):
+            return self.respond(404, '<html><body>Not Found</body></html>')
+        if self.mock.roll(self.mock.errors):
+            self.mock.count('errors')
+            return self.respond(500, '<html><body>Internal Server Error</body></html>')
+        self.mock.count('searches')
+        search = self.mock.newSearch(form['queryTermField'][0])
+        self.redirect('/news/results/{}/1?accountid=14816'.format(search))
+
+
+def serve(mock, port=0):
+    server = ThreadingHTTPServer(('localhost', port), MockHandler)
+    server.daemon_threads = True
+    server.mock = mock
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# -
+
+# ## Command Line
+
+# +
+def resultsArgument(value):
+    if '-' in value:
+        low, high = value.split('-')
+        return (int(low), int(high))
+    return int(value)
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Serve a local stand-in for ProQuest.')
+    args.add_argument('--port', type=int, default=8765)
+    args.add_argument('--results', type=resultsArgument, default=838, help='results per query, or a LOW-HIGH range')
+    args.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    args.add_argument('--expiry', type=float, default=0.0, help='fraction of result pages that expire the session')
+    args.add_argument('--errors', type=float, default=0.0, help='fraction of requests answered with a 500')
+    args.add_argument('--nogzip', action='store_true', help='never compress responses')
+    args = args.parse_args(argv)
+
+    server = serve(MockProquest(args.results, args.latency, args.expiry, args.errors, compress=not args.nogzip), args.port)
+    print('Mock ProQuest at http://localhost:{}/ (auth page at /auth)'.format(server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    sys.exit(main())
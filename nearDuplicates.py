@@ -0,0 +1,242 @@
+# # nearDuplicates
+# Groups syndicated copies of the same story into clusters. The search form asks for duplicates (`includeDuplicate`), and a wire story turns up under every outlet that ran it, often with a slightly different headline ("Trump says China wants him to lose re-election" / "Trump says China wants him to lose re-election bid"). Counting clusters rather than records is what analyses of coverage need, and comparing every pair of articles is out of the question at our scale.
+#
+# Each article's title (or full text, when a record has a `text` field) is cut into shingles and summarised by a MinHash signature, whose positions agree between two articles about as often as their shingle sets overlap (Jaccard similarity). Locality-sensitive hashing splits the signature into bands and files the article under each band's value; only articles sharing a band are ever compared, and each band value holds a bounded number of them, so adding an article costs a handful of dictionary lookups and comparisons however large the index has grown. Articles whose signatures agree at least `threshold` of the time join the same cluster, joining the cluster of the one it is most like.
+#
+# Titles like "News from around the world" are reused for different stories every day, so by default articles are only clustered if their `published` dates (see `infoParser.py`) are within `window` days of each other.
+#
+# Usage: `python nearDuplicates.py biden/data/articles.jsonl [--index biden/data/nearduplicates.pickle] [--output clusters.jsonl] [--threshold 0.7]`
+
+# +
+import os
+import re
+import sys
+import json
+import zlib
+import pickle
+import datetime
+import argparse
+
+import numpy as np
+
+from extractArticles import documentId
+
+mersenne = (1 << 61) - 1
+# -
+
+# ## Signatures
+
+# +
+# lower case, no punctuation, single spaces
+def normalise(text):
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+# titles are too short for word shingles to overlap much, so they are cut into characters; full text into words
+def shingles(text, characters=5, words=3):
+    text = normalise(text)
+    tokens = text.split()
+    if len(tokens) >= 50:
+        return {' '.join(tokens[i:i + words]) for i in range(len(tokens) - words + 1)}
+    if len(text) <= characters:
+        return {text} if text else set()
+    return {text[i:i + characters] for i in range(len(text) - characters + 1)}
+
+class MinHasher(object):
+
+    def __init__(self, permutations=64, seed=0):
+        # the multipliers have to span the field: small ones barely reorder the hashes, and the minimum becomes the smallest hash
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, mersenne, size=(permutations, 1), dtype=np.int64).astype(np.uint64)
+        self.b = generator.randint(0, mersenne, size=(permutations, 1), dtype=np.int64).astype(np.uint64)
+
+    # one row of the signature per permutation: the smallest permuted shingle hash
+    def signature(self, shingleset):
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingleset), dtype=np.uint64, count=len(shingleset))
+        if not len(hashes):
+            return None
+        with np.errstate(over='ignore'): # products wrap around 2**64, as they would in C
+            permuted = (self.a * hashes + self.b) % mersenne
+        return (permuted.min(axis=1) & 0xffffffff).astype(np.uint32)
+
+
+# -
+
+# ## The Index
+# `add` files an article under its bands and returns the cluster it joined: the cluster of the most similar article already in the index, if any is similar enough, or a new cluster named after the article's own key. Clusters are never merged afterwards, so one article whose title combines two stories ("Trump says China wants him to lose re-election; President says virus is proof...") can't chain them together, and a cluster id, once handed out, keeps its meaning.
+#
+# Buckets are kept per band value and per date period (`window` days long), and an article only looks in the periods that can hold an article within `window` days of it, so titles reused every day don't pile up in one bucket. Each bucket holds one representative per cluster, its latest member, and at most `bucketsize` clusters, dropping the one that has gone longest without a new member, so adding an article compares it with a bounded number of others however many share its title. Only representatives keep their signatures and dates, which keeps the saved index small. Articles without a date are only clustered with other articles without one (with `window=None`, every article is compared regardless of date).
+
+# +
+class NearDuplicateIndex(object):
+
+    def __init__(self, threshold=0.7, bands=16, rows=4, window=3, seed=0, bucketsize=10):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.window = window
+        self.bucketsize = bucketsize
+        self.hasher = MinHasher(bands * rows, seed)
+        self.buckets = [{} for band in range(bands)] # (band value, period) -> {cluster: representative}, least recently joined first
+        self.signatures = {} # representative -> signature
+        self.dates = {} # representative -> published
+        self.references = {} # representative -> buckets it represents its cluster in
+        self.clusterof = {}
+
+    def __len__(self):
+        return len(self.clusterof)
+
+    def __contains__(self, key):
+        return key in self.clusterof
+
+    def cluster(self, key):
+        return self.clusterof[key]
+
+    def close(self, key, date):
+        if self.window is None or date is None or self.dates.get(key) is None:
+            return True
+        return abs((datetime.date.fromisoformat(date) - datetime.date.fromisoformat(self.dates[key])).days) <= self.window
+
+    # the date periods an article is filed under and looked up in
+    def period(self, date):
+        if self.window is None or date is None:
+            return None
+        return datetime.date.fromisoformat(date).toordinal() // max(self.window, 1)
+
+    def periods(self, date):
+        period = self.period(date)
+        return (None,) if period is None else (period - 1, period, period + 1)
+
+    def add(self, key, text, date=None):
+        if key in self.clusterof:
+            return self.clusterof[key]
+        self.clusterof[key] = key
+        signature = self.hasher.signature(shingles(text or ''))
+        if signature is None:
+            return key # nothing to compare on, so the article is a cluster of its own
+
+        candidates = set()
+        bands = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        for band, value in enumerate(bands):
+            for period in self.periods(date):
+                candidates.update(self.buckets[band].get((value, period), {}).values())
+
+        candidates = [candidate for candidate in candidates if self.close(candidate, date)]
+        if candidates:
+            similarities = np.mean(np.stack([self.signatures[candidate] for candidate in candidates]) == signature, axis=1)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                self.clusterof[key] = self.clusterof[candidates[best]]
+
+        self.file(key, bands, signature, date)
+        return self.clusterof[key]
+
+    # makes `key` its cluster's representative in each of its buckets
+    def file(self, key, bands, signature, date):
+        cluster, period = self.clusterof[key], self.period(date)
+        self.signatures[key] = signature
+        self.dates[key] = date
+        self.references[key] = 0
+        for band, value in enumerate(bands):
+            bucket = self.buckets[band].setdefault((value, period), {})
+            if cluster in bucket:
+                self.release(bucket.pop(cluster))
+            bucket[cluster] = key
+            self.references[key] += 1
+            if len(bucket) > self.bucketsize:
+                self.release(bucket.pop(next(iter(bucket))))
+
+    def release(self, key):
+        self.references[key] -= 1
+        if not self.references[key]:
+            del self.references[key], self.signatures[key], self.dates[key]
+
+    def clusters(self):
+        groups = {}
+        for key, cluster in self.clusterof.items():
+            groups.setdefault(cluster, []).append(key)
+        return groups
+
+    def save(self, path):
+        with open(path + '.saving', 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.saving', path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+# the text an article is clustered on and the key it is filed under; copies of one document share a key
+def articleText(record):
+    return record.get('text') or record.get('title') or ''
+
+def articleKey(record):
+    return documentId(record['link'])
+
+
+# -
+
+# ## Clustering During the Crawl
+# `NearDuplicatePipeline` runs after `InfoParserPipeline` (it needs `published`) and stores the `cluster` each article joins as it is scraped. The index is kept at the `NEARDUPLICATE_INDEX` setting between runs, so articles from later crawls join the clusters of earlier ones.
+
+class NearDuplicatePipeline(object):
+
+    def __init__(self, path=None):
+        self.path = path
+        self.index = NearDuplicateIndex.load(path) if path and os.path.exists(path) else NearDuplicateIndex()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get('NEARDUPLICATE_INDEX'))
+
+    def process_item(self, item, spider):
+        item['cluster'] = self.index.add(articleKey(item), articleText(item), item.get('published'))
+        return item
+
+    def close_spider(self, spider):
+        if self.path:
+            self.index.save(self.path)
+
+
+# ## Command Line
+# Adds every article of a store the index hasn't seen yet, then reports record, document and cluster counts per query. With `--index` the index is kept between runs, so only new articles are hashed.
+
+# +
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Cluster near-duplicate articles in an articles.jsonl store.')
+    args.add_argument('store', help='path to articles.jsonl')
+    args.add_argument('--index', help='keep the index here between runs')
+    args.add_argument('--output', help='write each document\'s cluster here as JSON lines')
+    args.add_argument('--threshold', type=float, default=0.7, help='share of signature positions that must agree')
+    args.add_argument('--window', type=int, default=3, help='days apart two articles may be and still cluster (-1: any)')
+    args = args.parse_args(argv)
+
+    if args.index and os.path.exists(args.index):
+        index = NearDuplicateIndex.load(args.index)
+    else:
+        index = NearDuplicateIndex(args.threshold, window=None if args.window < 0 else args.window)
+
+    queries = {}
+    with open(args.store, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            key = articleKey(record)
+            index.add(key, articleText(record), record.get('published'))
+            queries.setdefault((record.get('databaseindex', 0), record['originalquery']), []).append(key)
+
+    for (databaseindex, originalquery), keys in queries.items():
+        print('[{}] {}'.format(databaseindex, originalquery))
+        print('    {} records, {} documents, {} clusters'.format(len(keys), len(set(keys)), len({index.cluster(key) for key in keys})))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for key, cluster in index.clusterof.items():
+                f.write(json.dumps({'document': key, 'cluster': cluster}) + '\n')
+    if args.index:
+        index.save(args.index)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
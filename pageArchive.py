@@ -0,0 +1,52 @@
+# # pageArchive
+# Keeps the raw result pages the crawler receives so they can be replayed offline: for profiling, for regression checks, or to rebuild a dataset after the extraction code changes. Each page is stored gzipped under the archive directory, and `index.jsonl` records, in the order pages arrived, which file holds which URL along with the search details (`meta`) the page was requested with.
+
+# +
+import os
+import gzip
+import json
+import hashlib
+
+# the parts of a request's meta that describe the search, and how a sampled page was picked; everything else is crawl state
+metafields = ('originalquery', 'query', 'databaseindex', 'originalstart', 'originalend', 'querystart', 'queryend', 'parents', 'querypart', 'sample')
+# -
+
+# ## Writing Pages
+
+class PageArchive(object):
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index = open(os.path.join(path, 'index.jsonl'), 'a', encoding='utf-8')
+
+    # stores a page received by `stage` (the callback name) and returns its file name
+    def save(self, stage, url, text, meta):
+        meta = {field: meta[field] if isinstance(meta[field], (int, float, dict)) else str(meta[field])
+                for field in metafields if field in meta}
+        name = hashlib.sha1('{}\n{}\n{}'.format(stage, url, json.dumps(meta, sort_keys=True)).encode('utf-8')).hexdigest()[:20] + '.html.gz'
+        with gzip.open(os.path.join(self.path, name), 'wt', encoding='utf-8') as f:
+            f.write(text)
+        self.index.write(json.dumps({'file': name, 'stage': stage, 'url': url, 'meta': meta}) + '\n')
+        self.index.flush()
+        return name
+
+    def close(self):
+        self.index.close()
+
+
+# ## Reading Pages Back
+# `readArchive` yields index entries in arrival order; `loadPage` returns the text of one of them. They are separate so a caller can hand entries to worker processes and have each load its own pages.
+
+# +
+def readArchive(path, stage=None):
+    with open(os.path.join(path, 'index.jsonl'), encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if stage is None or entry['stage'] == stage:
+                    yield entry
+
+def loadPage(path, entry):
+    with gzip.open(os.path.join(path, entry['file']), 'rt', encoding='utf-8') as f:
+        return f.read()
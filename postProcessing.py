@@ -0,0 +1,87 @@
+# # postProcessing
+# Helpers for moving CPU-heavy work out of the Twisted reactor thread. While a callback is busy parsing a page the reactor cannot send or receive anything, so long parses show up directly as lost network throughput. `PostProcessor` hands work to a thread or process pool and gives the result back to the reactor as a `Deferred`; `ReactorLagMonitor` measures how late the reactor is running so we can tell whether that's working.
+
+# +
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from twisted.internet import defer, task
+# -
+
+# ## Offloading Work
+# At most `maxpending` jobs are handed to the pool at once; further jobs wait on a `DeferredSemaphore` inside the reactor rather than piling up pickled pages in the executor's queue.
+
+class PostProcessor(object):
+
+    def __init__(self, kind='process', workers=4, maxpending=None):
+        if kind == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        elif kind == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError("post-processing kind must be 'process' or 'thread', not {!r}".format(kind))
+        self.kind = kind
+        self.semaphore = defer.DeferredSemaphore(maxpending or workers * 2)
+
+    # returns a Deferred firing with fn(*args) once a worker has computed it
+    def submit(self, fn, *args):
+        return self.semaphore.run(self._submit, fn, *args)
+
+    def _submit(self, fn, *args):
+        from twisted.internet import reactor # imported late so scrapy gets to choose which reactor is installed
+        d = defer.Deferred()
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda f: reactor.callFromThread(self._fire, d, f))
+        return d
+
+    @staticmethod
+    def _fire(d, future):
+        try:
+            d.callback(future.result())
+        except Exception as e:
+            d.errback(e)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ## Measuring Reactor Latency
+# A `LoopingCall` asks to run every `interval` seconds; how much later than scheduled it actually runs is time the reactor spent stuck in a callback. We keep the worst and average lag and warn whenever a single stall exceeds `threshold`.
+
+class ReactorLagMonitor(object):
+
+    def __init__(self, interval=0.05, threshold=0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.stalls = 0
+        self.loop = None
+
+    def start(self):
+        if self.loop is None:
+            self.last = time.monotonic()
+            self.loop = task.LoopingCall(self._tick)
+            self.loop.start(self.interval, now=False)
+
+    def _tick(self):
+        now = time.monotonic()
+        lag = max(now - self.last - self.interval, 0.0)
+        self.last = now
+        self.samples += 1
+        self.total += lag
+        self.worst = max(self.worst, lag)
+        if lag > self.threshold:
+            self.stalls += 1
+            logging.warning('Reactor Stalled For {:.3f}s'.format(lag))
+
+    def stop(self):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.loop = None
+
+    def summary(self):
+        return {'samples': self.samples, 'meanlag': self.total / self.samples if self.samples else 0.0,
+                'worstlag': self.worst, 'stalls': self.stalls}
@@ -0,0 +1,205 @@
+# # profileStages
+# A profiling mode for the crawl: CPU profiles (`cProfile`) and, optionally, memory-allocation snapshots (`tracemalloc`) are taken around each spider callback and the writer pipeline, kept separately per stage, and summarised as a ranked report of hot spots. The report also groups time by library so it's obvious at a glance whether XPath evaluation, NumPy, JSON encoding or date parsing dominates.
+#
+# Callbacks are wrapped with `profiler.profiled(stage)`. Generator callbacks are only profiled while they are actually running, so a stage never overlaps with the pipeline processing the items it yielded; asynchronous generator callbacks likewise for each step they run between awaits, so what the reactor does while they wait (other callbacks, say) isn't theirs, and neither is work they hand to a pool. A stage run from inside another (`parse` called from `parsePages` with `--lean`) is profiled as itself, and its time taken out of the outer stage's.
+#
+# Tracing memory (`tracememory=True`, `--profilememory` in `scrapeArticles.py`) adds peak memory per stage and sampled allocation sites to the report, but `tracemalloc` records every allocation, and the sampled heap snapshots are slower still: it makes a crawl or replay one to two orders of magnitude slower (a 1,200-record replay takes over a minute with it and about a second without), so it's off unless asked for.
+
+# +
+import io
+import time
+import pstats
+import inspect
+import cProfile
+import functools
+import tracemalloc
+
+# which library a profiled function belongs to, judged by the file it lives in; first match wins
+categories = (('xpath', ('lxml', 'parsel', 'cssselect', 'w3lib')),
+              ('numpy', ('numpy',)),
+              ('json', ('json',)),
+              ('dateparsing', ('dateutil', '_strptime')),
+              ('scrapy', ('scrapy', 'twisted')))
+# -
+
+# ## Collecting Profiles
+# Only one `cProfile` profile can be enabled at a time, so the profiler keeps a stack of the stages running: entering a stage pauses the one below it, and leaving it resumes it.
+
+# +
+class StageProfiler(object):
+
+    # snapshotting the whole heap is slow, so allocation sites are only recorded for every `snapshotevery`th run of a stage
+    def __init__(self, tracememory=False, snapshotevery=50):
+        self.tracememory = tracememory
+        self.snapshotevery = snapshotevery
+        self.profiles = {}  # stage -> cProfile.Profile
+        self.walltime = {}  # stage -> seconds
+        self.calls = {}     # stage -> number of profiled runs
+        self.peak = {}      # stage -> largest growth in traced memory during a single step, in bytes
+        self.allocated = {} # stage -> {allocation site: bytes}, from sampled runs
+        self.running = []   # [stage, start, seconds spent in stages entered from it] of the stages running, innermost last
+        if tracememory and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+
+    # counts a new run of a stage and decides whether its allocation sites are sampled
+    def _run(self, stage):
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        return self.tracememory and self.calls[stage] % self.snapshotevery == 1
+
+    def _enter(self, stage, sampled):
+        if stage not in self.profiles:
+            self.profiles[stage] = cProfile.Profile()
+        if self.running:
+            self.profiles[self.running[-1][0]].disable()
+        nested = bool(self.running)
+        before = tracemalloc.take_snapshot() if sampled and not nested else None
+        current = None
+        if self.tracememory and not nested: # resetting the peak would spoil the outer stage's
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+        self.running.append([stage, time.perf_counter(), 0.0])
+        self.profiles[stage].enable()
+        return current, before
+
+    def _exit(self, stage, started):
+        self.profiles[stage].disable()
+        stage, start, inner = self.running.pop()
+        elapsed = time.perf_counter() - start
+        self.walltime[stage] = self.walltime.get(stage, 0.0) + elapsed - inner
+        if self.running:
+            self.running[-1][2] += elapsed
+            self.profiles[self.running[-1][0]].enable()
+        current, before = started
+        if current is not None:
+            self.peak[stage] = max(self.peak.get(stage, 0), tracemalloc.get_traced_memory()[1] - current)
+        if before is not None:
+            sites = self.allocated.setdefault(stage, {})
+            for diff in tracemalloc.take_snapshot().compare_to(before, 'lineno'):
+                if diff.size_diff > 0:
+                    site = str(diff.traceback[0])
+                    sites[site] = sites.get(site, 0) + diff.size_diff
+
+    # wraps a callback or pipeline method so it is profiled under `stage`
+    def profiled(self, stage):
+        def decorator(fn):
+            if inspect.isasyncgenfunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    sampled = [self._run(stage)]
+                    generator = fn(*args, **kwargs)
+                    while True:
+                        try:
+                            result = await ProfiledAwaitable(self, stage, generator.__anext__(), sampled)
+                        except StopAsyncIteration:
+                            return
+                        yield result
+                return wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                sampled = self._run(stage)
+                started = self._enter(stage, sampled)
+                try:
+                    result = fn(*args, **kwargs)
+                finally:
+                    self._exit(stage, started)
+                if inspect.isgenerator(result):
+                    return self._profiledGenerator(stage, result, sampled)
+                return result
+            return wrapper
+        return decorator
+
+    # a sampled run only snapshots its first step, which for our callbacks is where the page gets parsed
+    def _profiledGenerator(self, stage, generator, sampled):
+        while True:
+            started = self._enter(stage, sampled)
+            sampled = False
+            try:
+                result = next(generator)
+            except StopIteration:
+                return
+            finally:
+                self._exit(stage, started)
+            yield result
+
+
+# awaits `awaitable` with each of its steps profiled under `stage`, and none of the time it spends suspended
+class ProfiledAwaitable(object):
+
+    def __init__(self, profiler, stage, awaitable, sampled):
+        self.profiler = profiler
+        self.stage = stage
+        self.awaitable = awaitable
+        self.sampled = sampled # [bool], shared by the steps of one run so only its first is sampled
+
+    def __await__(self):
+        steps = self.awaitable.__await__()
+        value, error = None, None
+        while True:
+            started = self.profiler._enter(self.stage, self.sampled[0])
+            self.sampled[0] = False
+            try:
+                suspended = steps.throw(error) if error is not None else steps.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profiler._exit(self.stage, started)
+            try:
+                value, error = (yield suspended), None
+            except BaseException as raised:
+                value, error = None, raised
+
+
+# -
+
+# ## Reporting
+# Functions are ranked by their own time (`tottime`) so the report points at the code that is actually burning CPU rather than at the callbacks that happen to call it.
+
+# +
+def categorise(filename):
+    for category, markers in categories:
+        if any(marker in filename for marker in markers):
+            return category
+    return 'other'
+
+def report(profiler, top=25):
+    out = io.StringIO()
+    total = sum(profiler.walltime.values()) or 1.0
+
+    out.write('Per-stage wall time\n')
+    for stage, seconds in sorted(profiler.walltime.items(), key=lambda kv: -kv[1]):
+        out.write('  {:<12} {:9.3f}s {:6.1%} over {} runs{}\n'.format(
+            stage, seconds, seconds / total, profiler.calls.get(stage, 0),
+            ', peak {:.1f} KiB'.format(profiler.peak.get(stage, 0) / 1024) if profiler.tracememory else ''))
+
+    for stage, profile in sorted(profiler.profiles.items(), key=lambda kv: -profiler.walltime.get(kv[0], 0)):
+        stats = {key: value for key, value in pstats.Stats(profile).stats.items() if key[0] != __file__}
+        bycategory = {}
+        for (filename, line, name), (cc, nc, tottime, cumtime, callers) in stats.items():
+            category = categorise(filename)
+            bycategory[category] = bycategory.get(category, 0.0) + tottime
+        stagetotal = sum(bycategory.values()) or 1.0
+
+        out.write('\n[{}] time by library\n'.format(stage))
+        for category, seconds in sorted(bycategory.items(), key=lambda kv: -kv[1]):
+            out.write('  {:<12} {:9.3f}s {:6.1%}\n'.format(category, seconds, seconds / stagetotal))
+
+        out.write('[{}] hottest functions (own time)\n'.format(stage))
+        ranked = sorted(stats.items(), key=lambda kv: -kv[1][2])[:top]
+        for (filename, line, name), (cc, nc, tottime, cumtime, callers) in ranked:
+            out.write('  {:9.3f}s {:9.3f}s cum {:>8} calls  {}:{}({})\n'.format(tottime, cumtime, nc, filename, line, name))
+
+        if stage in profiler.allocated:
+            out.write('[{}] largest allocation sites (sampled runs)\n'.format(stage))
+            for site, size in sorted(profiler.allocated[stage].items(), key=lambda kv: -kv[1])[:top // 2]:
+                out.write('  {:>10.1f} KiB  {}\n'.format(size / 1024, site))
+
+    return out.getvalue()
+
+def writeReport(profiler, path, top=25):
+    text = report(profiler, top)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    for stage, profile in profiler.profiles.items():
+        profile.dump_stats('{}.{}.prof'.format(path.rsplit('.', 1)[0], stage))
+    return text
@@ -0,0 +1,320 @@
+# # queryCompiler
+# Turns ProQuest boolean queries into small trees so they can be cleaned up and measured before they are sent. Generated queries (see `searchGenerators.py`) grow combinatorially: `xof` builds a `NEAR/200` clause for every pair in every combination of keyword groups, so the same sub-clauses show up over and over and an event with many keyword groups produces a query ProQuest either rejects or runs very slowly.
+#
+# Compiling a query
+# - removes blank and repeated clauses, and treats `a NEAR/n b` and `b NEAR/n a` as the same clause
+# - factors conjuncts shared by every branch of an `OR` out in front of it, and drops branches another branch already covers
+# - measures the result, and if it is longer than `querylimit` characters splits it into several searches whose results together are exactly the results of the original query
+#
+# The searches a query was split into overlap, so the same document can be returned by more than one of them. Every stored article keeps the `originalquery` it was collected for and the `querypart` that found it; `mergeParts` merges the parts back into one deduplicated set of documents.
+
+# +
+import re
+import logging
+import functools
+
+from extractArticles import documentId
+
+querylimit = 1000 # characters per search
+# -
+
+# ## Building Queries
+# A query is either a string (a term, a quoted phrase, or anything else ProQuest reads as a single operand) or a tuple:
+# - `('OR', clauses)` and `('AND', clauses)`, where `clauses` is a tuple
+# - `('NEAR', operator, a, b)`, where `operator` is the proximity operator as written, e.g. `'NEAR/200'` or `'PRE/3'`
+# - `('NOT', a, b)`
+# - `('FIELD', code, clause)` for field codes such as `PD(20200501-20200502)` or `FT(shooting)`
+#
+# Tuples are hashable, so compiled queries can be cached and repeated clauses found with a dictionary. Always build them with the functions below, which keep them normalised.
+
+# +
+def anyof(*clauses):
+    return combine('OR', clauses)
+
+def allof(*clauses):
+    return combine('AND', clauses)
+
+def near(a, b, distance=200):
+    return proximity('NEAR/{}'.format(distance), a, b)
+
+def field(code, clause):
+    return ('FIELD', code, clause) if clause else ''
+
+# ProQuest's publication date clause; articles published on d0 up to and including d1
+def publicationDates(d0, d1):
+    return field('PD', '{}-{}'.format(d0.strftime('%Y%m%d'), d1.strftime('%Y%m%d')))
+
+def proximity(operator, a, b):
+    if not a or not b:
+        return a or b
+    if a == b:
+        return a
+    # NEAR doesn't care about order, so give both orders the same form; PRE does
+    if operator.startswith(('NEAR', 'N/')) and render(b) < render(a):
+        a, b = b, a
+    return ('NEAR', operator, a, b)
+
+def combine(op, clauses):
+    flat = []
+    for clause in clauses:
+        if not clause:
+            continue
+        if isinstance(clause, tuple) and clause[0] == op:
+            flat.extend(clause[1])
+        else:
+            flat.append(clause)
+    flat = tuple(dict.fromkeys(flat)) # drops repeats, keeps the first occurrence's position
+    if op == 'OR' and len(flat) > 1:
+        return factor(flat)
+    if not flat:
+        return ''
+    return flat[0] if len(flat) == 1 else (op, flat)
+
+# the clauses a query requires, as a set
+def conjuncts(clause):
+    return frozenset(clause[1]) if isinstance(clause, tuple) and clause[0] == 'AND' else frozenset([clause])
+
+# (a AND b) OR (a AND c)  ->  a AND (b OR c), and  a OR (a AND b)  ->  a
+def factor(branches):
+    sets = [conjuncts(branch) for branch in branches]
+
+    # a branch requiring everything another (shorter) branch requires, and more, adds no results
+    if len(set(map(len, sets))) > 1:
+        kept = [branch for branch, s in zip(branches, sets) if not any(other < s for other in sets)]
+        if len(kept) < len(branches):
+            return anyof(*kept)
+
+    common = frozenset.intersection(*sets)
+    if not common:
+        return ('OR', branches)
+    shared = [clause for clause in orderedConjuncts(branches[0]) if clause in common]
+    rest = [allof(*[clause for clause in orderedConjuncts(branch) if clause not in common]) for branch in branches]
+    if not all(rest):
+        return allof(*shared)
+    return allof(*shared, anyof(*rest))
+
+def orderedConjuncts(clause):
+    return clause[1] if isinstance(clause, tuple) and clause[0] == 'AND' else (clause,)
+
+
+# -
+
+# ## Writing Queries Out
+
+# +
+@functools.lru_cache(maxsize=65536)
+def render(query):
+    if isinstance(query, str):
+        return query
+    if query[0] == 'FIELD':
+        return '{}({})'.format(query[1], render(query[2]))
+    if query[0] == 'NEAR':
+        return '{} {} {}'.format(operand(query[2]), query[1], operand(query[3]))
+    if query[0] == 'NOT':
+        return '{} NOT {}'.format(operand(query[1]), operand(query[2]))
+    return ' {} '.format(query[0]).join(operand(clause) for clause in query[1])
+
+def operand(query):
+    if isinstance(query, str) or query[0] == 'FIELD':
+        return render(query)
+    return '(' + render(query) + ')'
+
+def querySize(query):
+    return len(render(query))
+
+# a query string that remembers the tree it was written out from, so compiling it doesn't have to parse it again
+class Query(str):
+
+    def __new__(cls, tree):
+        query = str.__new__(cls, render(tree))
+        query.tree = tree
+        return query
+
+
+# -
+
+# ## Reading Queries In
+# Queries typed into the notebook (like `search_query`) are parsed into the same trees. Operators bind in ProQuest's order: `PRE`/`NEAR` first, then `AND`, `OR` and finally `NOT`. Neighbouring words without an operator between them are kept together as one operand, as ProQuest reads them.
+
+# +
+tokenpattern = re.compile(r'\s*(?:(?!(?:AND|OR|NOT)\()([A-Z]{2,6})\(|(\()|(\))|("[^"]*")|((?:NEAR|PRE|N|P)/\d+)|([^\s()"]+))')
+operators = ('AND', 'OR', 'NOT')
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = tokenpattern.match(text, position)
+        if not match or match.end() == position:
+            raise ValueError('could not read query {!r} at position {}'.format(text, position))
+        code, opening, closing, phrase, proximal, word = match.groups()
+        if code:
+            tokens.append(('field', code))
+        elif opening:
+            tokens.append(('(', opening))
+        elif closing:
+            tokens.append((')', closing))
+        elif proximal:
+            tokens.append(('near', proximal))
+        elif word in operators:
+            tokens.append((word, word))
+        else:
+            tokens.append(('term', phrase or word))
+        position = match.end()
+    return tokens
+
+class QueryParser(object):
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self, kind):
+        if self.peek() != kind:
+            raise ValueError('expected {} in query {!r} at token {}'.format(kind, self.text, self.position))
+        self.position += 1
+        return self.tokens[self.position - 1][1]
+
+    def parse(self):
+        query = self.negation()
+        if self.peek() is not None:
+            raise ValueError('unexpected {!r} in query {!r}'.format(self.tokens[self.position][1], self.text))
+        return query
+
+    def negation(self):
+        query = self.disjunction()
+        while self.peek() == 'NOT':
+            self.take('NOT')
+            query = ('NOT', query, self.disjunction())
+        return query
+
+    def disjunction(self):
+        clauses = [self.conjunction()]
+        while self.peek() == 'OR':
+            self.take('OR')
+            clauses.append(self.conjunction())
+        return anyof(*clauses)
+
+    def conjunction(self):
+        clauses = [self.proximity()]
+        while self.peek() == 'AND':
+            self.take('AND')
+            clauses.append(self.proximity())
+        return allof(*clauses)
+
+    def proximity(self):
+        query = self.operand()
+        while self.peek() == 'near':
+            query = proximity(self.take('near'), query, self.operand())
+        return query
+
+    def operand(self):
+        if self.peek() == '(':
+            self.take('(')
+            query = self.negation()
+            self.take(')')
+            return query
+        if self.peek() == 'field':
+            code = self.take('field')
+            query = field(code, self.negation())
+            self.take(')')
+            return query
+        words = [self.take('term')]
+        while self.peek() == 'term':
+            words.append(self.take('term'))
+        return ' '.join(words)
+
+@functools.lru_cache(maxsize=4096)
+def parseQuery(text):
+    return QueryParser(text).parse()
+
+
+# -
+
+# ## Splitting Long Queries
+# An `OR` is split by packing its branches, in order, into as few groups under the limit as possible. An `AND` is split by splitting its longest `OR` and requiring everything else alongside each part, which is how the date clause ends up in every search. Anything else (a single `NEAR`, `NOT` or term over the limit) can't be split, so it is searched as it is and a warning is logged.
+
+# +
+def splitQuery(query, limit=querylimit):
+    if querySize(query) <= limit:
+        return [query]
+
+    if query[0] == 'OR':
+        # a group's size is counted as its branches joined by ' OR '; factoring the group can only make it shorter
+        groups, group, size = [], [], 0
+        for clause in query[1]:
+            clausesize = len(operand(clause))
+            if group and size + 4 + clausesize > limit:
+                groups.append(anyof(*group))
+                group, size = [], -4
+            group.append(clause)
+            size += 4 + clausesize if len(group) > 1 else clausesize
+        groups.append(anyof(*group))
+        return [part for group in groups for part in splitQuery(group, limit)]
+
+    if query[0] == 'AND':
+        branches = [clause for clause in query[1] if isinstance(clause, tuple) and clause[0] == 'OR']
+        if branches:
+            longest = max(branches, key=querySize)
+            rest = [clause for clause in query[1] if clause is not longest]
+            overhead = querySize(allof(*rest, 'x')) + 1 # 'x' stands in for the part, which also gets parentheses
+            parts = splitQuery(longest, max(limit - overhead, 1))
+            return [split for part in parts for split in splitQuery(allof(*rest, part), limit)]
+
+    logging.warning('Query Of {} Characters Cannot Be Split Under {}: {}'.format(querySize(query), limit, render(query)[:200]))
+    return [query]
+
+
+# -
+
+# ## Compiling a Search
+# The date clause is set aside while the rest of the query is compiled, and compiled clauses are cached. An event's continuation searches (see `parse`) differ from its first search only in their dates, so every search for an event after the first reuses the compiled clause and the split.
+
+# +
+@functools.lru_cache(maxsize=4096)
+def compileClause(clause, limit):
+    return tuple(splitQuery(clause, limit))
+
+# splits a query's top-level PD(...) clause from the rest
+def separateDates(query):
+    if isinstance(query, tuple) and query[0] == 'FIELD' and query[1] == 'PD':
+        return query, ''
+    if isinstance(query, tuple) and query[0] == 'AND':
+        dates = [clause for clause in query[1] if isinstance(clause, tuple) and clause[0] == 'FIELD' and clause[1] == 'PD']
+        if len(dates) == 1:
+            return dates[0], allof(*[clause for clause in query[1] if clause is not dates[0]])
+    return None, query
+
+# the searches to run for `query`, as ProQuest query strings, each at most `limit` characters where possible
+def compileSearch(query, limit=querylimit):
+    dates, clause = separateDates(query.tree if isinstance(query, Query) else parseQuery(query))
+    if not clause:
+        return [render(dates)]
+    budget = limit - querySize(allof(dates, 'x')) - 1 if dates else limit
+    return [render(allof(dates, part)) for part in compileClause(clause, max(budget, 1))]
+
+# the same search over different dates
+def redate(query, d0, d1):
+    dates = publicationDates(d0, d1)
+    if re.search(r'PD\(\d{8}-\d{8}\)', query):
+        return re.sub(r'PD\(\d{8}-\d{8}\)', render(dates), query, count=1)
+    return render(allof(dates, parseQuery(query)))
+
+
+# -
+
+# ## Merging Split Searches
+# Yields each document once per event and original query, whichever part (or continuation) found it first.
+
+def mergeParts(records):
+    seen = set()
+    for record in records:
+        key = (record.get('databaseindex', 0), record['originalquery'], documentId(record['link']))
+        if key not in seen:
+            seen.add(key)
+            yield record
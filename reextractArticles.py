@@ -0,0 +1,145 @@
+# # reextractArticles
+# Rebuilds a dataset from the raw result pages kept by `pageArchive.py`, without touching the network, after the extraction or enrichment code changes (new `info` parsing, date rules, ...). Saved result pages are read by a pool of worker processes, each loading its own pages, running `extractPage` and `searchRecords` (the same code `parse` runs, with the same `searchindex`/`parents` numbering) and adding the `infoParser.py` fields. The main process writes the records out in the order the pages arrived, so the rebuilt store reads the same as one the crawler would have written.
+#
+# Pages are handed out in batches; after each batch is written a checkpoint records how far the rebuild got, so an interrupted run picks up where it stopped. A result saved more than once (a page fetched again by a repair crawl, say) is only written the first time. Near-duplicate clusters aren't assigned here; run `nearDuplicates.py` over the rebuilt store.
+#
+# Usage: `python reextractArticles.py biden/data/pages [--output biden/data/reextracted.jsonl] [--workers 8] [--restart]`
+
+# +
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+from extractArticles import extractPage, searchRecords
+from pageArchive import readArchive, loadPage
+from infoParser import enrich
+# -
+
+# ## Re-extracting Pages
+# A worker gets a chunk of index entries and returns, for each, the page's status and its records. Pages are re-extracted as if nothing had been stored yet (`missing` is `'All'`), as in the notebook's offline replay.
+
+# +
+def reextractChunk(path, entries):
+    results = []
+    for entry in entries:
+        extracted = extractPage(loadPage(path, entry), entry['url'])
+        if extracted['status'] != 'ok':
+            results.append((extracted['status'], []))
+            continue
+        records = [enrich(record) for record in searchRecords(extracted, dict(entry['meta'], missing='All'))]
+        results.append(('limited' if extracted['limit'] else 'ok', records))
+    return results
+
+# a result is the same result when the same search part numbers it the same
+def resultKey(record):
+    return (record['databaseindex'], record['originalquery'], record['querypart'], record['searchindex'])
+
+
+# -
+
+# ## Checkpoints
+# The checkpoint sits next to the output and holds the number of index entries done and the size of the output after them. Resuming cuts the output back to that size (dropping anything written after the last checkpoint) and skips that many entries.
+
+# +
+def readCheckpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def writeCheckpoint(path, checkpoint):
+    with open(path + '.saving', 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.saving', path)
+
+def storedKeys(path, size):
+    keys = set()
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+        for line in f:
+            if line.strip():
+                keys.add(resultKey(json.loads(line)))
+    return keys
+
+
+# -
+
+# ## Rebuilding a Store
+
+# +
+def reextract(archive, output, workers=None, chunksize=20, restart=False):
+    checkpointpath = output + '.checkpoint'
+    checkpoint = None if restart else readCheckpoint(checkpointpath)
+    if checkpoint is not None and checkpoint['archive'] != os.path.abspath(archive):
+        raise ValueError('{} is a checkpoint for {}, not {}; pass --restart to start over'.format(checkpointpath, checkpoint['archive'], archive))
+    if checkpoint is None or not os.path.exists(output):
+        checkpoint = {'archive': os.path.abspath(archive), 'entries': 0, 'size': 0, 'counts': {}}
+        open(output, 'w').close()
+    seen = storedKeys(output, checkpoint['size'])
+
+    entries = list(readArchive(archive, stage='parse'))
+    remaining = entries[checkpoint['entries']:]
+    workers = workers or os.cpu_count() or 1
+    batchsize = chunksize * workers * 4 # enough to keep every worker busy, small enough to checkpoint often
+    counts = checkpoint['counts']
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    start = time.time()
+    with open(output, 'a', encoding='utf-8') as out, tqdm(total=len(entries), initial=checkpoint['entries']) as progress:
+        for first in range(0, len(remaining), batchsize):
+            batch = remaining[first:first + batchsize]
+            chunks = [batch[i:i + chunksize] for i in range(0, len(batch), chunksize)]
+            if executor is None:
+                results = map(reextractChunk, itertools.repeat(archive), chunks)
+            else:
+                results = executor.map(reextractChunk, itertools.repeat(archive), chunks)
+
+            for status, records in itertools.chain.from_iterable(results):
+                counts[status] = counts.get(status, 0) + 1
+                for record in records:
+                    key = resultKey(record)
+                    if key in seen:
+                        counts['repeats'] = counts.get('repeats', 0) + 1
+                        continue
+                    seen.add(key)
+                    out.write(json.dumps(record) + '\n')
+                    counts['records'] = counts.get('records', 0) + 1
+
+            out.flush()
+            checkpoint['entries'] += len(batch)
+            checkpoint['size'] = out.tell()
+            writeCheckpoint(checkpointpath, checkpoint)
+            progress.update(len(batch))
+    if executor is not None:
+        executor.shutdown()
+    return counts, time.time() - start
+
+
+# -
+
+# ## Command Line
+
+# +
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Rebuild an articles.jsonl store from archived result pages.')
+    args.add_argument('archive', help='page archive directory (the one holding index.jsonl)')
+    args.add_argument('--output', help='where to write the rebuilt store (default: reextracted.jsonl beside the archive)')
+    args.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    args.add_argument('--chunksize', type=int, default=20, help='pages handed to a worker at a time')
+    args.add_argument('--restart', action='store_true', help='ignore any checkpoint and rebuild from the first page')
+    args = args.parse_args(argv)
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(args.archive)), 'reextracted.jsonl')
+    counts, seconds = reextract(args.archive, output, args.workers, args.chunksize, args.restart)
+    print('{} records written to {} in {:.1f}s'.format(counts.get('records', 0), output, seconds))
+    print(', '.join('{} {}'.format(count, status) for status, count in sorted(counts.items()) if status != 'records'))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
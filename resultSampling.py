@@ -0,0 +1,169 @@
+# # resultSampling
+# Crawls a random sample of a query's result pages instead of all of them, for coding studies or for estimating how common something is among the results, at a small fraction of the requests. Every stored article carries the weight it stands for, so weighted sums over the sample are unbiased estimates of the same sums over every result.
+#
+# The sample is drawn in two stages:
+# - The query's date range is cut into shards of `sharddays` days, each searched on its own (the same search, `redate`d). Each shard is a stratum, so every part of the range is sampled, and a shard small enough to show all its results in ProQuest's 100 pages is sampled from all of them.
+# - Once a shard's first page gives its `pqResultsCount`, a `fraction` of its result pages (at least `minpages`) is picked: at random (`'random'`), or spread evenly along the shard by splitting its pages into runs of neighbouring pages and picking `stratumpages` pages from each run (`'stratified'`, the default). Results are sorted oldest first, so the runs are stretches of time.
+#
+# Pages are the units sampled, so each article's weight is the pages of its stratum over the pages picked from it, and the standard errors `estimate` gives treat pages as clusters. Picks are seeded by the query and shard, so a rerun picks the same pages. A shard with more results than ProQuest shows (`maxpossiblepages` pages of 100) is only sampled from the results it shows; that is logged and counted as `sample_truncated`, and should be fixed with smaller shards.
+#
+# Usage (estimating): `python resultSampling.py biden/data/sample.jsonl [--by day source] [--title WORD]`
+
+# +
+import sys
+import json
+import math
+import random
+import hashlib
+import argparse
+from datetime import timedelta
+
+from extractArticles import maxpossiblepages
+from infoParser import parseInfo
+
+designs = ('random', 'stratified')
+resultsperpage = 100
+# -
+
+# ## Date Shards
+
+# +
+# (start, end) of consecutive shards of `days` days covering start to end, both included
+def dateShards(start, end, days=7):
+    shards = []
+    while start <= end:
+        last = min(start + timedelta(days=days - 1), end)
+        shards.append((start, last))
+        start = last + timedelta(days=1)
+    return shards
+
+
+# -
+
+# ## Picking Pages
+# `samplePages` returns `{page index: (stratum, pages picked from it, pages in it)}` for one search, page indices counting from 0.
+
+# +
+def pageCount(resultscount):
+    return min(math.ceil(resultscount / resultsperpage), maxpossiblepages)
+
+def sampleRandom(seed, *key):
+    return random.Random(hashlib.sha1(json.dumps([seed] + [str(part) for part in key]).encode('utf-8')).hexdigest())
+
+def samplePages(pages, fraction, design='stratified', minpages=2, stratumpages=2, rng=None):
+    if design not in designs:
+        raise ValueError('sampling design must be one of {}, not {!r}'.format(designs, design))
+    rng = rng or random.Random(0)
+    picks = min(pages, max(minpages, math.ceil(fraction * pages)))
+    if design == 'random' or picks == pages:
+        return {page: (0, picks, pages) for page in rng.sample(range(pages), picks)}
+
+    # runs of neighbouring pages, as even in length as they can be
+    runs = max(1, picks // stratumpages)
+    sample = {}
+    for stratum in range(runs):
+        first, last = stratum * pages // runs, (stratum + 1) * pages // runs
+        take = min(last - first, picks * (stratum + 1) // runs - picks * stratum // runs)
+        for page in rng.sample(range(first, last), take):
+            sample[page] = (stratum, take, last - first)
+    return sample
+
+# what a page's articles record about how they were sampled
+def sampleFields(shard, stratum, picked, pages):
+    return {'samplestratum': '{}/{}'.format(shard, stratum), 'samplepages': [picked, pages], 'sampleweight': pages / picked}
+
+
+# -
+
+# ## Estimating
+# Horvitz-Thompson totals with the usual stratified cluster-sample variance: pages are clusters, and a page picked but holding no matching articles counts as a zero. `estimate` gives `{group: (total, standard error)}` over the articles `where` accepts; `estimateShare` gives the share of articles in each group that `where` accepts, with a linearised standard error.
+
+# +
+# stratum -> (picked, pages, {page: {group: (value, count)}})
+def pageTotals(records, where, by):
+    strata = {}
+    for record in records:
+        if 'sampleweight' not in record:
+            continue
+        picked, pages = record['samplepages']
+        key = (record.get('databaseindex', 0), record['originalquery'], record.get('querypart', 0), record['samplestratum'])
+        page = (record['querystart'], (int(record['searchindex']) - 1) // resultsperpage)
+        totals = strata.setdefault(key, (picked, pages, {}))[2].setdefault(page, {})
+        group = by(record)
+        value, count = totals.get(group, (0, 0))
+        totals[group] = (value + bool(where(record)), count + 1)
+    return strata
+
+def clusterVariance(picked, pages, values):
+    values = values + [0.0] * (picked - len(values)) # picked pages with nothing to count
+    if picked < 2:
+        return 0.0
+    mean = sum(values) / picked
+    return pages ** 2 * (1 - picked / pages) * sum((value - mean) ** 2 for value in values) / (picked - 1) / picked
+
+def estimate(records, where=lambda record: True, by=lambda record: None):
+    strata = pageTotals(records, where, by)
+    groups = {group for picked, pages, totals in strata.values() for page in totals.values() for group in page}
+    estimates = {}
+    for group in groups:
+        total = variance = 0.0
+        for picked, pages, totals in strata.values():
+            values = [page[group][0] for page in totals.values() if group in page]
+            total += pages / picked * sum(values)
+            variance += clusterVariance(picked, pages, values)
+        estimates[group] = (total, math.sqrt(variance))
+    return estimates
+
+def estimateShare(records, where, by=lambda record: None):
+    strata = pageTotals(records, where, by)
+    groups = {group for picked, pages, totals in strata.values() for page in totals.values() for group in page}
+    estimates = {}
+    for group in groups:
+        matching = articles = 0.0
+        for picked, pages, totals in strata.values():
+            matching += pages / picked * sum(page[group][0] for page in totals.values() if group in page)
+            articles += pages / picked * sum(page[group][1] for page in totals.values() if group in page)
+        share = matching / articles if articles else 0.0
+        variance = 0.0
+        for picked, pages, totals in strata.values():
+            residuals = [page[group][0] - share * page[group][1] for page in totals.values() if group in page]
+            variance += clusterVariance(picked, pages, residuals)
+        estimates[group] = (share, math.sqrt(variance) / articles if articles else 0.0)
+    return estimates
+
+
+# -
+
+# ## Command Line
+# Prints estimated article totals (or, with `--title`, the estimated share of articles whose title contains a word) for each group, with standard errors.
+
+# +
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Estimate article counts from a sampled crawl.')
+    args.add_argument('store', help='sampled articles (data/sample.jsonl)')
+    args.add_argument('--by', nargs='+', choices=['query', 'day', 'source'], default=[], help='what to estimate by')
+    args.add_argument('--title', help='estimate the share of articles whose title contains this text')
+    args = args.parse_args(argv)
+
+    def group(record):
+        if 'published' not in record:
+            record.update(parseInfo(record.get('info') or ''))
+        values = {'query': record['originalquery'], 'day': record['published'], 'source': record['publication']}
+        return tuple(values[dimension] for dimension in args.by)
+
+    with open(args.store, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if args.title:
+        word = args.title.lower()
+        estimates = estimateShare(records, lambda record: word in record['title'].lower(), group)
+    else:
+        estimates = estimate(records, by=group)
+
+    print('\t'.join(args.by + ['share' if args.title else 'articles', 'se']))
+    for key, (value, error) in sorted(estimates.items(), key=lambda row: tuple(str(value) for value in row[0])):
+        print('\t'.join([str(value) for value in key] + ['{:.4f}'.format(value) if args.title else '{:.1f}'.format(value), '{:.4f}'.format(error) if args.title else '{:.1f}'.format(error)]))
+    print('{} sampled articles'.format(sum(1 for record in records if 'sampleweight' in record)), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -29,10 +29,43 @@ from scrapy.crawler import CrawlerProcess
 from scrapy.spiders import CrawlSpider, Rule
 from scrapy.item import Item, Field
 from scrapy.selector import Selector
+from scrapy.http import HtmlResponse
 
 # for troubleshooting
 import logging
+import argparse
 from scrapy.utils.response import open_in_browser
+
+# for reading result pages, optionally off the reactor thread
+from scrapy.utils.defer import maybe_deferred_to_future
+from extractArticles import extractPage, extractEnrichedPage, searchRecords, wantedPages, continuationDate, maxpossiblepages
+from postProcessing import PostProcessor, ReactorLagMonitor
+
+# for measuring each stage of the crawl
+from crawlMetrics import metrics
+from profileStages import StageProfiler, writeReport
+from bandwidth import leansettings
+from pageArchive import PageArchive, readArchive, loadPage
+
+# for checking what is already stored
+from verifyArticles import loadRepairs, queryKey, QueryCoverage
+
+# for keeping queries a size proquest will run
+from queryCompiler import compileSearch, redate
+from eventTable import EventTable, planSearches
+
+# for reading source, authors and dates out of each result's info
+from infoParser import InfoParserPipeline, parseInfo
+
+# for clustering near-duplicate articles as they are stored
+from nearDuplicates import NearDuplicatePipeline
+
+# for keeping article counts as articles are stored
+from aggregateViews import openViews, viewsPath
+from articleIndex import ArticleIndex
+
+# for crawling a sample of the results rather than all of them
+from resultSampling import dateShards, pageCount, samplePages, sampleFields, sampleRandom
 # -
 
 # ## Authentication Parameters
@@ -41,6 +74,9 @@ from scrapy.utils.response import open_in_browser
 # So to use this notebook, you just have to specify the URL, xpaths, and credentials unique to your situation.
 
 # +
+# where proquest lives; a local stand-in like mockProquest.py can be swapped in here
+baseurl = 'https://search.proquest.com'
+
 # url for your login page
 auth_url = 'http://www.library.vanderbilt.edu/eres?id=1349'
 
@@ -75,6 +111,79 @@ d1 = parser.parse('May 2, 2020')
 # what will be searched
 search_query = 'PD({}-{}) AND ("biden")'.format(d0.strftime('%Y%m%d'), d1.strftime('%Y%m%d'))
 search_query
+
+# alternatively, search for every event in an event dataset: a CSV with one event per row, and the name of the generator in `searchGenerators.py` that turns a row into a search
+eventtable = None # e.g. os.path.join(topic, 'data', 'terroristattacks.csv')
+event_type = None # e.g. 'terroristattack'
+# -
+
+# ### Query Size
+# ProQuest runs long boolean queries slowly, if at all. `compileSearch` (see `queryCompiler.py`) tidies `search_query` up and, if it is still longer than `querylimit` characters, splits it into several searches that together return the same results. Each search is crawled as its own `querypart` of the original query; `queryCompiler.mergeParts` deduplicates the articles they have in common.
+#
+# The `plan` lists every query to crawl as `(databaseindex, query, d0, d1, searches)`. With an `eventtable` the whole table is planned in one batch across a process pool and the plan is cached next to the CSV (see `eventTable.py`). As with the post-processing pool below, spawned worker processes re-run this notebook, so on Windows plan the table ahead of time with `python eventTable.py` and let the notebook load the cached plan.
+
+# +
+querylimit = 1000
+
+if eventtable:
+    plan = planSearches(EventTable(eventtable), event_type, querylimit)
+else:
+    plan = [(0, search_query, d0, d1, compileSearch(search_query, querylimit))]
+len(plan), sum(len(searches) for databaseindex, query, start, end, searches in plan)
+# -
+
+# ### Sampling
+# When a representative sample of the results is enough, set `sampling` to `'stratified'` (or `'random'`) and only about `samplefraction` of each query's result pages are crawled. Every query is searched in date shards of `sharddays` days, and within each shard result pages are picked once its result count is known (see `resultSampling.py`). Each sampled article records its `sampleweight`, the number of results it stands for, so weighted counts estimate counts over all results; `python resultSampling.py biden/data/sample.jsonl --by day` prints such estimates with standard errors.
+#
+# A sample isn't a complete set, so it's stored apart from the dataset, in `data/sample.jsonl` (its pages in `data/samplepages`), and what the dataset already holds doesn't change which pages are picked.
+
+# +
+sampling = None # None crawls every result; 'stratified' or 'random' crawls a sample of the result pages
+samplefraction = 0.05
+sharddays = 7
+sampleseed = 0
+# -
+
+# ## Run Mode
+# Run as a script, the notebook crawls ProQuest live. Two options change that:
+# - `--profile [REPORT]` profiles CPU time around every spider callback and the writer pipeline (with `--profilememory`, memory allocations too, which slows the run down many times over), and writes a ranked report of hot spots to `data/profile.txt` (plus one `.prof` file per stage for `snakeviz`/`pstats`) when the run ends.
+# - `--baseurl URL`, `--noauth`, `--topic DIR`, `--postprocessing MODE` and `--set SETTING=VALUE` override the parameters above and the crawler's Scrapy settings without editing the notebook. `benchmarkCrawl.py` uses them to point the crawler at `mockProquest.py`.
+# - `--lean` fetches result pages as leanly as ProQuest allows (see Lean Fetching below).
+# - `--sample DESIGN` and `--samplefraction F` set `sampling` and `samplefraction` above.
+# - `--replay [ARCHIVE]` skips the login and the network entirely and feeds the result pages saved in `data/pages` back through the same callbacks. Replayed items go to `data/replay.jsonl` rather than the real dataset. Combine it with `--profile` to profile extraction offline.
+#
+# Every page the crawler receives is saved to `pagearchive` (set it to `None` to turn that off).
+
+# +
+pagearchive = os.path.join(topic, 'data', 'pages')
+
+runmode = argparse.ArgumentParser(description='Scrape ProQuest search results.')
+runmode.add_argument('--profile', nargs='?', const=True, default=None)
+runmode.add_argument('--profilememory', action='store_true', help='with --profile, also trace memory allocations (slow)')
+runmode.add_argument('--replay', nargs='?', const=True, default=None)
+runmode.add_argument('--baseurl', default=baseurl)
+runmode.add_argument('--noauth', action='store_true', help='skip the selenium login')
+runmode.add_argument('--topic', default=topic)
+runmode.add_argument('--postprocessing', choices=['thread', 'process'], default=None)
+runmode.add_argument('--set', action='append', default=[], metavar='SETTING=VALUE')
+runmode.add_argument('--lean', action='store_true', help='trim requests and skip refetching first result pages')
+runmode.add_argument('--sample', choices=['random', 'stratified'], default=sampling)
+runmode.add_argument('--samplefraction', type=float, default=samplefraction)
+runmode = runmode.parse_known_args()[0] # unknown arguments are left for jupyter
+
+baseurl = runmode.baseurl
+if runmode.noauth:
+    auth_url = None
+sampling, samplefraction = runmode.sample, runmode.samplefraction
+if runmode.topic != topic:
+    topic = runmode.topic
+    pagearchive = os.path.join(topic, 'data', 'pages')
+if sampling and pagearchive:
+    pagearchive = os.path.join(topic, 'data', 'samplepages')
+if runmode.profile is True:
+    runmode.profile = os.path.join(topic, 'data', 'profile.txt')
+if runmode.replay is True:
+    runmode.replay = pagearchive
 # -
 
 # ## Scraping Pipeline
@@ -95,6 +204,15 @@ except FileNotFoundError:
     articles = None
 
 
+# #### A repair job list from `verifyArticles.py` takes precedence over the inline completeness check.
+# Running `python verifyArticles.py biden/data/articles.jsonl` writes `data/repairs.jsonl` listing exactly which search indices each query is still missing. For the queries it lists we trust it rather than recomputing what's missing from `articles`; queries it doesn't list (new ones, say) are checked against `articles` as usual. A crawl that finishes deletes the file, since the gaps it listed have been requested.
+
+try:
+    repairs = loadRepairs(os.path.join(topic, 'data', 'repairs.jsonl'))
+except FileNotFoundError:
+    repairs = None
+
+
 # #### We'll organize scraped information into an ArticleItem instance to facilitate orderly storage.
 # There are two types of information we currently store: 
 # - **Information about the search process**. Every detail identifying we found this article using this pipeline so that anyone who wants to check our work (including ourselves) can do it.
@@ -102,6 +220,9 @@ except FileNotFoundError:
 
 class ArticleItem(scrapy.Item):
     
+    # info defined by event data set (0 when searching for a single query)
+    databaseindex = scrapy.Field()
+    
     # info defined by search process
     resultscount = scrapy.Field()
     query = scrapy.Field()
@@ -111,49 +232,73 @@ class ArticleItem(scrapy.Item):
     querystart = scrapy.Field()
     queryend = scrapy.Field()
     parents = scrapy.Field()
+    querypart = scrapy.Field()
     
     # info defined by article content
     searchindex = scrapy.Field()
     title = scrapy.Field()
     info = scrapy.Field()
     link  = scrapy.Field()
+    
+    # info parsed out of `info` by `infoParser.py`
+    authors = scrapy.Field()
+    publication = scrapy.Field()
+    edition = scrapy.Field()
+    place = scrapy.Field()
+    publisher = scrapy.Field()
+    issue = scrapy.Field()
+    page = scrapy.Field()
+    published = scrapy.Field()
+    duplicate = scrapy.Field()
+
+    # the near-duplicate cluster the article joined, from `nearDuplicates.py`
+    cluster = scrapy.Field()
+
+    # how the article's page was picked, in a sampled crawl (see `resultSampling.py`)
+    samplestratum = scrapy.Field()
+    samplepages = scrapy.Field()
+    sampleweight = scrapy.Field()
 
 
 # #### We'll store Article Data as JSON lines.
-# This `JsonWriterPipeline` class specifies exactly what happens when a new `ArticleItem` instance is prepared. We'll store all scraped items into a single `articles.jsonl`, listing each research as a unique JSON object.
+# This `JsonWriterPipeline` class specifies exactly what happens when a new `ArticleItem` instance is prepared. We'll store all scraped items into a single `articles.jsonl` (`sample.jsonl` when sampling), listing each research as a unique JSON object. It also keeps the article counts per day, source and query (see `aggregateViews.py`) and the lookup index (see `articleIndex.py`) next to the store up to date.
 #
 # `JSON` is just a human-readable way of representing dictionaries as text. With the `json` package, they can be readily loaded into Python dictionaries or converted into other formats.
 
 class JsonWriterPipeline(object):
+    path = os.path.join(topic, 'data', 'sample.jsonl' if sampling else 'articles.jsonl')
 
     # operations performed when spider starts
     def open_spider(self, spider):
-        self.file = open(os.path.join(topic, 'data', 'articles.jsonl'), 'a')
+        self.views = openViews(self.path) # article counts per day, source and query, caught up with the store
+        self.file = open(self.path, 'a')
 
     # when the spider finishes
     def close_spider(self, spider):
         self.file.close()
+        self.views.caughtUp(self.path)
+        self.views.save(viewsPath(self.path))
+        index = ArticleIndex(self.path) # adds what this crawl stored to the store's lookup index
+        index.update()
+        index.close()
 
     # when the spider yields an item
+    @metrics.timed('pipeline')
     def process_item(self, item, spider):
         line = json.dumps(dict(item)) + "\n"
         self.file.write(line)
+        self.views.add(item)
         return item 
 
 
-# ### Crawler Settings and Initial URL(s)
-# The initial URL isn't actually the search form. Instead, we go to a URL that for some unknown reason must be visited first in order to have access to all possible search parameters with a web crawler. Query information is maintained in a `meta` field within the request so we use (and ultimately store) the information downstream.
+# #### We obtain authenticated session cookie(s) using selenium.
+# This happens when the crawl starts rather than when the notebook is loaded, so offline runs never open a browser.
 
 # +
-maxpossiblepages = 100 # no more than 100 pages are ever returned
+def authenticate():
+    if auth_url is None:
+        return {}
 
-class articleSpider(scrapy.Spider):
-    name = 'articles'
-    custom_settings = {'HTTPERROR_ALLOWED_CODES': [500],
-                      'ITEM_PIPELINES': {'__main__.JsonWriterPipeline': 1},
-                      'LOG_LEVEL': 'WARNING'}
-    
-    # first we obtain authenticated session cookie(s) using selenium
     driver = webdriver.Firefox()
     driver.get(auth_url)
 
@@ -183,32 +328,115 @@ class articleSpider(scrapy.Spider):
 
     cookies = {i['name']: i['value'] for i in driver.get_cookies()}
     driver.close()
+    return cookies
+
+
+# -
+
+# ### Crawler Settings and Initial URL(s)
+# The initial URL isn't actually the search form. Instead, we go to a URL that for some unknown reason must be visited first in order to have access to all possible search parameters with a web crawler. Query information is maintained in a `meta` field within the request so we use (and ultimately store) the information downstream.
+
+# #### Scheduling
+# With `fairscheduling` on, requests are ordered by the priorities below and, within a priority, shared round-robin between queries (see `fairScheduler.py`). Pages that fill gaps in an existing dataset go first, then pages of small queries (at most `smallquery` results), then everything else. A search's form requests get the priority of the pages they lead to; until the result count is known a fresh search counts as small.
+
+# +
+fairscheduling = True
+schedulepriorities = {'gapfill': 30, 'small': 20, 'bulk': 10}
+smallquery = 1000
+
+def requestPriority(meta, resultscount=None):
+    if meta['missing'] != 'All':
+        return schedulepriorities['gapfill']
+    if resultscount is None or resultscount <= smallquery:
+        return schedulepriorities['small']
+    return schedulepriorities['bulk']
+
+
+# -
+
+# +
+class articleSpider(scrapy.Spider):
+    name = 'articles'
+    custom_settings = {'HTTPERROR_ALLOWED_CODES': [500],
+                      'ITEM_PIPELINES': {'infoParser.InfoParserPipeline': 0, 'nearDuplicates.NearDuplicatePipeline': 1, '__main__.JsonWriterPipeline': 2,
+                                         'itemStream.ItemStreamPipeline': 3},
+                      'NEARDUPLICATE_INDEX': os.path.join(topic, 'data', 'samplenearduplicates.pickle' if sampling else 'nearduplicates.pickle'),
+                      'STREAM_ADDRESS': None, # e.g. '/tmp/proquest.sock' to stream articles live (see itemStream.py)
+                      'EXTENSIONS': {'crawlMetrics.MetricsExtension': 500, 'bandwidth.BandwidthExtension': 510},
+                      'SPIDER_MIDDLEWARES': {'bandwidth.ParseTimeMiddleware': 1000},
+                      'BANDWIDTH_REPORT': os.path.join(topic, 'data', 'bandwidth.json'),
+                      'METRICS_PORT': 9410,
+                      'METRICS_SNAPSHOT': os.path.join(topic, 'data', 'metrics.json'),
+                      'LOG_LEVEL': 'WARNING'}
+    if fairscheduling:
+        custom_settings['SCHEDULER_PRIORITY_QUEUE'] = 'fairScheduler.FairPriorityQueue'
+    if runmode.lean:
+        custom_settings.update(leansettings)
     
+    cookies = None
+
     def start_requests(self):
-        
+        self.cookies = authenticate()
+        lagmonitor.start()
+
+        if sampling:
+            yield from sampleRequests(self)
+            return
+
         # if no results exist at all in existing data set, search is a-go as before;
         # otherwise constrain search to avoid redundancy
         # this is a powerful way to test if and ensure our traversal actually succeeded
         # since proquest will inevitably reject some request, some drop-outs are inevitable and must be tracked/corrected
+        # what is already stored is tallied by search once, rather than rescanned for every event
+        stored = {}
         if articles is not None:
-            if np.size(articles) == 0:
-                missing = 'All'
-            else:
-                count = min([int(a['resultscount']) for a in articles if a['parents'] == 0])
-                missing = set(np.arange(1, count+1)) - set([int(s['searchindex']) for s in articles])
-        else:
-            missing = 'All'
-        
-        yield scrapy.Request('https://search.proquest.com/advanced.showresultpageoptions?site=news',
-                                 callback=self.startform, dont_filter=True, cookies=self.cookies,
-                                 meta={'originalquery': search_query, 'query': search_query, 'databaseindex': 0,
-                                       'originalstart': d0, 'originalend': d1, 'line': '',
-                                       'querystart': d0, 'queryend': d1, 'parents': 0, 'missing': missing}
-                            )
+            for a in articles:
+                key = queryKey(a)
+                if key not in stored:
+                    stored[key] = QueryCoverage(a)
+                stored[key].add(a)
+        self.repairsused = repairs is not None
+
+        # each part of a split query keeps its own search indices, so is checked on its own
+        for databaseindex, originalquery, start, end, searches in tqdm(plan):
+            for part, query in enumerate(searches):
+                key = queryKey({'databaseindex': databaseindex, 'originalquery': originalquery, 'querypart': part})
+                if repairs is not None and key in repairs:
+                    missing = repairs[key]
+                elif key in stored:
+                    missing = stored[key].missing()
+                else:
+                    missing = 'All'
+
+                # don't do any search if no results are missing for this event
+                if not missing:
+                    continue
+
+                yield scrapy.Request(baseurl + '/advanced.showresultpageoptions?site=news',
+                                         callback=self.startform, dont_filter=True, cookies=self.cookies,
+                                         priority=requestPriority({'missing': missing}),
+                                         meta={'originalquery': originalquery, 'query': query, 'querypart': part,
+                                               'databaseindex': databaseindex, 'originalstart': start, 'originalend': end, 'line': '',
+                                               'querystart': start, 'queryend': end, 'parents': 0, 'missing': missing}
+                                    )
 
 
 # -
 
+# Sampled searches: every part of every query, once per date shard.
+
+def sampleRequests(self):
+    for databaseindex, originalquery, start, end, searches in tqdm(plan):
+        for part, query in enumerate(searches):
+            for shardstart, shardend in dateShards(start, end, sharddays):
+                yield scrapy.Request(baseurl + '/advanced.showresultpageoptions?site=news',
+                                     callback=self.startform, dont_filter=True, cookies=self.cookies,
+                                     priority=requestPriority({'missing': 'All'}),
+                                     meta={'originalquery': originalquery, 'query': redate(query, shardstart, shardend), 'querypart': part,
+                                           'databaseindex': databaseindex, 'originalstart': start, 'originalend': end, 'line': '',
+                                           'querystart': shardstart, 'queryend': shardend, 'parents': 0, 'missing': 'All'})
+
+
 # ### Querying for Results
 # We have to make a request to start the full search form and then another request to actually initiate the search query.
 
@@ -217,8 +445,9 @@ class articleSpider(scrapy.Spider):
 def startform(self, response):
     
     # start the search form
-    yield scrapy.Request('https://search.proquest.com/news/advanced',
-                         callback=self.query, dont_filter=True, meta=response.meta)
+    yield scrapy.Request(baseurl + '/news/advanced',
+                         callback=self.query, dont_filter=True, meta=response.meta,
+                         priority=requestPriority(response.meta))
 
 # fills out form and initiates search
 def query(self, response):
@@ -228,7 +457,20 @@ def query(self, response):
                                            formdata={'queryTermField': response.meta['query'],'fullTextLimit':'on',
                                                      'sortType':'DateAsc', 'includeDuplicate':'on'},
                                            callback=self.parsePages, clickdata={'id': 'searchToResultPage'},
-                                           meta=response.meta)
+                                           meta=response.meta, priority=requestPriority(response.meta))
+
+
+# -
+
+# ### Keeping Raw Pages
+# Result pages are saved as they arrive (see Run Mode) so they can be replayed or re-extracted later without the network.
+
+# +
+archive = PageArchive(pagearchive) if pagearchive and not runmode.replay else None
+
+def archivePage(stage, response):
+    if archive is not None:
+        archive.save(stage, response.url, response.text, response.meta)
 
 
 # -
@@ -240,12 +482,14 @@ def query(self, response):
 
 # sets up inspection of each page of results generated by search
 def parsePages(self, response):    
+    archivePage('parsePages', response)
     sel = Selector(response)
     
     # sometimes proquest will expire the current session or refuse to fulfill a query
     # we'll have to get them another time!
     if 'sessionexpired' in response.url:
         logging.warning('Session Expiration Outcome Tied To {}'.format(response.meta['databaseindex']))
+        metrics.count('session_expiries')
         return
     
     # we check if there are no results provided for some other reason and also log/give up when that happens
@@ -253,108 +497,197 @@ def parsePages(self, response):
         resultscount = sel.xpath("//h1[@id='pqResultsCount']/text()").extract()[0]
     except IndexError:
         logging.warning('Result Absence Outcome Tied To {}'.format(response.meta['databaseindex']))
+        metrics.count('result_absences')
         return
     
     # on this page we can count the number of returned results and construct follow-up queries on that basis
     resultscount = int(resultscount[:resultscount.find(' ')].replace(',', ''))
-    maxpages = resultscount // 100
     urlparts = [response.url[:response.url.find('/1')+1], response.url[response.url.find('1?')+1:]]
 
+    # a sampled crawl only asks for the pages picked from this shard
+    if sampling:
+        yield from samplePageRequests(self, response, resultscount, urlparts)
+        return
+
     # what i do next depends on what's missing
     # for each result page, grab and parse it if a needed result is missing
     # if there's a missing result beyond the max possible recount, open the final result page at the end of the loop
-    for page_index in range(min(maxpages+1, maxpossiblepages)):
-        request = scrapy.Request(str(page_index+1).join(urlparts), callback=self.parse, dont_filter=True, meta=response.meta)
-
-        if response.meta['missing'] is 'All':
-            yield request
-        elif 0 < len(set(np.arange((page_index*100)+1+(response.meta['parents']*maxpossiblepages*100),min((page_index+1)*100+(response.meta['parents']*maxpossiblepages*100),
-                                                                                 resultscount+(response.meta['parents']*maxpossiblepages*100))+1)
-               ).intersection(response.meta['missing'])):
-            yield request
-        elif page_index+1 == maxpossiblepages and len([m for m in response.meta['missing'] if m > maxpossiblepages*100]) > 0:
-            yield request
+    for page_index in wantedPages(resultscount, response.meta):
+
+        # the search itself answered with the first page, so lean fetching reads it from here instead of asking for it again
+        if page_index == 0 and leanfetch:
+            yield from self.parse(response)
+            continue
+        yield scrapy.Request(str(page_index+1).join(urlparts), callback=self.parseOffloaded if postprocessor else self.parse,
+                             dont_filter=True, meta=response.meta, priority=requestPriority(response.meta, resultscount))
+
+# each picked page carries what its articles record about how it was sampled
+def samplePageRequests(self, response, resultscount, urlparts):
+    meta = response.meta
+    if resultscount > maxpossiblepages*100:
+        logging.warning('Sample Of {} Results Limited To The First {} Tied To {}'.format(resultscount, maxpossiblepages*100, meta['databaseindex']))
+        metrics.count('sample_truncated')
+
+    shard = str(meta['querystart'])[:10]
+    rng = sampleRandom(sampleseed, meta['databaseindex'], meta['originalquery'], meta['querypart'], shard)
+    pages = samplePages(pageCount(resultscount), samplefraction, sampling, rng=rng)
+    metrics.count('sample_pages', len(pages))
+    for page_index, (stratum, picked, total) in sorted(pages.items()):
+        yield scrapy.Request(str(page_index+1).join(urlparts), callback=self.parseOffloaded if postprocessor else self.parse,
+                             dont_filter=True, meta=dict(meta, sample=sampleFields(shard, stratum, picked, total)),
+                             priority=requestPriority(meta, resultscount))
 
 
 # ### Parsing Results For Data
+# The page itself is read by `extractPage` in `extractArticles.py`; here we turn its records into `ArticleItem`s tied to the search that produced them.
 
+# +
 def parse(self, response):
-        sel = Selector(response)
-        
-        # sometimes proquest will expire the current session or refuse to fulfill a query
-        # we'll have to get them another time!
-        if 'sessionexpired' in response.url:
-            logging.warning('Session Expiration Outcome Tied To {}'.format(response.meta['databaseindex']))
+    archivePage('parse', response)
+    return emitArticles(self, response, extractPage(response.text, response.url))
+
+# builds ArticleItems (and any continuation search) from an extracted page
+def emitArticles(self, response, extracted):
+
+    # sometimes proquest will expire the current session or refuse to fulfill a query
+    # we'll have to get them another time!
+    if extracted['status'] == 'expired':
+        logging.warning('Session Expiration Outcome Tied To {}'.format(response.meta['databaseindex']))
+        metrics.count('session_expiries')
+        return
+
+    # we check if there are no results provided for some other reason and also log/give up when that happens
+    if extracted['status'] == 'absent':
+        logging.warning('Result Absence Outcome Tied To {}'.format(response.meta['databaseindex']))
+        metrics.count('result_absences')
+        return
+
+    # now populate an ArticleItem() for each result, skipping any the missing parameter suggests have already been processed
+    for record in searchRecords(extracted, response.meta):
+        yield ArticleItem(record)
+
+    # set up successive searches for when there are more than max possible results
+    # results are sorted oldest first, so the next search picks up from the date of the last one shown
+    # (a sample is drawn from the results a shard shows, so sampled pages never continue)
+    if extracted['limit'] and 'sample' not in response.meta:
+        outcome, date = continuationDate(extracted, response.meta)
+        if outcome == 'undated':
+            logging.warning('Continuation Without Dates Tied To {}'.format(response.meta['databaseindex']))
+            metrics.count('continuation_failures')
             return
-        
-        # we check if there are no results provided for some other reason and also log/give up when that happens
-        try:
-            resultscount = sel.xpath("//h1[@id='pqResultsCount']/text()").extract()[0]
-        except IndexError:
-            logging.warning('Result Absence Outcome Tied To {}'.format(response.meta['databaseindex']))
+
+        # more results than proquest will show for a single day can't be narrowed down by date any further
+        if outcome == 'stuck':
+            logging.warning('Continuation Stuck On {} Tied To {}'.format(date, response.meta['databaseindex']))
+            metrics.count('continuation_failures')
             return
-        resultscount = int(resultscount[:resultscount.find(' ')].replace(',', ''))
-        
-        # we pull the data from the results page for parsing
-        indices = sel.xpath("//li[@class='resultItem ltr']/div//span[@class='indexing']/text()").extract()
-        titles = sel.xpath("//h3/a/@title").extract()
-        links = sel.xpath("//h3/a/@href").extract()
-        info = [(' '.join(path.xpath(".//span[@class='titleAuthorETC']//text()").extract())).replace('\n', '') for path in sel.xpath("//li[@class='resultItem ltr']")]
-        
-        # correct me if im wrong but i assume all of these lists are of the same length
-        assert (len(indices) + len(titles) + len(links) + len(info)) == (len(indices) + len(indices) + len(indices) + len(indices))
-        
-        # now populate an ArticleItem() for each result
-        for i in range(len(indices)):
-            
-            # but skip if missing parameter suggests that the articleitem has already been processed
-            if response.meta['missing'] is not 'All':
-                if int(indices[i]) + response.meta['parents']*maxpossiblepages*100 not in response.meta['missing']:
-                    continue
-            
-            article = ArticleItem()
-            
-            # defined prior to or at start of search
-            article['resultscount'] = resultscount + response.meta['parents']*maxpossiblepages*100
-            article['originalquery'] = response.meta['originalquery']
-            article['originalstart'] = str(response.meta['originalstart'])
-            article['originalend'] = str(response.meta['originalend'])
-            article['query'] = response.meta['query']
-            article['querystart'] = str(response.meta['querystart'])
-            article['queryend'] = str(response.meta['queryend'])
-            article['parents'] = int(response.meta['parents'])
-
-            # defined by item itself
-            article['searchindex'] = int(indices[i]) + response.meta['parents']*maxpossiblepages*100
-            article['title'] = titles[i]
-            article['info'] = info[i]
-            article['link']  = links[i]
-
-            yield article
-            
-        # set up successive searches for when there are more than max possible results
-        limitstring = 'You have reached the maximum number of search results that are displayed.'
-        limit = sel.xpath("//p[@class='errorMessageHeaderText']/text()")
-        if limit:
-            if limitstring in limit.extract()[0]:
-                request = scrapy.Request('https://search.proquest.com/advanced.showresultpageoptions?site=news',
-                                         callback=self.startform, dont_filter=True, meta=response.meta)
-                
-                request.meta['parents'] += 1
-                request.meta['querystart'] = [d for d in dates if d is not None][-1]
-                request.meta['query'] = searchParamGenerators[event_type](request.meta['line'], header, d0=request.meta['querystart'], d1=request.meta['queryend'])[0]
-                yield request
 
+        request = scrapy.Request(baseurl + '/advanced.showresultpageoptions?site=news',
+                                 callback=self.startform, dont_filter=True, meta=response.meta,
+                                 priority=requestPriority(response.meta))
 
-# ### Spider Execution
+        request.meta['parents'] += 1
+        request.meta['querystart'] = datetime.datetime.fromisoformat(date)
+        request.meta['query'] = redate(request.meta['query'], request.meta['querystart'], request.meta['queryend'])
+        yield request
+
+
+# -
+
+# ### Optional Post-Processing Pool
+# Extracting a page runs XPath over the whole document, and while it runs inside the reactor thread no other request can be sent or received. Setting `postprocessing` to `'process'` (or `'thread'`) hands each page to a worker pool instead, which also parses each record's `info` line (see `infoParser.py`), and picks the records back up asynchronously. Either way a `ReactorLagMonitor` reports how long the reactor was stalled when the spider closes, so the two modes can be compared.
+#
+# Worker processes that are started by spawning (the only option on Windows) re-run this script on import, login and all, so use `'thread'` there.
 
 # +
-articleSpider.startform = startform
-articleSpider.query = query
-articleSpider.parsePages = parsePages
-articleSpider.parse = parse
+postprocessing = runmode.postprocessing # None (extract inside the reactor), 'thread' or 'process'
+postprocessingworkers = 4
 
-process = CrawlerProcess({'USER_AGENT': 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)'})
+postprocessor = PostProcessor(postprocessing, postprocessingworkers) if postprocessing else None
+lagmonitor = ReactorLagMonitor()
+
+async def parseOffloaded(self, response):
+    archivePage('parse', response)
+    extracted = await maybe_deferred_to_future(postprocessor.submit(extractEnrichedPage, response.text, response.url))
+    for result in emitArticles(self, response, extracted):
+        yield result
+
+def closed(self, reason):
+    if getattr(self, 'repairsused', False) and reason == 'finished':
+        os.remove(os.path.join(topic, 'data', 'repairs.jsonl')) # its gaps have been requested; what's still missing is found from the store
+    lagmonitor.stop()
+    logging.warning('Reactor Lag: {}'.format(lagmonitor.summary()))
+    if postprocessor is not None:
+        postprocessor.shutdown()
+
+
+# -
+
+# ### Lean Fetching
+# `bandwidth.py` accounts for every request: bytes sent, bytes received before and after decompression, parse time and articles stored, per query and per callback, written to `data/bandwidth.json` when the crawl ends. `python bandwidth.py biden/data/bandwidth.json` prints it, and `--compare` sets two crawls side by side.
+#
+# With `--lean` the crawler sends smaller requests (no `Referer` or `Accept-Language` headers, a short `Accept`) and reads the first page of results straight from the response to the search form, which is that page, instead of requesting it again; for the many queries with at most 100 results that halves the result pages fetched. Scrapy already asks for compressed responses and never fetches a page's images, scripts or stylesheets, so there's nothing to gain there. Reading the first page in place runs its extraction in the reactor, so it's left off when a post-processing pool is in use, and replays never need it.
 
-process.crawl(articleSpider)
-process.start()
+# +
+leanfetch = runmode.lean and not runmode.replay and postprocessor is None
+
+
+# -
+
+# ### Offline Replay
+# Feeds archived pages through the same callbacks a live crawl would use. Requests the callbacks yield are dropped; items go through the `InfoParserPipeline` and a `JsonWriterPipeline` pointed at `data/replay.jsonl`. Pages are replayed as if nothing had been stored yet (`missing` is `'All'`).
+
+# +
+def replay(path):
+    spider = articleSpider()
+    pipeline = JsonWriterPipeline()
+    pipeline.path = os.path.join(topic, 'data', 'replay.jsonl')
+    pipeline.open_spider(spider)
+    infopipeline = InfoParserPipeline()
+    callbacks = {'parsePages': spider.parsePages, 'parse': spider.parse}
+    for entry in tqdm(list(readArchive(path))):
+        request = scrapy.Request(entry['url'], meta=dict(entry['meta'], missing='All', line=''))
+        response = HtmlResponse(entry['url'], body=loadPage(path, entry).encode('utf-8'), encoding='utf-8', request=request)
+        for result in callbacks[entry['stage']](response) or ():
+            if isinstance(result, scrapy.Item):
+                pipeline.process_item(infopipeline.process_item(result, spider), spider)
+    pipeline.close_spider(spider)
+
+
+# -
+
+# ### Spider Execution
+# Every callback, and every item pipeline, is timed under its own stage by `crawlMetrics` (the pipelines as `infoparser`, `nearduplicates`, `pipeline` for the writer and `stream`). While the crawl runs, http://127.0.0.1:9410/metrics serves the counters and latency histograms in Prometheus format (`/metrics.json` as JSON), and `data/metrics.json` is rewritten with a snapshot every 10 seconds.
+
+# +
+profiler = StageProfiler(runmode.profilememory) if runmode.profile else None
+
+# every callback is timed for the metrics endpoint and, with --profile, profiled too
+def instrument(stage, fn):
+    fn = metrics.timed(stage)(fn)
+    return profiler.profiled(stage)(fn) if profiler else fn
+
+articleSpider.startform = instrument('startform', startform)
+articleSpider.query = instrument('query', query)
+articleSpider.parsePages = instrument('parsePages', parsePages)
+articleSpider.parse = instrument('parse', parse)
+articleSpider.parseOffloaded = instrument('parse', parseOffloaded)
+articleSpider.closed = closed
+InfoParserPipeline.process_item = instrument('infoparser', InfoParserPipeline.process_item)
+NearDuplicatePipeline.process_item = instrument('nearduplicates', NearDuplicatePipeline.process_item)
+if profiler:
+    JsonWriterPipeline.process_item = profiler.profiled('pipeline')(JsonWriterPipeline.process_item)
+
+if runmode.replay:
+    replay(runmode.replay)
+else:
+    articleSpider.custom_settings.update(setting.split('=', 1) for setting in runmode.set)
+    process = CrawlerProcess({'USER_AGENT': 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)'})
+
+    process.crawl(articleSpider)
+    process.start()
+
+if archive is not None:
+    archive.close()
+if profiler is not None:
+    print(writeReport(profiler, runmode.profile))
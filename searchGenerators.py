@@ -0,0 +1,160 @@
+# # searchGenerators
+# Search parameter generators for event datasets: each turns one row of an event table into the ProQuest search for articles about that event. A generator takes the row (`line`), the table's column names (`header`) and optionally the dates to search between, and returns `(query, d0, d1)`. Without dates the search runs from the event's date for `scrape_window` days.
+#
+# The queries are built with `queryCompiler.py` rather than by pasting strings together, so repeated keywords and clauses are dropped as they're built and `compileSearch` can split a query that is still too long.
+
+# +
+import re
+import datetime
+import itertools
+from datetime import timedelta
+
+from dateutil import parser
+
+from queryCompiler import Query, anyof, allof, near, publicationDates
+
+scrape_window = 50 # days searched after each event
+# -
+
+# ## Generator Functions
+
+# +
+def datedSearch(clause, d0, d1):
+    return Query(allof(publicationDates(d0, d1), clause)), d0, d1
+
+## super bowls
+def superbowlSearchGenerator(line, header, d0=None, d1=None):
+    d0 = d0 or datetime.datetime.strptime(line[header.index('Date')], '%b %d %Y')
+    d1 = d1 or d0 + timedelta(days=scrape_window)
+    return datedSearch(anyof('"superbowl"', '"super bowl"'), d0, d1)
+
+def sotuSearchGenerator(line, header, d0=None, d1=None):
+    d0 = d0 or parser.parse(line[header.index('date')])
+    d1 = d1 or d0 + timedelta(days=scrape_window)
+    return datedSearch('"state of the union"', d0, d1)
+
+def worldseriesSearchGenerator(line, header, d0=None, d1=None):
+    d0 = d0 or parser.parse(line[header.index('date')])
+    d1 = d1 or d0 + timedelta(days=scrape_window)
+    return datedSearch('"world series"', d0, d1)
+
+def oscarSearchGenerator(line, header, d0=None, d1=None):
+    d0 = d0 or parser.parse(line[header.index('date')])
+    d1 = d1 or d0 + timedelta(days=scrape_window)
+    return datedSearch(anyof('"oscars"', '"academy awards"'), d0, d1)
+
+## terrorist attacks
+proximityparam = 200    # required proximacy of query terms to one another
+x = 2                   # number of keywords/phrases to require in a search result
+def terroristattackSearchGenerator(line, header, d0=None, d1=None):
+
+    # location and date
+    location = anyof('"' + line[header.index('city')] + '"', '"' + line[header.index('provstate')] + '"')
+
+    if not d0:
+        if line[header.index('iday')] != str(0):
+            d0 = datetime.datetime(int(line[header.index('iyear')]),
+                                   int(line[header.index('imonth')]),
+                                   int(line[header.index('iday')]))
+        else:
+            d0 = datetime.datetime(int(line[header.index('iyear')]),
+                                   int(line[header.index('imonth')]), 1) # the day is unknown, so search from the start of the month
+    if not d1:
+        d1 = d0 + timedelta(days=scrape_window)
+
+    return datedSearch(xof(x, [attackkeywords(line[header.index('attacktype1')]),
+                               targetkeywords(line[header.index('targtype1')],
+                                              line[header.index('targsubtype1_txt')],
+                                              line[header.index('corp1')],
+                                              line[header.index('target1')]),
+                               perpkeywords(line[header.index('gname')]),
+                               'terroris*'], location), d0, d1)
+
+searchParamGenerators = {'terroristattack': terroristattackSearchGenerator, 'superbowl': superbowlSearchGenerator, 'sotu': sotuSearchGenerator,
+                         'worldseries': worldseriesSearchGenerator, 'oscar': oscarSearchGenerator}
+
+
+# -
+
+# ## Helper Functions
+# `xof` requires `x` of the keyword groups to appear near each other and near the location. Each combination of groups becomes the `AND` of a `NEAR` for every pair in it, so a `NEAR` shared by several combinations is built once and only written out once per branch it appears in.
+
+# +
+def xof(x, options, location):
+    # filters blank options
+    options = [option for option in dict.fromkeys(options) if option]
+
+    # sets x to minimum of number of options and specified maximum limit
+    x = min(len(options), x)
+
+    # builds set of possible ways to fulfill constraints
+    return anyof(*[allof(*[near(a, b, proximityparam) for a, b in itertools.combinations(list(xcombo) + [location], 2)])
+                   for xcombo in itertools.combinations(options, x)])
+
+# define set of keywords such that the presence of one
+def attackkeywords(attacktype1):
+    keywords = {'1': ['assassin*'],
+                '2': ['assault*', 'armed'],
+                '3': ['bomb*', 'explo*'],
+                '4': ['hijack*'],
+                '5': ['hostage', 'barricade*'],
+                '6': ['hostage*', 'kidnap*'],
+                '7': ['facility', 'infrastructure', 'sabotage'],
+                '8': ['assault*', 'unarmed']}
+    return anyof(*keywords.get(attacktype1, []))
+
+targetwords = {'1': ['business'],
+               '2': ['government', 'political'],
+               '22': ['government', 'political'],
+               '3': ['police'],
+               '4': ['military'],
+               '5': ['abortion'],
+               '6': ['airport', 'aircraft'],
+               '7': ['government', 'embass*', 'consul*'],
+               '8': ['school', '"educational institution"', 'university', 'teach*', 'professor'],
+               '9': ['supplies'],
+               '10': ['journalist', 'reporter', 'media'],
+               '11': ['maritime', 'fishing', '"oil tanker"', 'ferr*', 'yacht'],
+               '12': ['NGO', '"non-governmental organization"'],
+               '15': ['religious', 'church', 'mosque', 'synagogue', 'imam', 'priest', 'bishop'],
+               '16': ['telecom*', 'transmitter', 'tower'],
+               '18': ['tourist', '"tour bus*"', 'tour'],
+               '19': ['"public transport*"'],
+               '21': ['utilit*', '"power line"', 'pipeline', 'transformer', '"high tension line"', 'substation', 'lamppost', '"street light"']}
+
+# subtype names that read better as a search term in another form, or not at all
+targetsubtypes = {'Labor Union Related': 'Labor Union/Union',
+                  'Affiliated Institution': '',
+                  'Named Citizen': '',
+                  'Other (including online news agencies)': '',
+                  'Other Personnel': '',
+                  'Clinics': 'Abortion Clinics',
+                  'Personnel': 'Abortion Personnel'}
+
+def targetkeywords(targtype1, targsubtype1_txt, corp1, target1):
+    keywords = list(targetwords.get(targtype1, []))
+
+    targsubtype1_txt = targsubtype1_txt.replace('/Other Personnel', '')
+    targsubtype1_txt = targsubtype1_txt.replace('/Facility', '')
+    targsubtype1_txt = targsubtype1_txt.replace('/Ethnicity Identified', '')
+    targsubtype1_txt = targsubtype1_txt.replace('Religion Identified', 'Religious')
+    targsubtype1_txt = targetsubtypes.get(targsubtype1_txt, targsubtype1_txt)
+    if targsubtype1_txt.count('(') > 0 or targsubtype1_txt.count(')') > 0:
+        result = re.findall(r".*?\((.*?)\)", targsubtype1_txt)
+        targsubtype1_txt = targsubtype1_txt[:targsubtype1_txt.find('(' + result[0] + ')')-1]
+
+    keywords += ['"' + each.strip() + '"' for each in targsubtype1_txt.split('/')]
+
+    if len(corp1) > 0:
+        keywords.append('"' + corp1 + '"')
+
+    if len(target1) > 0:
+        keywords.append('"' + target1 + '"')
+
+    return anyof(*[k for k in keywords if len(k) > 2]) # '""' is an empty phrase
+
+def perpkeywords(gname):
+    if len(gname) > 2 and gname != 'Unknown':
+        return '"' + gname + '"'
+    else:
+        return ''
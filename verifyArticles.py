@@ -0,0 +1,204 @@
+# # verifyArticles
+# A standalone completeness check for an `articles.jsonl` store. It streams over the store once, tracking which `searchindex` values every query has returned, and reports coverage, duplicates, gaps and result-count mismatches. It also writes a repair job list (`repairs.jsonl`) that `scrapeArticles.py` picks up on its next run so only the missing results are requested again.
+#
+# Usage: `python verifyArticles.py biden/data/articles.jsonl [--repairs biden/data/repairs.jsonl] [--json]`
+
+# +
+import os
+import sys
+import json
+import argparse
+
+maxpossibleresults = 10000 # proquest never displays more than 100 pages of 100 results
+# -
+
+# ## Per-Query Bookkeeping
+# Each query keeps a bitmap of the search indices it has seen rather than a list of records, so memory grows with the number of results a query *claims* to have and not with the size of the store.
+
+# +
+# records belonging to the same search are grouped by the event they came from, the query that started them
+# and, for queries too long to run in one search, which part of the split query found them
+def queryKey(record):
+    return (record.get('databaseindex', 0), record['originalquery'], record.get('querypart', 0))
+
+class QueryCoverage(object):
+
+    def __init__(self, record):
+        self.databaseindex = record.get('databaseindex', 0)
+        self.originalquery = record['originalquery']
+        self.querypart = record.get('querypart', 0)
+        self.originalstart = record.get('originalstart')
+        self.originalend = record.get('originalend')
+        self.seen = bytearray()
+        self.records = 0
+        self.duplicates = 0
+        self.counts = {} # parents -> set of resultscount values reported at that depth
+
+    # marks a searchindex as seen, counting it as a duplicate if it was already marked
+    def add(self, record):
+        self.records += 1
+        self.counts.setdefault(int(record['parents']), set()).add(int(record['resultscount']))
+
+        index = int(record['searchindex'])
+        if index >= len(self.seen):
+            self.seen.extend(bytes(max(index + 1 - len(self.seen), len(self.seen))))
+        if self.seen[index]:
+            self.duplicates += 1
+        else:
+            self.seen[index] = 1
+
+    # the true count is whatever the root search (parents == 0) reported; like the inline check we trust the smallest
+    def expected(self):
+        if 0 in self.counts:
+            return min(self.counts[0])
+        return None
+
+    # contiguous runs of missing search indices as [first, last] pairs; without a root search none of the
+    # results it shows are stored, so every index it could show is missing
+    def gaps(self):
+        expected = self.expected()
+        if expected is None:
+            expected = maxpossibleresults
+        seen = self.seen[:expected + 1].ljust(expected + 1, b'\0')
+        gaps = []
+        first = seen.find(0, 1)
+        while first != -1:
+            last = seen.find(1, first)
+            if last == -1:
+                last = expected + 1
+            gaps.append([first, last - 1])
+            first = seen.find(0, last)
+        return gaps
+
+    # the missing search indices as a set, as the scraper's `missing` meta wants them
+    def missing(self):
+        return {index for first, last in self.gaps() for index in range(first, last + 1)}
+
+    # every way the reported counts disagree with each other or with what we stored
+    def mismatches(self):
+        problems = []
+        expected = self.expected()
+        if expected is None:
+            problems.append('no root search (parents == 0) stored')
+            return problems
+        if len(self.counts[0]) > 1:
+            problems.append('root search reported differing counts {}'.format(sorted(self.counts[0])))
+        for parents in sorted(self.counts):
+            if parents == 0:
+                continue
+            if parents - 1 not in self.counts:
+                problems.append('continuation depth {} stored without depth {}'.format(parents, parents - 1))
+            if max(self.counts[parents]) > expected:
+                problems.append('continuation depth {} reported {} results, more than the root count {}'.format(
+                    parents, max(self.counts[parents]), expected))
+        if expected > maxpossibleresults and max(self.counts) == 0:
+            problems.append('root count {} exceeds the {} display cap but no continuation search was stored'.format(
+                expected, maxpossibleresults))
+        beyond = sum(self.seen[expected + 1:])
+        if beyond:
+            problems.append('{} search indices beyond the root count {}'.format(beyond, expected))
+        return problems
+
+    def report(self):
+        expected = self.expected()
+        gaps = self.gaps()
+        missing = sum(last - first + 1 for first, last in gaps)
+        return {'databaseindex': self.databaseindex, 'originalquery': self.originalquery, 'querypart': self.querypart,
+                'expected': expected, 'records': self.records, 'unique': sum(self.seen), 'duplicates': self.duplicates,
+                'missing': missing, 'coverage': (expected - missing) / expected if expected else None,
+                'gaps': gaps, 'mismatches': self.mismatches()}
+
+    # the job the scraper needs to run to fill this query's gaps
+    def repair(self):
+        return {'databaseindex': self.databaseindex, 'originalquery': self.originalquery, 'querypart': self.querypart,
+                'originalstart': self.originalstart, 'originalend': self.originalend, 'missing': self.gaps()}
+
+
+# -
+
+# ## Streaming Over the Store
+
+# +
+def verifyStore(path):
+    coverage = {}
+    malformed = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                key = queryKey(record)
+            except (ValueError, KeyError):
+                malformed += 1
+                continue
+            if key not in coverage:
+                coverage[key] = QueryCoverage(record)
+            try:
+                coverage[key].add(record)
+            except (KeyError, TypeError, ValueError):
+                malformed += 1
+    return coverage, malformed
+
+def writeRepairs(coverage, path):
+    jobs = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for query in coverage.values():
+            repair = query.repair()
+            if repair['missing']:
+                f.write(json.dumps(repair) + '\n')
+                jobs += 1
+    return jobs
+
+# repair files list ranges; the scraper wants the set of missing search indices for each query
+def loadRepairs(path):
+    repairs = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                job = json.loads(line)
+                missing = set()
+                for first, last in job['missing']:
+                    missing.update(range(first, last + 1))
+                repairs[queryKey(job)] = missing
+    return repairs
+
+
+# -
+
+# ## Command Line
+
+# +
+def main(argv=None):
+    args = argparse.ArgumentParser(description='Check an articles.jsonl store for completeness.')
+    args.add_argument('store', help='path to articles.jsonl')
+    args.add_argument('--repairs', help='where to write the repair job list (default: repairs.jsonl next to the store)')
+    args.add_argument('--json', action='store_true', help='print the per-query report as JSON lines')
+    args = args.parse_args(argv)
+
+    coverage, malformed = verifyStore(args.store)
+    repairs = args.repairs or os.path.join(os.path.dirname(args.store), 'repairs.jsonl')
+    jobs = writeRepairs(coverage, repairs)
+
+    complete = True
+    for query in coverage.values():
+        report = query.report()
+        complete = complete and not report['missing'] and not report['duplicates'] and not report['mismatches']
+        if args.json:
+            print(json.dumps(report))
+            continue
+        print('[{databaseindex}] {originalquery}'.format(**report) + (' (part {querypart})'.format(**report) if report['querypart'] else ''))
+        print('    {unique}/{expected} unique results stored ({records} records, {duplicates} duplicates, {missing} missing)'.format(**report))
+        if report['gaps']:
+            print('    gaps: ' + ', '.join('{}-{}'.format(first, last) if first != last else str(first) for first, last in report['gaps'][:10])
+                  + (' ...' if len(report['gaps']) > 10 else ''))
+        for problem in report['mismatches']:
+            print('    mismatch: ' + problem)
+
+    if malformed:
+        print('{} malformed records skipped'.format(malformed), file=sys.stderr)
+    print('{} repair jobs written to {}'.format(jobs, repairs), file=sys.stderr)
+    return 0 if complete and not malformed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())